@@ -0,0 +1,275 @@
+"""批量评测：在 asyncio 上并发运行多个迷宫回合，统计成功率、步数、LLM调用、token消耗和耗时"""
+
+import os
+import sys
+import csv
+import time
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from llm_client import AsyncLLMClient, OUTPUT_MODES, episode_usage
+from decision_cache import DecisionCache
+from episode_record import EpisodeRecorder
+from event_log import LOG_LEVELS, configure_logging, shutdown_logging
+from maze_engine import MazeEngine, MazeGenerator
+from maze_store import MazeStore, build_corpus
+from metrics import EPISODE_FIELDS, PHASES, metrics, print_latency_stats, print_phase_stats
+
+# 加载 .env 文件
+load_dotenv()
+
+CSV_FIELDS = [
+    "episode", "algorithm", "width", "height", "seed", "won", "steps", "decisions", "llm_calls", "errors",
+    "prompt_tokens", "cached_tokens", "completion_tokens", "elapsed",
+]
+# 回合指标中不与上面重复的字段（API调用次数、缓存命中、解析回退、非法移动、分阶段耗时等）
+CSV_FIELDS += [field for field in EPISODE_FIELDS if field not in CSV_FIELDS]
+
+
+def parse_sizes(text: str) -> List[Tuple[int, int]]:
+    """解析迷宫尺寸列表，如 "21x21,31x31" """
+    sizes = []
+    for item in text.split(","):
+        width, _, height = item.strip().lower().partition("x")
+        sizes.append((int(width), int(height or width)))
+    return sizes
+
+
+def build_specs(episodes: int, sizes: List[Tuple[int, int]], seed_start: int,
+                algorithm: str = "backtracker") -> List[Dict[str, Any]]:
+    """生成回合列表：尺寸依次轮换，种子从 seed_start 开始递增"""
+    return build_corpus(episodes, sizes, algorithm, seed_start)
+
+
+async def run_batch(
+    specs: List[Dict[str, int]],
+    llm_client: Optional[AsyncLLMClient] = None,
+    concurrency: int = 8,
+    max_steps: Optional[int] = None,
+    algorithm: str = "backtracker",
+    window_size: Optional[int] = None,
+    plan_length: int = 1,
+    record_dir: Optional[str] = None,
+    maze_store: Optional[MazeStore] = None
+) -> List[Dict[str, Any]]:
+    """
+    并发运行一组回合
+
+    每个回合在自己的任务中运行，最多 concurrency 个回合同时等待LLM回复；
+    所有回合共用同一个LLM客户端（同一个连接池和决策缓存）。
+
+    Args:
+        specs: 回合列表，每项包含 width、height、seed，以及可选的 algorithm（覆盖 algorithm 参数）
+        llm_client: 异步LLM客户端，为None时使用本地策略
+        concurrency: 最大并发回合数
+        max_steps: 每回合最大决策次数
+        algorithm: 迷宫生成算法（回合未指定时使用）
+        window_size: 局部视野大小
+        plan_length: 规划模式每次最多返回的步数
+        record_dir: 设置后把每个回合录制为 record_dir/episode_NNNN.jsonl.gz
+        maze_store: 迷宫库，设置后从库中取迷宫
+
+    Returns:
+        按 specs 顺序排列的回合统计
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(index: int, spec: Dict[str, Any]) -> Dict[str, Any]:
+        async with semaphore:
+            # 每个生成器使用自己的种子，与并发回合的执行顺序无关
+            engine = MazeEngine(
+                maze_width=spec["width"],
+                maze_height=spec["height"],
+                verbose=False,
+                algorithm=spec.get("algorithm", algorithm),
+                window_size=window_size,
+                plan_length=plan_length,
+                seed=spec["seed"],
+                maze_store=maze_store
+            )
+            engine.episode = index
+            if record_dir:
+                engine.recorder = EpisodeRecorder()
+                engine.recorder.start(engine)
+            # 每个任务有独立的上下文，token用量按回合分别累计
+            usage = {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+            episode_usage.set(usage)
+            result = await engine.run_episode_async(llm_client, max_steps)
+        result.update(episode=index, **spec, **usage)
+        if engine.recorder is not None:
+            engine.recorder.save(os.path.join(record_dir, f"episode_{index:04d}.jsonl.gz"), result)
+        return result
+
+    return await asyncio.gather(*(run_one(i, spec) for i, spec in enumerate(specs)))
+
+
+def write_csv(path: str, results: List[Dict[str, Any]]):
+    """将每个回合的统计写入CSV文件"""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for result in results:
+            row = {**dict.fromkeys(EPISODE_FIELDS, 0), **result.get("metrics", {}), **result}
+            for phase in PHASES:
+                row[f"time_{phase}"] = f"{row[f'time_{phase}']:.6f}"
+            writer.writerow({**row, "elapsed": f"{result['elapsed']:.3f}"})
+
+
+def print_summary(results: List[Dict[str, Any]], wall_time: float):
+    """输出汇总统计"""
+    if not results:
+        return
+    count = len(results)
+    wins = sum(1 for r in results if r["won"])
+    print(f"成功率: {wins}/{count}")
+    print(f"平均步数: {sum(r['steps'] for r in results) / count:.1f}")
+    print(f"平均LLM调用次数: {sum(r['llm_calls'] for r in results) / count:.1f}")
+    print(f"出错次数: {sum(r['errors'] for r in results)}")
+    prompt_tokens = sum(r["prompt_tokens"] for r in results)
+    cached_tokens = sum(r["cached_tokens"] for r in results)
+    completion_tokens = sum(r["completion_tokens"] for r in results)
+    print(f"输入token: {prompt_tokens} (缓存命中 {cached_tokens}), 输出token: {completion_tokens}")
+    episode_time = sum(r["elapsed"] for r in results)
+    print(f"总耗时: {wall_time:.2f} 秒 (各回合耗时之和 {episode_time:.2f} 秒)")
+    if wall_time > 0:
+        print(f"回合速度: {count / wall_time * 60:.0f} 回合/分钟")
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="迷宫批量评测：并发运行多个回合并输出统计")
+    parser.add_argument("--episodes", type=int, default=20, help="运行的回合数")
+    parser.add_argument("--sizes", default="21x21", help="迷宫尺寸列表，逗号分隔并依次轮换，如 21x21,31x31")
+    parser.add_argument("--seed-start", type=int, default=0, help="第一个回合的随机种子，之后依次加1")
+    parser.add_argument("--corpus", metavar="NAME", default=None,
+                        help="使用迷宫库中的命名语料（覆盖 --episodes、--sizes、--seed-start 和 --algorithm）；"
+                             "语料不存在时按这些参数创建")
+    parser.add_argument("--maze-store", metavar="PATH", default=None,
+                        help="迷宫库的SQLite文件（使用 --corpus 时默认为 mazes.db）")
+    parser.add_argument("--concurrency", type=int, default=8, help="最大并发回合数")
+    parser.add_argument("--max-steps", type=int, default=None, help="每回合的最大决策次数")
+    parser.add_argument("--algorithm", choices=MazeGenerator.ALGORITHMS, default="backtracker",
+                        help="迷宫生成算法：backtracker（递归回溯）或 eller（逐行生成）")
+    parser.add_argument("--window-size", type=int, default=None,
+                        help="局部视野大小k：只向LLM发送玩家周围 k×k 的地图")
+    parser.add_argument("--plan-length", type=int, default=1,
+                        help="规划模式：每次LLM调用最多返回多少步路径")
+    parser.add_argument("--decision-cache", metavar="PATH", default=None,
+                        help="启用LLM决策缓存并持久化到SQLite文件")
+    parser.add_argument("--timeout", type=float, default=30.0, help="单次LLM请求的超时时间（秒）")
+    parser.add_argument("--max-retries", type=int, default=2, help="超时、限流和服务端错误的最大重试次数")
+    parser.add_argument("--hedge", action="store_true",
+                        help="启用对冲请求：请求超过p95耗时仍未返回时再发送一个相同请求，采用先返回的结果")
+    parser.add_argument("--hedge-after", type=float, default=None,
+                        help="固定的对冲阈值（秒），不设置时使用最近请求耗时的p95")
+    parser.add_argument("--stream", action="store_true",
+                        help="流式模式：边接收边解析，收到完整的决策JSON后立即关闭连接")
+    parser.add_argument("--output-mode", choices=OUTPUT_MODES, default="coordinate",
+                        help="LLM输出模式：coordinate（坐标JSON）、direction（结构化输出的方向枚举）或 tool（工具调用返回方向）")
+    parser.add_argument("--local", action="store_true", help="不调用LLM，使用本地策略（用于测试评测流程本身）")
+    parser.add_argument("--output", default=None, help="将每个回合的统计写入CSV文件")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default="info",
+                        help="控制台日志级别，warning 及以上时每步几乎没有控制台输出")
+    parser.add_argument("--metrics-file", metavar="PATH", default=None,
+                        help="结束时将分阶段耗时直方图和计数器以Prometheus文本格式写入文件")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="运行期间在本地端口提供 /metrics HTTP端点（Prometheus文本格式）")
+    parser.add_argument("--log-jsonl", metavar="PATH", default=None,
+                        help="将每个决策（位置、选择、耗时、token用量、解析路径）作为一条JSON记录写入文件")
+    parser.add_argument("--record", metavar="DIR", default=None,
+                        help="将每个回合（迷宫、移动序列和决策元数据）录制到目录中，可用 replay.py 回放")
+    return parser.parse_args()
+
+
+def create_async_client(args) -> AsyncLLMClient:
+    """从环境变量创建异步LLM客户端"""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        print("错误: 批量评测需要设置 OPENAI_API_KEY，或使用 --local 以本地策略运行")
+        sys.exit(1)
+
+    base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1/")
+    model = os.getenv("LLM_MODEL", "gpt-4o")
+    decision_cache = DecisionCache(db_path=args.decision_cache) if args.decision_cache else None
+    return AsyncLLMClient(
+        api_key=api_key,
+        base_url=base_url,
+        model=model,
+        decision_cache=decision_cache,
+        verbose=False,
+        timeout=args.timeout,
+        max_retries=args.max_retries,
+        hedge=args.hedge,
+        hedge_after=args.hedge_after,
+        stream=args.stream,
+        output_mode=args.output_mode
+    )
+
+
+async def main_async(args):
+    """运行批量评测"""
+    specs = build_specs(args.episodes, parse_sizes(args.sizes), args.seed_start, args.algorithm)
+    maze_store = None
+    if args.maze_store or args.corpus:
+        maze_store = MazeStore(db_path=args.maze_store or "mazes.db")
+    if args.corpus:
+        corpus = maze_store.corpus(args.corpus)
+        if corpus is None:
+            maze_store.create_corpus(args.corpus, specs)
+            print(f"已创建语料 {args.corpus}: {len(specs)} 个迷宫")
+        else:
+            specs = corpus
+            print(f"使用语料 {args.corpus}: {len(specs)} 个迷宫")
+    llm_client = None if args.local else create_async_client(args)
+    solver = f"LLM ({llm_client.model})" if llm_client else "本地策略"
+    sizes = ",".join(dict.fromkeys(f"{spec['width']}x{spec['height']}" for spec in specs))
+    print(f"批量评测: {len(specs)} 个回合, 尺寸 {sizes}, 并发 {args.concurrency}, 求解器: {solver}")
+
+    start_time = time.perf_counter()
+    try:
+        results = await run_batch(
+            specs,
+            llm_client=llm_client,
+            concurrency=args.concurrency,
+            max_steps=args.max_steps,
+            algorithm=args.algorithm,
+            window_size=args.window_size,
+            plan_length=args.plan_length,
+            record_dir=args.record,
+            maze_store=maze_store
+        )
+    finally:
+        if llm_client:
+            await llm_client.close()
+    wall_time = time.perf_counter() - start_time
+
+    print_summary(results, wall_time)
+    if llm_client:
+        print_latency_stats(llm_client)
+    print_phase_stats()
+    if llm_client and llm_client.decision_cache:
+        cache = llm_client.decision_cache.stats()
+        print(f"决策缓存: 命中 {cache['hits']} 次, 未命中 {cache['misses']} 次, 命中率 {cache['hit_rate']:.1%}")
+    if args.output:
+        write_csv(args.output, results)
+        print(f"已写入 {args.output}")
+
+
+def main():
+    """主函数"""
+    args = parse_args()
+    configure_logging(args.log_level, args.log_jsonl)
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port)
+        print(f"指标端点: http://127.0.0.1:{args.metrics_port}/metrics")
+    try:
+        asyncio.run(main_async(args))
+    finally:
+        if args.metrics_file:
+            metrics.write_textfile(args.metrics_file)
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    main()
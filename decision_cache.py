@@ -0,0 +1,161 @@
+"""LLM决策缓存：内存LRU + 可选SQLite持久化，相同迷宫、相同局部状态时跳过付费的API调用"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Container, Optional, Tuple
+
+
+class DecisionCache:
+    """
+    LLM决策缓存
+
+    键由模型名称、迷宫布局的哈希、当前位置、目标位置和归一化的局部访问掩码组成，
+    不包含完整的移动历史，所以重放同一个迷宫或以相同的邻域状态回到同一位置时都能命中。
+    内存中按LRU淘汰；指定 db_path 时同时写入SQLite，重启后仍然有效。
+    """
+
+    def __init__(self, max_entries: int = 10000, db_path: Optional[str] = None, mask_radius: int = 1):
+        """
+        初始化决策缓存
+
+        Args:
+            max_entries: 内存中最多保留的条目数，超出时淘汰最久未使用的条目
+            db_path: SQLite数据库文件路径，为None时只使用内存缓存
+            mask_radius: 局部访问掩码的半径，1表示当前位置周围3x3的范围
+        """
+        self.max_entries = max_entries
+        self.mask_radius = mask_radius
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        # LLM请求可能在工作线程中进行，所有访问都需要加锁
+        self._lock = threading.Lock()
+        # 迷宫布局哈希的单条记忆：同一迷宫的静态地图是同一个字符串对象，不必每步重新哈希
+        self._last_layout: Optional[str] = None
+        self._last_layout_digest = ""
+
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS decisions (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._db.commit()
+
+    def _layout_digest(self, layout: str) -> str:
+        """计算迷宫布局文本的哈希"""
+        if layout is not self._last_layout:
+            self._last_layout_digest = hashlib.blake2b(layout.encode("utf-8"), digest_size=16).hexdigest()
+            self._last_layout = layout
+        return self._last_layout_digest
+
+    def visited_mask(self, current_pos: Tuple[int, int], visited: Container[Tuple[int, int]]) -> str:
+        """
+        计算当前位置周围 (2r+1)x(2r+1) 范围内的访问掩码
+
+        只与相对位置有关，与访问顺序和次数无关，例如 "010110000"
+
+        Args:
+            visited: 支持 in 查询的访问记录（如 VisitIndex 或集合）
+        """
+        x, y = current_pos
+        r = self.mask_radius
+        return "".join(
+            "1" if (x + dx, y + dy) in visited else "0"
+            for dy in range(-r, r + 1)
+            for dx in range(-r, r + 1)
+        )
+
+    def make_key(
+        self,
+        model: str,
+        kind: str,
+        layout: str,
+        current_pos: Tuple[int, int],
+        target_pos: Tuple[int, int],
+        visited: Container[Tuple[int, int]],
+        extra: str = ""
+    ) -> str:
+        """
+        生成缓存键
+
+        Args:
+            model: 模型名称，不同模型的决策分开缓存
+            kind: 请求类型，如 "move" 或 "plan:8"
+            layout: 迷宫布局文本（静态地图）
+            current_pos: 当前位置
+            target_pos: 目标位置
+            visited: 访问记录，只用于计算局部访问掩码
+            extra: 其他会影响决策的状态（如输出模式、局部视野）
+        """
+        parts = [
+            model,
+            kind,
+            self._layout_digest(layout),
+            f"{current_pos[0]},{current_pos[1]}",
+            f"{target_pos[0]},{target_pos[1]}",
+            self.visited_mask(current_pos, visited),
+            hashlib.blake2b(extra.encode("utf-8"), digest_size=8).hexdigest() if extra else "",
+        ]
+        return "|".join(parts)
+
+    def get(self, key: str, valid: Optional[Callable[[Any], bool]] = None) -> Optional[Any]:
+        """
+        查询缓存，未命中时返回None
+
+        Args:
+            valid: 检查缓存的决策在当前状态下是否仍然可用，返回False时按未命中处理
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            elif self._db is not None:
+                row = self._db.execute("SELECT value FROM decisions WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value = row[0]
+                    self._remember(key, value)
+            decision = json.loads(value) if value is not None else None
+            if decision is None or (valid is not None and not valid(decision)):
+                self.misses += 1
+                return None
+            self.hits += 1
+        return decision
+
+    def skip(self):
+        """记录一次绕过缓存的查询（如检测到循环时），按未命中计入统计"""
+        with self._lock:
+            self.misses += 1
+
+    def put(self, key: str, decision: Any):
+        """写入缓存（决策需要可以被JSON序列化）"""
+        value = json.dumps(decision)
+        with self._lock:
+            self._remember(key, value)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO decisions (key, value) VALUES (?, ?)", (key, value))
+                self._db.commit()
+
+    def _remember(self, key: str, value: str):
+        """写入内存LRU，超出容量时淘汰最久未使用的条目"""
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """返回命中统计"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
+
+    def close(self):
+        """关闭SQLite连接"""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,177 @@
+"""回合录制：把迷宫布局、移动序列和每个决策的元数据保存为紧凑的回合文件，供事后回放"""
+
+import base64
+import gzip
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from maze_engine import Direction, MazeGenerator, MazeGrid
+
+FORMAT = "maze-episode"
+VERSION = 1
+
+# 方向的2位编码，顺序与 Direction 枚举一致：UP=0, DOWN=1, LEFT=2, RIGHT=3
+DIRECTIONS = [direction.value for direction in Direction]
+DIRECTION_CODES = {delta: code for code, delta in enumerate(DIRECTIONS)}
+
+# 文本地图的字符（0=通道, 1=墙）
+_MAP_CHARS = bytes.maketrans(b"\x00\x01", b".W")
+
+# 决策元数据中不需要保存的字段（录制文件本身已包含回合信息，位置可以由移动序列还原）
+_SKIPPED_FIELDS = ("episode", "new_pos", "won")
+
+
+def pack_moves(codes: bytes) -> bytes:
+    """把方向编码（每个0~3）按每字节4个打包，先出现的移动在高位"""
+    packed = bytearray((len(codes) + 3) // 4)
+    for index, code in enumerate(codes):
+        packed[index >> 2] |= code << (6 - 2 * (index & 3))
+    return bytes(packed)
+
+
+def unpack_moves(data: bytes, count: int) -> bytes:
+    """从 pack_moves() 的结果还原 count 个方向编码"""
+    return bytes((data[index >> 2] >> (6 - 2 * (index & 3))) & 3 for index in range(count))
+
+
+class EpisodeRecorder:
+    """
+    回合录制器
+
+    挂在 MazeEngine.recorder 上，引擎每次移动时调用 on_move，每个决策结束时调用 on_decision。
+    移动只记录方向编码（每步2位）；个别不相邻的跳转（LLM返回远处坐标时）单独记录目标坐标。
+    """
+
+    def __init__(self):
+        self.header: Dict[str, Any] = {}
+        self.codes = bytearray()
+        self.jumps: Dict[int, Tuple[int, int]] = {}
+        self.decisions: List[Dict[str, Any]] = []
+        self._last: Tuple[int, int] = (0, 0)
+
+    def start(self, engine):
+        """开始录制引擎当前的迷宫（在迷宫生成或重置之后、第一步之前调用）"""
+        grid = engine.maze_generator.maze
+        self.header = {
+            "format": FORMAT,
+            "version": VERSION,
+            "width": engine.maze_width,
+            "height": engine.maze_height,
+            "algorithm": engine.algorithm,
+            "seed": engine.seed,
+            "start": (engine.player.x, engine.player.y),
+            "goal": (engine.end_x, engine.end_y),
+            "layout": base64.b64encode(grid.pack()).decode("ascii"),
+        }
+        self.codes = bytearray()
+        self.jumps = {}
+        self.decisions = []
+        self._last = (engine.player.x, engine.player.y)
+
+    def on_move(self, x: int, y: int):
+        """记录一次移动"""
+        code = DIRECTION_CODES.get((x - self._last[0], y - self._last[1]))
+        if code is None:
+            self.jumps[len(self.codes)] = (x, y)
+            code = 0
+        self.codes.append(code)
+        self._last = (x, y)
+
+    def on_decision(self, fields: Dict[str, Any]):
+        """记录一个决策的元数据（来源、选择、解析路径、耗时、token用量等）"""
+        self.decisions.append({key: value for key, value in fields.items() if key not in _SKIPPED_FIELDS})
+
+    def save(self, path: str, result: Optional[Dict[str, Any]] = None):
+        """
+        写入回合文件（gzip压缩的 JSON Lines）
+
+        第一行是回合头：迷宫尺寸、算法、按位打包的布局、打包的移动序列和回合结果；
+        之后每行是一个决策的元数据。
+
+        Args:
+            result: run_episode 返回的回合统计（可选）
+        """
+        header = dict(self.header)
+        header["move_count"] = len(self.codes)
+        header["moves"] = base64.b64encode(pack_moves(self.codes)).decode("ascii")
+        header["jumps"] = {str(index): pos for index, pos in self.jumps.items()}
+        if result is not None:
+            header["result"] = {key: value for key, value in result.items() if key != "metrics"}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            f.write(json.dumps(header, ensure_ascii=False, separators=(",", ":")) + "\n")
+            for decision in self.decisions:
+                f.write(json.dumps(decision, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+class EpisodeRecording:
+    """读取回合文件，还原迷宫和每一步的位置"""
+
+    def __init__(self, header: Dict[str, Any], decisions: List[Dict[str, Any]]):
+        if header.get("format") != FORMAT:
+            raise ValueError("不是回合录制文件")
+        if header.get("version", 0) > VERSION:
+            raise ValueError(f"不支持的录制文件版本: {header['version']}")
+        self.header = header
+        self.decisions = decisions
+        self.width: int = header["width"]
+        self.height: int = header["height"]
+        self.start = tuple(header["start"])
+        self.goal = tuple(header["goal"])
+        self.result: Dict[str, Any] = header.get("result", {})
+        self.positions = self._replay_moves()
+        self._grid: Optional[MazeGrid] = None
+        # 按步数索引决策：产生第 n 步移动（或在第 n 步之后失败）的决策
+        self.decisions_by_step: Dict[int, List[Dict[str, Any]]] = {}
+        for decision in decisions:
+            self.decisions_by_step.setdefault(decision.get("step", 0), []).append(decision)
+
+    @classmethod
+    def load(cls, path: str) -> "EpisodeRecording":
+        """读取回合文件"""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            decisions = [json.loads(line) for line in f if line.strip()]
+        return cls(header, decisions)
+
+    def _replay_moves(self) -> List[Tuple[int, int]]:
+        """从起点按方向编码依次移动，得到第0步到最后一步的位置"""
+        codes = unpack_moves(base64.b64decode(self.header["moves"]), self.header["move_count"])
+        jumps = {int(index): tuple(pos) for index, pos in self.header.get("jumps", {}).items()}
+        x, y = self.start
+        positions = [(x, y)]
+        for index, code in enumerate(codes):
+            if index in jumps:
+                x, y = jumps[index]
+            else:
+                dx, dy = DIRECTIONS[code]
+                x, y = x + dx, y + dy
+            positions.append((x, y))
+        return positions
+
+    @property
+    def steps(self) -> int:
+        """移动步数"""
+        return len(self.positions) - 1
+
+    def maze_generator(self) -> MazeGenerator:
+        """还原录制时的迷宫"""
+        grid = MazeGrid.unpack(self.width, self.height, base64.b64decode(self.header["layout"]))
+        return MazeGenerator.from_grid(grid, self.header.get("algorithm", "backtracker"), self.header.get("seed"),
+                                       self.start, self.goal)
+
+    def render_text(self, step: int) -> str:
+        """第 step 步时的文本地图（W=墙，.=通道，o=已走过，P=玩家，G=终点）"""
+        if self._grid is None:
+            self._grid = self.maze_generator().maze
+        grid = self._grid
+        rows = [bytearray(grid.row_bytes(y).translate(_MAP_CHARS)) for y in range(self.height)]
+        for x, y in self.positions[:step]:
+            rows[y][x] = ord("o")
+        rows[self.goal[1]][self.goal[0]] = ord("G")
+        x, y = self.positions[step]
+        rows[y][x] = ord("P")
+        return "\n".join(row.decode("ascii") for row in rows)
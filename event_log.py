@@ -0,0 +1,118 @@
+"""分级日志与结构化事件：控制台日志按级别过滤，决策事件由后台线程写入 JSONL 文件"""
+
+import atexit
+import json
+import logging
+import queue
+import sys
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional
+
+LOG_LEVELS = ("debug", "info", "warning", "error")
+
+# 控制台日志：引擎、LLM客户端和游戏界面分别使用其子日志器
+logger = logging.getLogger("maze")
+# 结构化事件：不向上传递到控制台，只写入 JSONL 文件；未配置文件时整个事件日志器处于关闭状态
+events = logging.getLogger("maze.events")
+events.propagate = False
+events.setLevel(logging.CRITICAL + 1)
+
+# 当前决策的追踪信息（来源、解析路径、token用量、耗时等），由引擎在请求LLM前设置，
+# LLM客户端在同一上下文中补充字段，最终由引擎写成一条决策事件
+decision_trace: ContextVar[Optional[dict]] = ContextVar("decision_trace", default=None)
+
+_listener: Optional[QueueListener] = None
+
+
+class JSONLHandler(logging.Handler):
+    """
+    将事件写成 JSON Lines 的处理器
+
+    文件使用较大的写缓冲，不在每条记录后刷新；只在后台线程中调用，不阻塞游戏循环。
+    """
+
+    def __init__(self, path: str, buffer_size: int = 1 << 16):
+        super().__init__()
+        self.stream = open(path, "a", encoding="utf-8", buffering=buffer_size)
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            entry = {"ts": round(record.created, 6), "level": record.levelname.lower(), "event": record.getMessage()}
+            entry.update(getattr(record, "fields", {}))
+            self.stream.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.acquire()
+        try:
+            if not self.stream.closed:
+                self.stream.close()
+        finally:
+            self.release()
+            super().close()
+
+
+def configure_logging(level: str = "info", jsonl_path: Optional[str] = None):
+    """
+    配置控制台日志级别和可选的 JSONL 事件文件
+
+    Args:
+        level: 控制台日志级别（debug/info/warning/error），warning 及以上时每步几乎没有控制台输出
+        jsonl_path: 事件文件路径；设置后每个决策写入一条 JSON 记录
+    """
+    global _listener
+    logger.setLevel(getattr(logging, level.upper()))
+    if not logger.handlers:
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(console)
+
+    if jsonl_path and _listener is None:
+        # 生产者只把记录放进队列，格式化和写文件都在监听线程中完成
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        events.addHandler(QueueHandler(records))
+        events.setLevel(logging.INFO)
+        _listener = QueueListener(records, JSONLHandler(jsonl_path))
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """停止后台写入线程，写出缓冲区中剩余的事件并关闭文件"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    events.handlers.clear()
+    events.setLevel(logging.CRITICAL + 1)
+    _listener = None
+
+
+def events_enabled() -> bool:
+    """是否配置了事件文件（未配置时调用方可以跳过组装事件字段）"""
+    return events.isEnabledFor(logging.INFO)
+
+
+def log_event(event: str, **fields: Any):
+    """写入一条结构化事件"""
+    if events.isEnabledFor(logging.INFO):
+        events.info(event, extra={"fields": fields})
+
+
+def trace(**fields: Any):
+    """向当前决策的追踪信息中写入字段（当前上下文没有进行中的决策时忽略）"""
+    current = decision_trace.get()
+    if current is not None:
+        current.update(fields)
+
+
+def trace_add(**counts: int):
+    """累加当前决策的计数字段（如 token 数和调用次数）"""
+    current = decision_trace.get()
+    if current is not None:
+        for key, value in counts.items():
+            current[key] = current.get(key, 0) + value
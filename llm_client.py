@@ -1,15 +1,182 @@
 """LLM客户端，用于获取下一步移动决策"""
 
 import os
+import re
 import json
-from typing import Optional, Tuple, List
-from openai import OpenAI
+import time
+import random
+import asyncio
+import logging
+import contextvars
+import functools
+import threading
+from types import SimpleNamespace
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, TimeoutError as FutureTimeoutError, wait
+from contextvars import ContextVar
+from typing import Deque, Optional, Pattern, Tuple, List
+from decision_cache import DecisionCache
+from event_log import trace, trace_add
+from metrics import metrics
+from maze_engine import VisitIndex
+
+logger = logging.getLogger("maze.llm")
+
+# 当前回合的token用量累计字典。批量评测时每个回合（asyncio任务）各自设置，
+# 多个回合共用同一个客户端时也能分别统计
+episode_usage: ContextVar[Optional[dict]] = ContextVar("episode_usage", default=None)
+
+
+def run_in_daemon_thread(fn, *args, name: str = "llm") -> Future:
+    """
+    在新的守护线程中运行 fn(*args)，返回其结果的 Future
+
+    同步的LLM请求无法中途中断，每个请求使用自己的守护线程：被丢弃的请求不会占住线程池的工作线程、
+    挡住之后的请求，进程退出时也不需要等待它结束。fn 在调用方上下文的副本中运行。
+    """
+    future: Future = Future()
+    context = contextvars.copy_context()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(context.run(fn, *args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return future
+
+
+@functools.lru_cache(maxsize=None)
+def retryable_errors() -> tuple:
+    """
+    可以重试的错误：超时和连接错误（APITimeoutError 是 APIConnectionError 的子类）、429限流、5xx服务端错误
+
+    openai 包导入需要约0.4秒，只在创建API客户端和处理其错误时才导入，手动模式和本地策略不加载。
+    """
+    from openai import APIConnectionError, InternalServerError, RateLimitError
+    return (APIConnectionError, RateLimitError, InternalServerError)
+
+
+# 提示词中列出的最近移动步数
+RECENT_MOVES_IN_PROMPT = 15
+
+# 流式模式下一旦出现完整的决策JSON就可以结束读取，之后的解释文字不再等待
+MOVE_JSON_RE = re.compile(r'\{\s*"x"\s*:\s*-?\d+\s*,\s*"y"\s*:\s*-?\d+\s*\}|\{\s*"y"\s*:\s*-?\d+\s*,\s*"x"\s*:\s*-?\d+\s*\}')
+PLAN_JSON_RE = re.compile(r'\{\s*"path"\s*:\s*\[[^\]]*\]\s*\}')
+DIRECTION_JSON_RE = re.compile(r'\{\s*"direction"\s*:\s*"(UP|DOWN|LEFT|RIGHT)"\s*\}')
+MOVES_JSON_RE = re.compile(r'\{\s*"moves"\s*:\s*\[[^\]]*\]\s*\}')
+
+# 输出模式：coordinate 为自由格式的坐标JSON；direction 使用结构化输出（json_schema）
+# 约束为方向枚举；tool 通过强制调用 maze_move 工具返回方向枚举，用于不支持 json_schema 的服务
+OUTPUT_MODES = ("coordinate", "direction", "tool")
+
+DIRECTION_DELTAS = {"UP": (0, -1), "DOWN": (0, 1), "LEFT": (-1, 0), "RIGHT": (1, 0)}
+DELTA_DIRECTIONS = {delta: direction for direction, delta in DIRECTION_DELTAS.items()}
+
+# 方向枚举固定为四个方向而不是每步的可用方向，保证请求参数逐字节相同、不破坏提示词缓存；
+# 返回的方向在客户端按 available_directions 验证
+DIRECTION_SCHEMA = {
+    "type": "object",
+    "properties": {"direction": {"type": "string", "enum": list(DIRECTION_DELTAS)}},
+    "required": ["direction"],
+    "additionalProperties": False,
+}
+MOVES_SCHEMA = {
+    "type": "object",
+    "properties": {"moves": {"type": "array", "items": {"type": "string", "enum": list(DIRECTION_DELTAS)}}},
+    "required": ["moves"],
+    "additionalProperties": False,
+}
+
+# 系统提示词：每次调用都逐字节相同，与静态迷宫地图一起构成可被服务端缓存的提示词前缀
+SYSTEM_PROMPT = """
+        你是一个迷宫求解助手。根据给定的迷宫状态和当前位置，推理出下一步应该移动到哪个坐标点。
+        重要规则（按优先级排序）：
+        1. 坐标必须是可通行的（不是墙）
+        2. 坐标必须是当前位置的相邻位置（上下左右，距离为1）
+        3. 优先选择未访问过的位置（避免走回头路）
+        4. 尽量朝着目标位置前进（计算曼哈顿距离）
+        5. 只有在所有未访问的相邻位置都不可行时，才允许回溯到已访问的位置（这是最后的选择）
+        6. ⚠️ 绝对禁止重复移动！如果检测到你在来回移动（如左右左右、上下上下），必须立即改变方向，选择不同的路径
+        7. 如果提示词中显示"检测到循环"或"重复模式"，你必须选择与最近移动方向不同的方向，优先选择未访问的位置
+        请只返回坐标，格式为JSON: {"x": 数字, "y": 数字}
+        """
+
+# 规划模式的系统提示词：一次返回多步路径
+PLAN_SYSTEM_PROMPT = SYSTEM_PROMPT.replace(
+    '请只返回坐标，格式为JSON: {"x": 数字, "y": 数字}',
+    '请规划接下来的多步路径，每一步都必须与上一步相邻且可通行，格式为JSON: {"path": [{"x": 数字, "y": 数字}, ...]}'
+)
+
+# 方向模式的系统提示词：只返回一个方向
+DIRECTION_SYSTEM_PROMPT = SYSTEM_PROMPT.replace(
+    '请只返回坐标，格式为JSON: {"x": 数字, "y": 数字}',
+    '请只返回移动方向，格式为JSON: {"direction": "UP" | "DOWN" | "LEFT" | "RIGHT"}'
+)
+PLAN_DIRECTION_SYSTEM_PROMPT = SYSTEM_PROMPT.replace(
+    '请只返回坐标，格式为JSON: {"x": 数字, "y": 数字}',
+    '请规划接下来的多步移动方向，每一步都必须可通行，格式为JSON: {"moves": ["UP" | "DOWN" | "LEFT" | "RIGHT", ...]}'
+)
+
+# 每步提示词末尾的输出格式要求
+COORDINATE_INSTRUCTION = '请返回JSON格式: {"x": 数字, "y": 数字}'
+DIRECTION_INSTRUCTION = '请从可用移动方向中选择一个，返回JSON格式: {"direction": "UP" | "DOWN" | "LEFT" | "RIGHT"}'
+PLAN_DIRECTION_INSTRUCTION = (
+    '请规划从当前位置出发的接下来最多{max_moves}步移动方向：第一步必须是可用移动方向之一，'
+    '之后每一步都不能撞墙，遇到岔路或无法确定时可以提前结束。'
+    '请返回JSON格式: {{"moves": ["UP" | "DOWN" | "LEFT" | "RIGHT", ...]}}'
+)
+PLAN_INSTRUCTION = (
+    '请规划从当前位置出发的接下来最多{max_moves}步路径：第一步必须是当前位置的相邻位置，'
+    '之后每一步都必须与上一步相邻且不是墙，遇到岔路或无法确定时可以提前结束。'
+    '请返回JSON格式: {{"path": [{{"x": 数字, "y": 数字}}, ...]}}'
+)
+
+
+class LatencyTracker:
+    """记录最近若干次请求的耗时，计算分位数"""
+
+    def __init__(self, window: int = 1000):
+        """
+        Args:
+            window: 计算分位数时使用的最近样本数
+        """
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.count = 0
+
+    def record(self, seconds: float):
+        """记录一次耗时（秒）"""
+        self.samples.append(seconds)
+        self.count += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        """最近样本的第p百分位数（最近秩法），没有样本时返回None"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = max(0, min(len(ordered) - 1, int(len(ordered) * p / 100.0 + 0.5) - 1))
+        return ordered[index]
+
+    def summary(self) -> dict:
+        """返回样本数和 p50/p95/p99（秒）"""
+        return {
+            "count": self.count,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
 
 
 class LLMClient:
     """LLM客户端类，用于与AI模型交互获取移动决策"""
 
-    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None, model: str = "gpt-4o"):
+    # 自适应对冲至少需要这么多次成功请求的耗时样本才启用
+    HEDGE_MIN_SAMPLES = 20
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None, model: str = "gpt-4o", decision_cache: Optional[DecisionCache] = None, verbose: bool = True, timeout: float = 30.0, max_retries: int = 2, backoff_base: float = 0.5, backoff_max: float = 8.0, hedge: bool = False, hedge_after: Optional[float] = None, stream: bool = False, output_mode: str = "coordinate"):
         """
         初始化LLM客户端
 
@@ -17,227 +184,746 @@ class LLMClient:
             api_key: OpenAI API密钥，如果为None则从环境变量OPENAI_API_KEY读取
             base_url: API基础URL，如果为None则从环境变量OPENAI_BASE_URL读取，如果都未设置则使用OpenAI默认URL
             model: 使用的模型名称，默认为gpt-4o-mini
+            decision_cache: 决策缓存，命中时直接返回缓存的决策而不调用API
+            verbose: 是否输出详细的推理日志
+            timeout: 单次请求的超时时间（秒）
+            max_retries: 超时、连接错误、429和5xx错误的最大重试次数
+            backoff_base: 指数退避的基础等待时间（秒），第n次重试最多等待 backoff_base * 2^n 秒（随机抖动）
+            backoff_max: 单次退避等待时间的上限（秒）
+            hedge: 是否启用对冲请求：第一个请求超过对冲阈值仍未返回时，再发送一个相同的请求，采用先返回的结果
+            hedge_after: 对冲阈值（秒），为None时使用最近成功请求耗时的p95
+            stream: 是否使用流式响应：边接收边解析，出现完整的决策JSON后立即关闭连接
+            output_mode: 输出模式：coordinate（坐标JSON，适用于任何模型）、direction（结构化输出的方向枚举）
+                或 tool（通过工具调用返回方向枚举）
         """
+        if output_mode not in OUTPUT_MODES:
+            raise ValueError(f"未知的输出模式: {output_mode}，可选: {', '.join(OUTPUT_MODES)}")
         api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("需要提供OpenAI API密钥，可以通过参数传入或设置环境变量OPENAI_API_KEY")
 
         base_url = base_url or os.getenv("OPENAI_BASE_URL")
 
-        # 构建客户端参数
-        client_kwargs = {"api_key": api_key}
+        # 构建客户端参数；重试由本类控制（带抖动的退避和对冲），关闭SDK自带的重试
+        client_kwargs = {"api_key": api_key, "max_retries": 0}
         if base_url:
             client_kwargs["base_url"] = base_url
 
-        self.client = OpenAI(**client_kwargs)
+        self.client = self._create_client(client_kwargs)
         self.model = model
+        self.decision_cache = decision_cache
+        self.verbose = verbose
+
+        # 累计token用量，cached_tokens 为命中服务端提示词缓存的输入token数
+        self.usage_stats = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+        # 提示词平均每个token的字符数，取自最近一次带用量的响应；提前关闭的流收不到用量时用它估算输入token数
+        self._chars_per_token: Optional[float] = None
+
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.stream = stream
+        self.output_mode = output_mode
+        # 单次成功请求的耗时（用于对冲阈值）和每步决策的总耗时（包含重试和对冲）
+        self.attempt_latency = LatencyTracker()
+        self.step_latency = LatencyTracker()
+        self.request_stats = {"retries": 0, "hedges": 0, "hedge_wins": 0, "failures": 0, "early_stops": 0}
 
-    def get_next_move(self, maze_state: str, current_pos: Tuple[int, int], target_pos: Tuple[int, int], move_history: List[Tuple[int, int]], available_directions: List[str], is_looping: bool = False, recent_pattern: str = "") -> Tuple[int, int]:
+    def get_next_move(self, maze_state: str, current_pos: Tuple[int, int], target_pos: Tuple[int, int], visited: VisitIndex, available_directions: List[str], is_looping: bool = False, recent_pattern: str = "", goal_distance: Optional[int] = None, local_view: str = "") -> Tuple[int, int]:
         """
         获取下一步移动坐标
 
+        提示词按"稳定前缀 + 每步后缀"排列：系统提示词和不含玩家位置的静态迷宫地图在前，
+        同一迷宫的每次调用逐字节相同，可以命中服务端的提示词缓存；当前位置、相邻位置和
+        移动历史等每步变化的状态放在最后一条消息中。
+
         Args:
-            maze_state: 迷宫状态的文本描述
+            maze_state: 静态迷宫地图的文本描述（同一迷宫内保持不变，不应包含玩家位置）
             current_pos: 当前位置 (x, y)
             target_pos: 目标位置 (x, y)
-            move_history: 移动历史，包含之前访问过的所有位置
+            visited: 访问记录索引，用于查询位置是否访问过以及最近的移动
             available_directions: 可用的移动方向列表，如 ['UP', 'DOWN', 'LEFT', 'RIGHT']
             is_looping: 是否检测到循环模式
             recent_pattern: 最近移动模式的描述
+            goal_distance: 当前位置沿迷宫路径到目标的距离（来自预计算的距离场），为None时提示中使用曼哈顿距离
+            local_view: 局部视野模式下玩家周围的局部地图及探索摘要，放在每步状态中
 
         Returns:
             下一步的坐标 (x, y)
         """
-        print("\n" + "="*80)
-        print("🤖 LLM 推理开始")
-        print("="*80)
+        request = self._prepare_move(maze_state, current_pos, target_pos, visited, available_directions, is_looping, recent_pattern, goal_distance, local_view)
+        if request["cached"] is not None:
+            return request["cached"]
+        try:
+            content = self._request_completion(request["messages"], request["max_tokens"], request["early_stop"], request["output_format"])
+            return self._parse(self._parse_move, request, content)
+        except Exception as e:
+            raise self._failure(e)
+
+    def get_next_plan(self, maze_state: str, current_pos: Tuple[int, int], target_pos: Tuple[int, int], visited: VisitIndex, available_directions: List[str], is_looping: bool = False, recent_pattern: str = "", goal_distance: Optional[int] = None, local_view: str = "", max_moves: int = 5) -> List[Tuple[int, int]]:
+        """
+        一次调用获取接下来最多 max_moves 步的移动路径（规划模式）
+
+        参数与 get_next_move 相同。返回的路径未经验证，调用方需要逐步检查
+        是否可通行且与上一步相邻，只执行有效的前缀。
+
+        Returns:
+            坐标列表 [(x, y), ...]，至少包含一步
+        """
+        request = self._prepare_plan(maze_state, current_pos, target_pos, visited, available_directions, is_looping, recent_pattern, goal_distance, local_view, max_moves)
+        if request["cached"] is not None:
+            return request["cached"]
+        try:
+            content = self._request_completion(request["messages"], request["max_tokens"], request["early_stop"], request["output_format"])
+            return self._parse(self._parse_plan, request, content)
+        except Exception as e:
+            raise self._failure(e, "LLM 路径规划失败")
+
+    def _create_client(self, client_kwargs: dict):
+        """创建底层API客户端"""
+        from openai import OpenAI
+        return OpenAI(**client_kwargs)
+
+    def _log(self, message: str, level: int = logging.INFO):
+        """输出日志（仅在verbose模式下，是否显示由日志级别决定）"""
+        if self.verbose:
+            logger.log(level, message)
+
+    def _prepare_move(self, maze_state: str, current_pos: Tuple[int, int], target_pos: Tuple[int, int], visited: VisitIndex, available_directions: List[str], is_looping: bool, recent_pattern: str, goal_distance: Optional[int], local_view: str) -> dict:
+        """
+        准备单步决策请求：输出输入信息、查询决策缓存并组装消息
+
+        同步和异步客户端共用，返回的字典中 cached 不为None时表示命中缓存，无需调用API
+        """
+        self._log("\n" + "="*80)
+        self._log("🤖 LLM 推理开始")
+        self._log("="*80)
         
-        # 构建提示词
-        prompt = self._build_prompt(maze_state, current_pos, target_pos, move_history, available_directions, is_looping, recent_pattern)
+        request = {
+            "kind": "move",
+            "current_pos": current_pos,
+            "target_pos": target_pos,
+            "visited": visited,
+            "cache_key": None,
+            "available_directions": available_directions,
+            "cached": None,
+            "messages": None,
+            "max_tokens": 200,
+            "early_stop": MOVE_JSON_RE,
+            "output_format": None,
+        }
         
-        # 打印输入信息
-        print(f"\n📍 当前位置: {current_pos}")
-        print(f"🎯 目标位置: {target_pos}")
-        print(f"📊 已访问位置数量: {len(move_history)}")
-        print(f"🔄 可用移动方向: {', '.join(available_directions)}")
-        # print(f"📏 到目标的曼哈顿距离: {abs(target_pos[0] - current_pos[0]) + abs(target_pos[1] - current_pos[1])}")
+        # 先查询决策缓存
+        cache_key = self._cache_key("move", maze_state, current_pos, target_pos, visited, is_looping, local_view)
+        request["cache_key"] = cache_key
+        if cache_key is not None:
+            cached = self.decision_cache.get(cache_key, lambda pos: self._is_open_step(request, pos))
+            if cached is not None:
+                self._log(f"💾 命中决策缓存: {tuple(cached)}，跳过API调用")
+                trace(parse="cache")
+                metrics.inc("cache_hits")
+                self._log("="*80)
+                request["cached"] = tuple(cached)
+                return request
         
-        # 计算相邻位置信息
-        visited_set = set(move_history)
-        x, y = current_pos
-        adjacent_info = []
-        for dx, dy, direction in [(0, -1, "UP"), (0, 1, "DOWN"), (-1, 0, "LEFT"), (1, 0, "RIGHT")]:
-            adj_x, adj_y = x + dx, y + dy
-            is_visited = (adj_x, adj_y) in visited_set
-            adjacent_info.append((adj_x, adj_y, direction, is_visited))
+        # 构建提示词（稳定前缀 + 每步状态后缀）
+        with metrics.time("prompt"):
+            if self.output_mode == "coordinate":
+                prompt = self._build_prompt(current_pos, target_pos, visited, available_directions, is_looping, recent_pattern, goal_distance, local_view)
+                request["messages"] = self._build_messages(maze_state, prompt)
+            else:
+                prompt = self._build_prompt(
+                    current_pos, target_pos, visited, available_directions, is_looping, recent_pattern,
+                    goal_distance, local_view, output_instruction=DIRECTION_INSTRUCTION
+                )
+                request["messages"] = self._build_messages(maze_state, prompt, DIRECTION_SYSTEM_PROMPT)
+                # {"direction": "RIGHT"} 只有几个token
+                request["max_tokens"] = 20
+                request["early_stop"] = DIRECTION_JSON_RE
+                request["output_format"] = self._output_format(DIRECTION_SCHEMA)
         
-        print(f"\n🔍 相邻位置分析:")
-        for adj_x, adj_y, direction, is_visited in adjacent_info:
-            status = "✅ 未访问" if not is_visited else "⚠️  已访问"
-            print(f"   {direction}: ({adj_x}, {adj_y}) - {status}")
+        # 打印输入信息
+        self._log(f"\n📍 当前位置: {current_pos}")
+        self._log(f"🎯 目标位置: {target_pos}")
+        self._log(f"📊 已访问位置数量: {len(visited)}")
+        self._log(f"🔄 可用移动方向: {', '.join(available_directions)}")
+        if goal_distance is not None:
+            self._log(f"📏 到目标的路径距离: {goal_distance}")
         
-        # 打印系统提示词摘要
-        system_prompt = """
-        你是一个迷宫求解助手。根据给定的迷宫状态和当前位置，推理出下一步应该移动到哪个坐标点。
-        重要规则（按优先级排序）：
-        1. 坐标必须是可通行的（不是墙）
-        2. 坐标必须是当前位置的相邻位置（上下左右，距离为1）
-        3. 优先选择未访问过的位置（避免走回头路）
-        4. 尽量朝着目标位置前进（计算曼哈顿距离）
-        5. 只有在所有未访问的相邻位置都不可行时，才允许回溯到已访问的位置（这是最后的选择）
-        6. ⚠️ 绝对禁止重复移动！如果检测到你在来回移动（如左右左右、上下上下），必须立即改变方向，选择不同的路径
-        7. 如果提示词中显示"检测到循环"或"重复模式"，你必须选择与最近移动方向不同的方向，优先选择未访问的位置
-        请只返回坐标，格式为JSON: {"x": 数字, "y": 数字}
-        """
+        if self.verbose:
+            # 计算相邻位置信息
+            x, y = current_pos
+            self._log(f"\n🔍 相邻位置分析:")
+            for dx, dy, direction in [(0, -1, "UP"), (0, 1, "DOWN"), (-1, 0, "LEFT"), (1, 0, "RIGHT")]:
+                adj_x, adj_y = x + dx, y + dy
+                status = "✅ 未访问" if (adj_x, adj_y) not in visited else "⚠️  已访问"
+                self._log(f"   {direction}: ({adj_x}, {adj_y}) - {status}")
         
         if is_looping:
-            print(f"\n⚠️  循环检测警告: 检测到重复移动模式")
-            print(f"   {recent_pattern}")
+            self._log(f"\n⚠️  循环检测警告: 检测到重复移动模式")
+            self._log(f"   {recent_pattern}")
         
-        print(f"\n⏳ 正在调用 LLM API...")
+        self._log(f"\n⏳ 正在调用 LLM API...")
+        return request
+
+    def _parse(self, parser, request: dict, content: str):
+        """调用解析函数并统计解析耗时和失败次数"""
+        start_time = time.perf_counter()
+        try:
+            return parser(request, content)
+        except Exception:
+            metrics.inc("parse_failures")
+            raise
+        finally:
+            metrics.observe("parse", time.perf_counter() - start_time)
+
+    def _parse_move(self, request: dict, content: str) -> Tuple[int, int]:
+        """解析单步决策的响应文本，JSON解析失败时尝试从文本中提取数字"""
+        if self.output_mode != "coordinate":
+            return self._parse_direction(request, content)
+        current_pos = request["current_pos"]
+        target_pos = request["target_pos"]
+        visited = request["visited"]
 
+        # 尝试提取JSON
+        self._log(f"\n🔍 开始解析响应...")
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": system_prompt,
+            json_str = self._extract_json_str(content)
+            self._log(f"   提取的JSON字符串: {json_str}")
+            result = json.loads(json_str)
+            self._log(f"   ✅ JSON解析成功: {result}")
+            trace(parse="json")
+            
+            next_x = int(result["x"])
+            next_y = int(result["y"])
+            next_pos = (next_x, next_y)
+        except (json.JSONDecodeError, KeyError, ValueError, TypeError) as e:
+            self._log(f"   ❌ JSON解析失败: {e}")
+            self._log(f"   尝试使用正则表达式提取数字...")
+            # 如果JSON解析失败，尝试从文本中提取数字
+            numbers = re.findall(r"\d+", content)
+            if len(numbers) >= 2:
+                extracted_pos = (int(numbers[0]), int(numbers[1]))
+                self._log(f"   ✅ 从文本中提取到坐标: {extracted_pos}")
+                trace(parse="regex")
+                metrics.inc("parse_fallbacks")
+                self._log("="*80)
+                self._log("🤖 LLM 推理完成\n")
+                return extracted_pos
+            self._log(f"   ❌ 无法从响应中提取有效坐标")
+            raise ValueError(f"无法解析LLM响应: {content}")
+        
+        self._log(f"\n🎯 解析结果:")
+        self._log(f"   下一步坐标: ({next_x}, {next_y})")
+        
+        # 验证返回的位置是否是已访问的位置
+        if next_pos in visited:
+            self._log(f"   ⚠️  注意: LLM选择回溯到已访问位置 ({next_x}, {next_y})")
+        else:
+            self._log(f"   ✅ 下一步移动到未访问位置: ({next_x}, {next_y})")
+        
+        # 验证是否是相邻位置
+        distance = abs(next_x - current_pos[0]) + abs(next_y - current_pos[1])
+        if distance == 1:
+            self._log(f"   ✅ 验证通过: 是相邻位置 (距离=1)")
+        else:
+            self._log(f"   ⚠️  警告: 不是相邻位置 (距离={distance})")
+        
+        # 计算到目标的新距离
+        new_distance = abs(target_pos[0] - next_x) + abs(target_pos[1] - next_y)
+        old_distance = abs(target_pos[0] - current_pos[0]) + abs(target_pos[1] - current_pos[1])
+        distance_change = new_distance - old_distance
+        if distance_change < 0:
+            self._log(f"   ✅ 距离目标更近了 (减少 {abs(distance_change)} 步)")
+        elif distance_change > 0:
+            self._log(f"   ⚠️  距离目标更远了 (增加 {distance_change} 步)")
+        else:
+            self._log(f"   ➡️  距离目标不变")
+
+        self._log("="*80)
+        self._log("🤖 LLM 推理完成\n")
+        
+        self._cache_decision(request, next_pos, next_pos)
+        return next_pos
+
+    def _parse_direction(self, request: dict, content: str) -> Tuple[int, int]:
+        """
+        解析方向模式的响应，返回移动后的坐标
+
+        方向必须是本步可用的方向之一，否则抛出异常，由调用方回退到本地策略，
+        不会像坐标模式的数字提取那样把错误的坐标当作移动目标。
+        """
+        self._log(f"\n🔍 开始解析方向...")
+        match = DIRECTION_JSON_RE.search(content)
+        if match is None:
+            raise ValueError(f"无法解析LLM响应: {content}")
+        direction = match.group(1)
+        if direction not in request["available_directions"]:
+            raise ValueError(f"LLM选择的方向 {direction} 不可通行，可用方向: {', '.join(request['available_directions'])}")
+
+        dx, dy = DIRECTION_DELTAS[direction]
+        next_pos = (request["current_pos"][0] + dx, request["current_pos"][1] + dy)
+        self._log(f"   ✅ 方向: {direction} -> 下一步坐标: {next_pos}")
+        trace(parse=self.output_mode)
+        if next_pos in request["visited"]:
+            self._log(f"   ⚠️  注意: LLM选择回溯到已访问位置 {next_pos}")
+        self._log("="*80)
+        self._log("🤖 LLM 推理完成\n")
+
+        self._cache_decision(request, next_pos, next_pos)
+        return next_pos
+
+    def _output_format(self, schema: dict) -> dict:
+        """方向模式下约束输出格式的请求参数：结构化输出或强制的工具调用"""
+        if self.output_mode == "tool":
+            return {
+                "tools": [{
+                    "type": "function",
+                    "function": {
+                        "name": "maze_move",
+                        "description": "在迷宫中移动",
+                        "parameters": schema,
+                        "strict": True,
                     },
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.3,  # 降低随机性，使决策更稳定
-                max_tokens=200,
+                }],
+                "tool_choice": {"type": "function", "function": {"name": "maze_move"}},
+            }
+        return {
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": "maze_move", "strict": True, "schema": schema},
+            },
+        }
+
+    def _prepare_plan(self, maze_state: str, current_pos: Tuple[int, int], target_pos: Tuple[int, int], visited: VisitIndex, available_directions: List[str], is_looping: bool, recent_pattern: str, goal_distance: Optional[int], local_view: str, max_moves: int) -> dict:
+        """准备规划请求：输出输入信息、查询决策缓存并组装消息"""
+        self._log("\n" + "="*80)
+        self._log(f"🤖 LLM 路径规划开始 (最多 {max_moves} 步)")
+        self._log("="*80)
+        self._log(f"\n📍 当前位置: {current_pos}")
+        self._log(f"🎯 目标位置: {target_pos}")
+        self._log(f"🔄 可用移动方向: {', '.join(available_directions)}")
+
+        request = {
+            "kind": "plan",
+            "current_pos": current_pos,
+            "target_pos": target_pos,
+            "visited": visited,
+            "max_moves": max_moves,
+            "available_directions": available_directions,
+            "cache_key": None,
+            "cached": None,
+            "messages": None,
+            # 每步最多约20个token
+            "max_tokens": max(200, 20 * max_moves + 50),
+            "early_stop": PLAN_JSON_RE,
+            "output_format": None,
+        }
+
+        # 先查询决策缓存
+        cache_key = self._cache_key(f"plan:{max_moves}", maze_state, current_pos, target_pos, visited, is_looping, local_view)
+        request["cache_key"] = cache_key
+        if cache_key is not None:
+            cached = self.decision_cache.get(
+                cache_key, lambda plan: isinstance(plan, list) and bool(plan) and self._is_open_step(request, plan[0])
             )
+            if cached is not None:
+                plan = [tuple(step) for step in cached]
+                trace(parse="cache")
+                metrics.inc("cache_hits")
+                self._log(f"💾 命中决策缓存: {plan}，跳过API调用")
+                self._log("="*80)
+                request["cached"] = plan
+                return request
 
-            # 打印API响应信息
-            print(f"✅ LLM API 调用成功")
-            print(f"📊 响应统计:")
-            print(f"   - 使用的模型: {response.model}")
-            print(f"   - 完成原因: {response.choices[0].finish_reason}")
-            if hasattr(response, 'usage') and response.usage:
-                print(f"   - 输入token数: {response.usage.prompt_tokens}")
-                print(f"   - 输出token数: {response.usage.completion_tokens}")
-                print(f"   - 总token数: {response.usage.total_tokens}")
-
-            # 解析响应
-            content = response.choices[0].message.content
-            if content is None:
-                raise ValueError("LLM返回的响应内容为空")
-            content = content.strip()
-            print(f"\n📨 原始响应内容:")
-            print(f"   {content}")
-
-            # 尝试提取JSON
-            print(f"\n🔍 开始解析响应...")
-            try:
-                # 如果响应包含JSON代码块，提取它
-                if "```json" in content:
-                    print(f"   检测到 JSON 代码块 (```json)")
-                    json_str = content.split("```json")[1].split("```")[0].strip()
-                elif "```" in content:
-                    print(f"   检测到代码块 (```)")
-                    json_str = content.split("```")[1].split("```")[0].strip()
-                else:
-                    print(f"   直接使用响应内容作为JSON")
-                    json_str = content
-
-                print(f"   提取的JSON字符串: {json_str}")
-                result = json.loads(json_str)
-                print(f"   ✅ JSON解析成功: {result}")
-                
-                next_x = int(result["x"])
-                next_y = int(result["y"])
-                next_pos = (next_x, next_y)
-                
-                print(f"\n🎯 解析结果:")
-                print(f"   下一步坐标: ({next_x}, {next_y})")
-                
-                # 验证返回的位置是否是已访问的位置
-                if next_pos in move_history:
-                    print(f"   ⚠️  注意: LLM选择回溯到已访问位置 ({next_x}, {next_y})")
-                    print(f"   已访问位置索引: {move_history.index(next_pos) + 1}/{len(move_history)}")
-                else:
-                    print(f"   ✅ 下一步移动到未访问位置: ({next_x}, {next_y})")
-                
-                # 验证是否是相邻位置
-                dx = next_x - current_pos[0]
-                dy = next_y - current_pos[1]
-                distance = abs(dx) + abs(dy)
-                if distance == 1:
-                    print(f"   ✅ 验证通过: 是相邻位置 (距离=1)")
-                else:
-                    print(f"   ⚠️  警告: 不是相邻位置 (距离={distance})")
-                
-                # 计算到目标的新距离
-                new_distance = abs(target_pos[0] - next_x) + abs(target_pos[1] - next_y)
-                old_distance = abs(target_pos[0] - current_pos[0]) + abs(target_pos[1] - current_pos[1])
-                distance_change = new_distance - old_distance
-                if distance_change < 0:
-                    print(f"   ✅ 距离目标更近了 (减少 {abs(distance_change)} 步)")
-                elif distance_change > 0:
-                    print(f"   ⚠️  距离目标更远了 (增加 {distance_change} 步)")
-                else:
-                    print(f"   ➡️  距离目标不变")
-
-                print("="*80)
-                print("🤖 LLM 推理完成\n")
-                
-                return next_pos
-            except (json.JSONDecodeError, KeyError, ValueError) as e:
-                print(f"   ❌ JSON解析失败: {e}")
-                print(f"   尝试使用正则表达式提取数字...")
-                # 如果JSON解析失败，尝试从文本中提取数字
-                import re
-
-                numbers = re.findall(r"\d+", content)
-                if len(numbers) >= 2:
-                    extracted_pos = (int(numbers[0]), int(numbers[1]))
-                    print(f"   ✅ 从文本中提取到坐标: {extracted_pos}")
-                    print("="*80)
-                    print("🤖 LLM 推理完成\n")
-                    return extracted_pos
+        with metrics.time("prompt"):
+            if self.output_mode == "coordinate":
+                prompt = self._build_prompt(
+                    current_pos, target_pos, visited, available_directions, is_looping, recent_pattern,
+                    goal_distance, local_view, output_instruction=PLAN_INSTRUCTION.format(max_moves=max_moves)
+                )
+                request["messages"] = self._build_messages(maze_state, prompt, PLAN_SYSTEM_PROMPT)
+            else:
+                prompt = self._build_prompt(
+                    current_pos, target_pos, visited, available_directions, is_looping, recent_pattern,
+                    goal_distance, local_view, output_instruction=PLAN_DIRECTION_INSTRUCTION.format(max_moves=max_moves)
+                )
+                request["messages"] = self._build_messages(maze_state, prompt, PLAN_DIRECTION_SYSTEM_PROMPT)
+                # 每个方向约2个token
+                request["max_tokens"] = 4 * max_moves + 20
+                request["early_stop"] = MOVES_JSON_RE
+                request["output_format"] = self._output_format(MOVES_SCHEMA)
+        self._log(f"\n⏳ 正在调用 LLM API...")
+        return request
+
+    def _parse_plan(self, request: dict, content: str) -> List[Tuple[int, int]]:
+        """解析规划响应，返回坐标列表"""
+        self._log(f"\n🔍 开始解析路径...")
+        plan = []
+        if self.output_mode != "coordinate":
+            # 方向序列从当前位置出发换算成坐标，是否撞墙由调用方逐步验证
+            match = MOVES_JSON_RE.search(content)
+            if match is None:
+                raise ValueError(f"无法解析LLM响应: {content}")
+            x, y = request["current_pos"]
+            for direction in json.loads(match.group(0))["moves"][:request["max_moves"]]:
+                dx, dy = DIRECTION_DELTAS[direction]
+                x, y = x + dx, y + dy
+                plan.append((x, y))
+        else:
+            # 优先取出完整的 {"path": [...]} 对象，模型在JSON前后附加的说明文字不影响解析
+            match = PLAN_JSON_RE.search(content)
+            result = json.loads(match.group(0) if match else self._extract_json_str(content))
+            steps = result["path"] if isinstance(result, dict) else result
+            for step in steps[:request["max_moves"]]:
+                if isinstance(step, dict):
+                    plan.append((int(step["x"]), int(step["y"])))
                 else:
-                    print(f"   ❌ 无法从响应中提取有效坐标")
-                    print("="*80)
-                    raise ValueError(f"无法解析LLM响应: {content}")
+                    plan.append((int(step[0]), int(step[1])))
+        if not plan:
+            raise ValueError("LLM返回的路径为空")
+        self._log(f"   ✅ 解析到 {len(plan)} 步: {plan}")
+        trace(parse=f"plan:{self.output_mode}")
+        self._log("="*80)
+        self._log("🤖 LLM 路径规划完成\n")
+        self._cache_decision(request, plan, plan[0])
+        return plan
 
-        except Exception as e:
-            print(f"\n❌ LLM API 调用失败:")
-            print(f"   错误类型: {type(e).__name__}")
-            print(f"   错误信息: {str(e)}")
-            print("="*80)
-            raise RuntimeError(f"调用LLM时出错: {str(e)}")
-
-    def _build_prompt(self, maze_state: str, current_pos: Tuple[int, int], target_pos: Tuple[int, int], move_history: List[Tuple[int, int]], available_directions: List[str], is_looping: bool = False, recent_pattern: str = "") -> str:
-        """构建发送给LLM的提示词"""
-        # 将移动历史转换为集合以便快速查找
-        visited_set = set(move_history)
-        
+    def _failure(self, error: Exception, title: str = "LLM API 调用失败") -> RuntimeError:
+        """输出错误信息，并统一包装为RuntimeError"""
+        self._log(f"\n❌ {title}:", logging.WARNING)
+        self._log(f"   错误类型: {type(error).__name__}", logging.WARNING)
+        self._log(f"   错误信息: {str(error)}", logging.WARNING)
+        self._log("="*80)
+        return RuntimeError(f"调用LLM时出错: {str(error)}")
+
+    def _is_open_step(self, request: dict, pos) -> bool:
+        """pos 是否是从当前位置沿本步可用方向走一步到达的格子"""
+        try:
+            x, y = pos
+            delta = (int(x) - request["current_pos"][0], int(y) - request["current_pos"][1])
+        except (TypeError, ValueError):
+            return False
+        return DELTA_DIRECTIONS.get(delta) in request["available_directions"]
+
+    def _cache_decision(self, request: dict, decision, first_step: Tuple[int, int]):
+        """写入决策缓存：只缓存第一步相邻且可通行的决策，墙和远处的坐标不会在之后被当作命中返回"""
+        if request["cache_key"] is None:
+            return
+        if not self._is_open_step(request, first_step):
+            self._log(f"   ⚠️  第一步 {first_step} 不是可通行的相邻位置，不写入决策缓存")
+            return
+        self.decision_cache.put(request["cache_key"], decision)
+
+    def _cache_key(self, kind: str, maze_state: str, current_pos: Tuple[int, int], target_pos: Tuple[int, int], visited: VisitIndex, is_looping: bool, local_view: str) -> Optional[str]:
+        """
+        生成决策缓存键，未启用缓存或检测到循环时返回None（既不查询也不写入缓存）
+
+        循环中反复回到同一位置时局部状态相同，缓存会一直重放导致循环的那个决策，
+        所以循环期间每步都重新询问模型，绕过的查询计为未命中。
+        """
+        if self.decision_cache is None:
+            return None
+        if is_looping:
+            self.decision_cache.skip()
+            metrics.inc("cache_bypasses")
+            return None
+        # 输出模式不同时提示词和解析方式都不同，决策分开缓存
+        extra = f"{self.output_mode}\n{local_view}"
+        return self.decision_cache.make_key(self.model, kind, maze_state, current_pos, target_pos, visited, extra)
+
+    def _completion_kwargs(self, messages: List[dict], max_tokens: int, output_format: Optional[dict] = None) -> dict:
+        """聊天补全请求参数，同步和异步客户端共用"""
+        return {
+            **(output_format or {}),
+            "model": self.model,
+            "messages": messages,
+            "temperature": 0.3,  # 降低随机性，使决策更稳定
+            "max_tokens": max_tokens,
+            "timeout": self.timeout,
+            **({"stream": True, "stream_options": {"include_usage": True}} if self.stream else {}),
+        }
+
+    def _request_completion(self, messages: List[dict], max_tokens: int = 200, early_stop: Optional[Pattern] = None, output_format: Optional[dict] = None) -> str:
+        """
+        调用聊天补全接口（带重试和对冲），返回去除首尾空白的响应文本
+
+        Args:
+            early_stop: 流式模式下匹配完整决策的正则，匹配到后立即关闭流并只返回匹配的部分
+            output_format: 约束输出格式的额外请求参数（response_format 或 tools）
+        """
+        kwargs = self._completion_kwargs(messages, max_tokens, output_format)
+        start_time = time.perf_counter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    content = self._create_with_hedge(kwargs, early_stop)
+                    break
+                except retryable_errors() as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    time.sleep(self._retry_delay(attempt, e))
+        except Exception:
+            self.request_stats["failures"] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start_time
+            self.step_latency.record(elapsed)
+            metrics.observe("api", elapsed)
+        return content
+
+    def _retry_delay(self, attempt: int, error: Exception) -> float:
+        """第 attempt 次失败后的等待时间：带完全抖动的指数退避"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        self.request_stats["retries"] += 1
+        trace_add(retries=1)
+        self._log(f"⏳ LLM请求失败（{type(error).__name__}），{delay:.2f} 秒后进行第 {attempt + 1} 次重试", logging.WARNING)
+        return delay
+
+    def _hedge_delay(self) -> Optional[float]:
+        """对冲阈值（秒），不启用对冲或样本不足时返回None"""
+        if not self.hedge:
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if len(self.attempt_latency.samples) < self.HEDGE_MIN_SAMPLES:
+            return None
+        return self.attempt_latency.percentile(95)
+
+    def _attempt(self, kwargs: dict, early_stop: Optional[Pattern]) -> str:
+        """发送一次请求并读取响应文本，成功时记录耗时"""
+        start_time = time.perf_counter()
+        if self.stream:
+            content = self._read_stream(kwargs, early_stop)
+        else:
+            content = self._handle_response(self.client.chat.completions.create(**kwargs), kwargs["messages"])
+        self.attempt_latency.record(time.perf_counter() - start_time)
+        return content
+
+    def _read_stream(self, kwargs: dict, early_stop: Optional[Pattern]) -> str:
+        """逐片读取流式响应，出现完整的决策JSON时提前关闭连接"""
+        stream = self.client.chat.completions.create(**kwargs)
+        state = {"parts": [], "usage": None}
+        early = None
+        try:
+            for chunk in stream:
+                early = self._on_stream_chunk(chunk, state, early_stop)
+                if early is not None:
+                    break
+        finally:
+            stream.close()
+        return self._finish_stream(state, early, kwargs["messages"])
+
+    def _on_stream_chunk(self, chunk, state: dict, early_stop: Optional[Pattern]) -> Optional[str]:
+        """处理一个流式片段，累计的文本中已出现完整的决策JSON时返回它"""
+        if getattr(chunk, "usage", None):
+            state["usage"] = chunk.usage
+        if not chunk.choices:
+            return None
+        delta = chunk.choices[0].delta
+        if getattr(delta, "tool_calls", None):
+            function = delta.tool_calls[0].function
+            delta = function.arguments if function else None
+        else:
+            delta = delta.content
+        if not delta:
+            return None
+        state["parts"].append(delta)
+        # 决策JSON以右花括号结尾，其他片段不可能让它变完整
+        if early_stop is None or "}" not in delta:
+            return None
+        match = early_stop.search("".join(state["parts"]))
+        return match.group(0) if match else None
+
+    def _finish_stream(self, state: dict, early: Optional[str], messages: List[dict]) -> str:
+        """流式响应结束（或提前关闭）后累计用量，返回响应文本"""
+        self._log(f"✅ LLM API 流式调用成功")
+        usage = state["usage"]
+        if usage is not None:
+            self._learn_token_ratio(messages, usage)
+        else:
+            # 提前关闭的流收不到末尾的用量片段，按提示词长度和收到的片段数估算，并在追踪信息中标记
+            usage = self._estimate_usage(messages, state["parts"])
+            trace(usage_estimated=True)
+            self._log(f"📊 未收到用量片段，估算: 输入 {usage.prompt_tokens} token, 输出 {usage.completion_tokens} token")
+        self._record_usage(usage)
+        if early is not None:
+            self.request_stats["early_stops"] += 1
+            trace(early_stop=True)
+            self._log(f"⚡ 已收到完整的决策JSON，提前关闭流（共接收 {len(state['parts'])} 个片段）")
+            content = early
+        else:
+            content = "".join(state["parts"]).strip()
+            if not content:
+                raise ValueError("LLM返回的响应内容为空")
+        self._log(f"\n📨 原始响应内容:")
+        self._log(f"   {content}")
+        return content
+
+    def _create_with_hedge(self, kwargs: dict, early_stop: Optional[Pattern] = None) -> str:
+        """
+        发送请求；超过对冲阈值仍未返回时再发送一个相同的请求，采用先成功返回的结果
+
+        同步客户端无法中途取消请求，落后的请求在各自的守护线程中自然结束，其结果被丢弃。
+        """
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is None:
+            return self._attempt(kwargs, early_stop)
+
+        # 每个请求在当前上下文的副本中运行，回合级的token统计（episode_usage）不会丢失
+        first = run_in_daemon_thread(self._attempt, kwargs, early_stop, name="llm-hedge")
+        try:
+            return first.result(timeout=hedge_delay)
+        except FutureTimeoutError:
+            pass
+
+        self.request_stats["hedges"] += 1
+        trace_add(hedges=1)
+        self._log(f"🔀 请求超过 {hedge_delay:.2f} 秒未返回，发送对冲请求")
+        second = run_in_daemon_thread(self._attempt, kwargs, early_stop, name="llm-hedge")
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self.request_stats["hedge_wins"] += 1
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def latency_stats(self) -> dict:
+        """每步决策耗时的分位数（包含重试和对冲）以及重试、对冲次数"""
+        return {**self.step_latency.summary(), **self.request_stats}
+
+    def _handle_response(self, response, messages: Optional[List[dict]] = None) -> str:
+        """打印响应统计并累计token用量，返回去除首尾空白的响应文本"""
+        # 打印API响应信息
+        self._log(f"✅ LLM API 调用成功")
+        self._log(f"📊 响应统计:")
+        self._log(f"   - 使用的模型: {response.model}")
+        self._log(f"   - 完成原因: {response.choices[0].finish_reason}")
+        if hasattr(response, 'usage') and response.usage:
+            if messages:
+                self._learn_token_ratio(messages, response.usage)
+            cached_tokens = self._record_usage(response.usage)
+            self._log(f"   - 输入token数: {response.usage.prompt_tokens}")
+            self._log(f"   - 缓存命中token数: {cached_tokens}")
+            self._log(f"   - 输出token数: {response.usage.completion_tokens}")
+            self._log(f"   - 总token数: {response.usage.total_tokens}")
+
+        # 解析响应（工具调用模式下决策在工具调用的参数中）
+        message = response.choices[0].message
+        content = message.content
+        if getattr(message, "tool_calls", None):
+            content = message.tool_calls[0].function.arguments
+        if content is None:
+            raise ValueError("LLM返回的响应内容为空")
+        content = content.strip()
+        self._log(f"\n📨 原始响应内容:")
+        self._log(f"   {content}")
+        return content
+
+    def _extract_json_str(self, content: str) -> str:
+        """从响应文本中提取JSON字符串（支持 ```json 代码块、普通代码块和纯JSON）"""
+        # 如果响应包含JSON代码块，提取它
+        if "```json" in content:
+            self._log(f"   检测到 JSON 代码块 (```json)")
+            return content.split("```json")[1].split("```")[0].strip()
+        elif "```" in content:
+            self._log(f"   检测到代码块 (```)")
+            return content.split("```")[1].split("```")[0].strip()
+        self._log(f"   直接使用响应内容作为JSON")
+        return content
+
+    def _learn_token_ratio(self, messages: List[dict], usage):
+        """记录提示词平均每个token的字符数，供之后估算流式响应的用量"""
+        if usage.prompt_tokens:
+            self._chars_per_token = sum(len(m["content"]) for m in messages) / usage.prompt_tokens
+
+    def _estimate_usage(self, messages: List[dict], parts: List[str]):
+        """
+        估算收不到用量片段的流式响应的用量
+
+        输入token数按最近一次带用量的响应的字符/token比例估算（还没有时ASCII按4个字符一个token、
+        中文等其他字符按一个字一个token），输出token数按收到的片段数计（每个片段大约一个token）；
+        命中提示词缓存的token数无法得知，记为0。
+        """
+        if self._chars_per_token:
+            chars = sum(len(m["content"]) for m in messages)
+            prompt_tokens = round(chars / self._chars_per_token)
+        else:
+            prompt_tokens = 0
+            for m in messages:
+                ascii_chars = len(m["content"].encode("ascii", "ignore"))
+                prompt_tokens += (ascii_chars + 3) // 4 + len(m["content"]) - ascii_chars
+        prompt_tokens = max(1, prompt_tokens)
+        return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(parts),
+                               total_tokens=prompt_tokens + len(parts), prompt_tokens_details=None)
+
+    def _record_usage(self, usage) -> int:
+        """累计token用量，返回本次命中提示词缓存的输入token数"""
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details else 0
+        self.usage_stats["calls"] += 1
+        self.usage_stats["prompt_tokens"] += usage.prompt_tokens or 0
+        self.usage_stats["cached_tokens"] += cached_tokens
+        self.usage_stats["completion_tokens"] += usage.completion_tokens or 0
+        trace_add(calls=1, prompt_tokens=usage.prompt_tokens or 0, cached_tokens=cached_tokens,
+                  completion_tokens=usage.completion_tokens or 0)
+        metrics.inc("api_calls")
+        metrics.inc("prompt_tokens", usage.prompt_tokens or 0)
+        metrics.inc("cached_tokens", cached_tokens)
+        metrics.inc("completion_tokens", usage.completion_tokens or 0)
+        current_episode = episode_usage.get()
+        if current_episode is not None:
+            current_episode["calls"] = current_episode.get("calls", 0) + 1
+            current_episode["prompt_tokens"] = current_episode.get("prompt_tokens", 0) + (usage.prompt_tokens or 0)
+            current_episode["cached_tokens"] = current_episode.get("cached_tokens", 0) + cached_tokens
+            current_episode["completion_tokens"] = current_episode.get("completion_tokens", 0) + (usage.completion_tokens or 0)
+        return cached_tokens
+
+    def _build_messages(self, maze_state: str, prompt: str, system_prompt: str = SYSTEM_PROMPT) -> List[dict]:
+        """组装消息：系统提示词和静态地图作为稳定前缀，每步状态作为最后一条消息"""
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"当前迷宫状态：\n{maze_state}"},
+            {"role": "user", "content": prompt},
+        ]
+
+    def _build_prompt(self, current_pos: Tuple[int, int], target_pos: Tuple[int, int], visited: VisitIndex, available_directions: List[str], is_looping: bool = False, recent_pattern: str = "", goal_distance: Optional[int] = None, local_view: str = "", output_instruction: str = COORDINATE_INSTRUCTION) -> str:
+        """构建每步变化的提示词后缀（不包含静态迷宫地图）"""
         # 计算当前位置的相邻位置，并标记哪些已访问
         adjacent_positions = []
         x, y = current_pos
         for dx, dy, direction in [(0, -1, "UP"), (0, 1, "DOWN"), (-1, 0, "LEFT"), (1, 0, "RIGHT")]:
             adj_x, adj_y = x + dx, y + dy
-            is_visited = (adj_x, adj_y) in visited_set
+            is_visited = (adj_x, adj_y) in visited
             adjacent_positions.append((adj_x, adj_y, direction, is_visited))
         
-        # 计算到目标的曼哈顿距离
-        manhattan_distance = abs(target_pos[0] - current_pos[0]) + abs(target_pos[1] - current_pos[1])
+        # 距离提示：优先使用距离场给出的实际路径距离，否则使用曼哈顿距离
+        if goal_distance is not None:
+            distance_hint = f"到目标的迷宫路径距离（沿通道实际需要的步数）: {goal_distance}"
+        else:
+            manhattan_distance = abs(target_pos[0] - current_pos[0]) + abs(target_pos[1] - current_pos[1])
+            distance_hint = f"到目标的曼哈顿距离: {manhattan_distance}"
         
         # 统计未访问的相邻位置数量
         unvisited_count = sum(1 for _, _, _, is_visited in adjacent_positions if not is_visited)
         can_backtrack = unvisited_count == 0
         
-        prompt = f"""当前迷宫状态：
-                    {maze_state}
-
-                    当前位置: ({current_pos[0]}, {current_pos[1]})
+        prompt = f"""当前位置: ({current_pos[0]}, {current_pos[1]})
                     目标位置: ({target_pos[0]}, {target_pos[1]})
-                    到目标的曼哈顿距离: {manhattan_distance}
+                    {distance_hint}
 
                     当前位置的相邻位置（必须从这些位置中选择一个）：
                     """
+        if local_view:
+            prompt = f"{local_view}\n\n" + prompt
         for adj_x, adj_y, direction, is_visited in adjacent_positions:
             if is_visited:
                 status = "⚠️ 已访问过（不推荐，仅在必要时回溯）"
@@ -264,22 +950,15 @@ class LLMClient:
 如果继续重复移动，将无法找到正确路径！
 """
         
+        # 只列出最近的移动，提示词长度不随回合长度增长
+        recent = visited.recent_moves(RECENT_MOVES_IN_PROMPT)
         prompt += f"""
-已访问过的所有位置（共{len(move_history)}个，尽量避免移动到这些位置）：
+已访问过 {len(visited)} 个不同位置（尽量避免移动到这些位置），最近经过的位置：
 """
-        if move_history:
-            # 显示所有已访问位置，但分组显示以提高可读性
-            if len(move_history) <= 20:
-                # 如果位置不多，全部显示
-                for i, pos in enumerate(move_history, 1):
-                    prompt += f"  {i}. ({pos[0]}, {pos[1]})\n"
-            else:
-                # 如果位置很多，显示前5个和最后15个
-                for i, pos in enumerate(move_history[:5], 1):
-                    prompt += f"  {i}. ({pos[0]}, {pos[1]})\n"
-                prompt += f"  ... (省略中间 {len(move_history) - 20} 个位置) ...\n"
-                for i, pos in enumerate(move_history[-15:], len(move_history) - 14):
-                    prompt += f"  {i}. ({pos[0]}, {pos[1]})\n"
+        if recent:
+            first_step = visited.total - len(recent) + 1
+            for i, pos in enumerate(recent, first_step):
+                prompt += f"  {i}. ({pos[0]}, {pos[1]})\n"
         else:
             prompt += "  无\n"
 
@@ -293,6 +972,135 @@ class LLMClient:
         6. ⚠️ 绝对禁止重复移动！如果最近几步在来回移动（如左右左右），必须立即选择不同的方向
         7. 如果看到"检测到循环"警告，你必须选择与最近移动方向不同的方向，优先选择未访问的位置
 
-        请返回JSON格式: {{"x": 数字, "y": 数字}}
+        {output_instruction}
         """
         return prompt
+
+
+class AsyncLLMClient(LLMClient):
+    """
+    异步LLM客户端，用于批量评测时并发运行多个回合
+
+    所有请求共用同一个 AsyncOpenAI 实例，即共用一个HTTP连接池；
+    提示词构建、缓存和响应解析与同步客户端完全相同。
+    """
+
+    def _create_client(self, client_kwargs: dict):
+        """创建异步API客户端"""
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(**client_kwargs)
+
+    async def get_next_move_async(self, maze_state: str, current_pos: Tuple[int, int], target_pos: Tuple[int, int], visited: VisitIndex, available_directions: List[str], is_looping: bool = False, recent_pattern: str = "", goal_distance: Optional[int] = None, local_view: str = "") -> Tuple[int, int]:
+        """异步获取下一步移动坐标，参数与 get_next_move 相同"""
+        request = self._prepare_move(maze_state, current_pos, target_pos, visited, available_directions, is_looping, recent_pattern, goal_distance, local_view)
+        if request["cached"] is not None:
+            return request["cached"]
+        try:
+            content = await self._request_completion_async(request["messages"], request["max_tokens"], request["early_stop"], request["output_format"])
+            return self._parse(self._parse_move, request, content)
+        except Exception as e:
+            raise self._failure(e)
+
+    async def get_next_plan_async(self, maze_state: str, current_pos: Tuple[int, int], target_pos: Tuple[int, int], visited: VisitIndex, available_directions: List[str], is_looping: bool = False, recent_pattern: str = "", goal_distance: Optional[int] = None, local_view: str = "", max_moves: int = 5) -> List[Tuple[int, int]]:
+        """异步获取多步路径，参数与 get_next_plan 相同"""
+        request = self._prepare_plan(maze_state, current_pos, target_pos, visited, available_directions, is_looping, recent_pattern, goal_distance, local_view, max_moves)
+        if request["cached"] is not None:
+            return request["cached"]
+        try:
+            content = await self._request_completion_async(request["messages"], request["max_tokens"], request["early_stop"], request["output_format"])
+            return self._parse(self._parse_plan, request, content)
+        except Exception as e:
+            raise self._failure(e, "LLM 路径规划失败")
+
+    async def _request_completion_async(self, messages: List[dict], max_tokens: int = 200, early_stop: Optional[Pattern] = None, output_format: Optional[dict] = None) -> str:
+        """异步调用聊天补全接口（带重试和对冲），返回去除首尾空白的响应文本"""
+        kwargs = self._completion_kwargs(messages, max_tokens, output_format)
+        start_time = time.perf_counter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    content = await self._create_with_hedge_async(kwargs, early_stop)
+                    break
+                except retryable_errors() as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    await asyncio.sleep(self._retry_delay(attempt, e))
+        except Exception:
+            self.request_stats["failures"] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start_time
+            self.step_latency.record(elapsed)
+            metrics.observe("api", elapsed)
+        return content
+
+    async def _attempt_async(self, kwargs: dict, early_stop: Optional[Pattern]) -> str:
+        """异步发送一次请求并读取响应文本，成功时记录耗时"""
+        start_time = time.perf_counter()
+        if self.stream:
+            content = await self._read_stream_async(kwargs, early_stop)
+        else:
+            content = self._handle_response(await self.client.chat.completions.create(**kwargs), kwargs["messages"])
+        self.attempt_latency.record(time.perf_counter() - start_time)
+        return content
+
+    async def _read_stream_async(self, kwargs: dict, early_stop: Optional[Pattern]) -> str:
+        """_read_stream 的异步版本"""
+        stream = await self.client.chat.completions.create(**kwargs)
+        state = {"parts": [], "usage": None}
+        early = None
+        try:
+            async for chunk in stream:
+                early = self._on_stream_chunk(chunk, state, early_stop)
+                if early is not None:
+                    break
+        finally:
+            await stream.close()
+        return self._finish_stream(state, early, kwargs["messages"])
+
+    async def _create_with_hedge_async(self, kwargs: dict, early_stop: Optional[Pattern] = None) -> str:
+        """_create_with_hedge 的异步版本，采用先成功返回的结果后取消另一个请求"""
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is None:
+            return await self._attempt_async(kwargs, early_stop)
+
+        first = asyncio.ensure_future(self._attempt_async(kwargs, early_stop))
+        done, _ = await asyncio.wait({first}, timeout=hedge_delay)
+        if done:
+            return first.result()
+
+        self.request_stats["hedges"] += 1
+        trace_add(hedges=1)
+        self._log(f"🔀 请求超过 {hedge_delay:.2f} 秒未返回，发送对冲请求")
+        second = asyncio.ensure_future(self._attempt_async(kwargs, early_stop))
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # 先取出所有已完成任务的异常，两个请求同时失败（如都遇到429）时不会留下未读取的异常
+                errors = {task: task.exception() for task in done}
+                for task in (first, second):
+                    if task in errors and errors[task] is None:
+                        if task is second:
+                            self.request_stats["hedge_wins"] += 1
+                        return task.result()
+                error = error or next(iter(errors.values()))
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            # 等待被取消的请求真正结束，取消过程中抛出的异常在这里被读取
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def close(self):
+        """关闭连接池"""
+        await self.client.close()
+
+    def get_next_move(self, *args, **kwargs):
+        """异步客户端不支持同步调用"""
+        raise TypeError("AsyncLLMClient 只支持异步调用，请使用 get_next_move_async")
+
+    def get_next_plan(self, *args, **kwargs):
+        """异步客户端不支持同步调用"""
+        raise TypeError("AsyncLLMClient 只支持异步调用，请使用 get_next_plan_async")
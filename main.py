@@ -1,51 +1,269 @@
 import os
 import sys
+import argparse
 from dotenv import load_dotenv
-from maze_game import MazeGame
-from llm_client import LLMClient
+from llm_client import LLMClient, OUTPUT_MODES
+from decision_cache import DecisionCache
+from event_log import LOG_LEVELS, configure_logging, shutdown_logging
+from metrics import metrics, print_latency_stats, print_phase_stats, write_episode_csv
+from maze_engine import MazeGenerator, run_headless
+from maze_store import MazeStore, build_corpus
+from maze_file import open_maze
 
 # 加载 .env 文件
 load_dotenv()
 
 
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="AI 自动化迷宫游戏")
+    parser.add_argument("--auto", action="store_true", help="以AI自动模式启动")
+    parser.add_argument("--headless", action="store_true",
+                        help="无界面模式：不创建窗口，以最快速度批量运行回合")
+    parser.add_argument("--episodes", type=int, default=1, help="无界面模式下运行的回合数")
+    parser.add_argument("--max-steps", type=int, default=None, help="无界面模式下每回合的最大决策次数")
+    parser.add_argument("--width", type=int, default=21, help="迷宫宽度（必须是奇数）")
+    parser.add_argument("--height", type=int, default=21, help="迷宫高度（必须是奇数）")
+    parser.add_argument("--algorithm", choices=MazeGenerator.ALGORITHMS, default="backtracker",
+                        help="迷宫生成算法：backtracker（递归回溯）或 eller（逐行生成）")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="第一个迷宫的随机种子，之后每个回合（或按R重新生成时）依次加1；相同种子总是生成相同的迷宫")
+    parser.add_argument("--corpus", metavar="NAME", default=None,
+                        help="使用迷宫库中的命名语料；语料不存在时按 --episodes、尺寸、算法和 --seed 创建")
+    parser.add_argument("--maze-file", metavar="PATH", default=None,
+                        help="使用 maze_file.py 生成的迷宫文件（每格1位，按需从磁盘读取），尺寸和种子取自文件；"
+                             "无界面模式下每个回合都使用这个迷宫")
+    parser.add_argument("--maze-store", metavar="PATH", default=None,
+                        help="迷宫库的SQLite文件，保存生成过的迷宫和语料（使用 --corpus 时默认为 mazes.db）")
+    parser.add_argument("--pregenerate", type=int, default=2,
+                        help="窗口模式下在后台进程中预先生成的迷宫数，按R重新开始或改变尺寸时直接换入（0表示不预生成）")
+    parser.add_argument("--window-size", type=int, default=None,
+                        help="局部视野大小k：只向LLM发送玩家周围 k×k 的地图，不设置则发送完整地图")
+    parser.add_argument("--plan-length", type=int, default=1,
+                        help="规划模式：每次LLM调用最多返回多少步路径，1表示每次只返回一步")
+    parser.add_argument("--decision-cache", metavar="PATH", default=None,
+                        help="启用LLM决策缓存并持久化到SQLite文件，相同迷宫和局部状态时跳过API调用")
+    parser.add_argument("--timeout", type=float, default=30.0, help="单次LLM请求的超时时间（秒）")
+    parser.add_argument("--max-retries", type=int, default=2, help="超时、限流和服务端错误的最大重试次数")
+    parser.add_argument("--hedge", action="store_true",
+                        help="启用对冲请求：请求超过p95耗时仍未返回时再发送一个相同请求，采用先返回的结果")
+    parser.add_argument("--hedge-after", type=float, default=None,
+                        help="固定的对冲阈值（秒），不设置时使用最近请求耗时的p95")
+    parser.add_argument("--stream", action="store_true",
+                        help="流式模式：边接收边解析，收到完整的决策JSON后立即关闭连接")
+    parser.add_argument("--output-mode", choices=OUTPUT_MODES, default="coordinate",
+                        help="LLM输出模式：coordinate（坐标JSON）、direction（结构化输出的方向枚举）或 tool（工具调用返回方向）")
+    parser.add_argument("--cache-size", type=int, default=10000, help="决策缓存在内存中保留的最大条目数")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default="info",
+                        help="控制台日志级别：info 输出每步的详细推理过程，warning 及以上时只输出警告和错误")
+    parser.add_argument("--log-jsonl", metavar="PATH", default=None,
+                        help="将每个决策（位置、选择、耗时、token用量、解析路径）作为一条JSON记录写入文件，由后台线程缓冲写入")
+    parser.add_argument("--metrics-file", metavar="PATH", default=None,
+                        help="退出时将分阶段耗时直方图和计数器以Prometheus文本格式写入文件")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="在本地端口提供 /metrics HTTP端点（Prometheus文本格式）")
+    parser.add_argument("--metrics-csv", metavar="PATH", default=None,
+                        help="无界面模式下将每个回合的计数器和分阶段耗时写入CSV文件")
+    parser.add_argument("--profile-frames", type=int, default=0,
+                        help="启动后用 cProfile 分析前N帧的游戏循环（游戏中按F4也可以开始分析）")
+    parser.add_argument("--record", metavar="DIR", default=None,
+                        help="将每个回合（迷宫、移动序列和决策元数据）录制到目录中，可用 replay.py 回放")
+    parser.add_argument("--profile-output", metavar="PATH", default="frame_profile.prof",
+                        help="帧分析结果的输出文件（pstats格式）")
+    return parser.parse_args()
+
+
+def create_llm_client(args) -> LLMClient:
+    """从环境变量创建LLM客户端"""
+    # 从 .env 文件读取配置
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        print("错误: 自动模式需要设置 OPENAI_API_KEY")
+        print("请在 .env 文件中设置 OPENAI_API_KEY，或设置环境变量")
+        print("可以参考 .env.example 文件创建 .env 文件")
+        sys.exit(1)
+
+    base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1/")
+    model = os.getenv("LLM_MODEL", "gpt-4o")
+
+    decision_cache = None
+    if args.decision_cache:
+        decision_cache = DecisionCache(max_entries=args.cache_size, db_path=args.decision_cache)
+        print(f"已启用决策缓存: {args.decision_cache}")
+
+    llm_client = LLMClient(
+        api_key=api_key,
+        base_url=base_url,
+        model=model,
+        decision_cache=decision_cache,
+        timeout=args.timeout,
+        max_retries=args.max_retries,
+        hedge=args.hedge,
+        hedge_after=args.hedge_after,
+        stream=args.stream,
+        output_mode=args.output_mode
+    )
+    print(f"LLM客户端初始化成功，使用模型: {model}")
+    if base_url:
+        print(f"使用自定义API地址: {base_url}")
+    return llm_client
+
+
+def load_corpus(args, maze_store: MazeStore) -> list:
+    """
+    读取 --corpus 指定的语料，不存在时按命令行参数创建
+
+    主程序每次只运行一种尺寸的迷宫，语料中的尺寸和算法会覆盖 --width、--height 和 --algorithm。
+
+    Returns:
+        语料中迷宫的种子列表
+    """
+    mazes = maze_store.corpus(args.corpus)
+    if mazes is None:
+        mazes = build_corpus(args.episodes, [(args.width, args.height)], args.algorithm, args.seed or 0)
+        maze_store.create_corpus(args.corpus, mazes)
+        print(f"已创建语料 {args.corpus}: {len(mazes)} 个迷宫")
+    else:
+        print(f"使用语料 {args.corpus}: {len(mazes)} 个迷宫")
+
+    shapes = {(m["algorithm"], m["width"], m["height"]) for m in mazes}
+    if len(shapes) > 1:
+        print(f"错误: 语料 {args.corpus} 包含多种尺寸或算法，请使用 batch_eval.py --corpus 运行")
+        sys.exit(1)
+    args.algorithm, args.width, args.height = shapes.pop()
+    return [m["seed"] for m in mazes]
+
+
+def run_headless_mode(args, llm_client, maze_store=None, seeds=None, maze=None):
+    """无界面模式：批量运行回合并输出统计"""
+    solver = f"LLM ({llm_client.model})" if llm_client else "本地策略"
+    episodes = len(seeds) if seeds else args.episodes
+    print(f"无界面模式: {episodes} 个回合, 迷宫 {args.width}x{args.height}, 求解器: {solver}")
+    results = run_headless(
+        episodes=args.episodes,
+        maze_width=args.width,
+        maze_height=args.height,
+        llm_client=llm_client,
+        max_steps=args.max_steps,
+        algorithm=args.algorithm,
+        window_size=args.window_size,
+        plan_length=args.plan_length,
+        record_dir=args.record,
+        seed=args.seed,
+        seeds=seeds,
+        maze_store=maze_store,
+        maze=maze
+    )
+
+    wins = sum(1 for r in results if r["won"])
+    total_time = sum(r["elapsed"] for r in results)
+    avg_steps = sum(r["steps"] for r in results) / len(results) if results else 0
+    print(f"成功率: {wins}/{len(results)}")
+    print(f"平均步数: {avg_steps:.1f}")
+    print(f"总耗时: {total_time:.2f} 秒")
+    if total_time > 0:
+        print(f"回合速度: {len(results) / total_time * 60:.0f} 回合/分钟")
+    if llm_client:
+        avg_calls = sum(r["llm_calls"] for r in results) / len(results) if results else 0
+        print(f"平均LLM调用次数: {avg_calls:.1f}")
+        usage = llm_client.usage_stats
+        print(f"LLM调用: {usage['calls']} 次, 输入token: {usage['prompt_tokens']} "
+              f"(缓存命中 {usage['cached_tokens']}), 输出token: {usage['completion_tokens']}")
+        print_latency_stats(llm_client)
+        if llm_client.decision_cache:
+            cache = llm_client.decision_cache.stats()
+            print(f"决策缓存: 命中 {cache['hits']} 次, 未命中 {cache['misses']} 次, 命中率 {cache['hit_rate']:.1%}")
+    print_phase_stats()
+    if args.metrics_csv:
+        write_episode_csv(args.metrics_csv, results)
+        print(f"已写入 {args.metrics_csv}")
+    if args.record:
+        print(f"回合录制已保存到 {args.record}")
+
+
 def main():
     """主函数"""
+    args = parse_args()
+    configure_logging(args.log_level, args.log_jsonl)
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port)
+        print(f"指标端点: http://127.0.0.1:{args.metrics_port}/metrics")
+    try:
+        run(args)
+    finally:
+        if args.metrics_file:
+            metrics.write_textfile(args.metrics_file)
+        shutdown_logging()
+
+
+def run(args):
+    """按命令行参数启动无界面模式或游戏窗口"""
     # 检查是否启用自动模式
-    auto_mode = "--auto" in sys.argv or os.getenv("AUTO_MODE", "").lower() == "true"
-    
+    auto_mode = args.auto or os.getenv("AUTO_MODE", "").lower() == "true"
+
     llm_client = None
     if auto_mode:
         try:
-            # 从 .env 文件读取配置
-            api_key = os.getenv("OPENAI_API_KEY")
-            if not api_key:
-                print("错误: 自动模式需要设置 OPENAI_API_KEY")
-                print("请在 .env 文件中设置 OPENAI_API_KEY，或设置环境变量")
-                print("可以参考 .env.example 文件创建 .env 文件")
-                sys.exit(1)
-            
-            base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1/")
-            model = os.getenv("LLM_MODEL", "gpt-4o")
-            
-            llm_client = LLMClient(api_key=api_key, base_url=base_url, model=model)
-            print(f"LLM客户端初始化成功，使用模型: {model}")
-            if base_url:
-                print(f"使用自定义API地址: {base_url}")
-            print("游戏将以自动模式启动，AI将自动控制移动")
+            llm_client = create_llm_client(args)
+            if not args.headless:
+                print("游戏将以自动模式启动，AI将自动控制移动")
         except Exception as e:
             print(f"初始化LLM客户端失败: {e}")
             print("将使用手动模式启动")
             auto_mode = False
-    
+
+    maze = None
+    if args.maze_file:
+        if args.corpus:
+            print("错误: --maze-file 不能与 --corpus 同时使用")
+            sys.exit(1)
+        try:
+            maze = open_maze(args.maze_file)
+        except (OSError, ValueError) as e:
+            print(f"错误: 无法打开迷宫文件 {args.maze_file}: {e}")
+            sys.exit(1)
+        args.width, args.height, args.algorithm = maze.width, maze.height, maze.algorithm
+        print(f"使用迷宫文件 {args.maze_file}: {maze.width}x{maze.height}, 种子 {maze.seed}")
+
+    maze_store = None
+    seeds = None
+    if args.maze_store or args.corpus:
+        maze_store = MazeStore(db_path=args.maze_store or "mazes.db")
+        if args.corpus:
+            seeds = load_corpus(args, maze_store)
+
+    if args.headless:
+        run_headless_mode(args, llm_client, maze_store, seeds, maze)
+        return
+
+    # 无界面模式不需要pygame，只在需要窗口时导入
+    from maze_game import MazeGame
+    from maze_pool import MazePool
+
+    maze_pool = MazePool(size=args.pregenerate) if args.pregenerate > 0 else None
+
     # 创建游戏实例
     # 可以调整迷宫大小（必须是奇数）
     game = MazeGame(
-        maze_width=21,
-        maze_height=21,
+        maze_width=args.width,
+        maze_height=args.height,
         auto_mode=auto_mode,
-        llm_client=llm_client
+        llm_client=llm_client,
+        algorithm=args.algorithm,
+        window_size=args.window_size,
+        plan_length=args.plan_length,
+        profile_frames=args.profile_frames,
+        profile_output=args.profile_output,
+        record_dir=args.record,
+        seed=seeds[0] if seeds else args.seed,
+        maze_store=maze_store,
+        maze_pool=maze_pool,
+        maze=maze
     )
-    
+    # 按R重新开始时依次使用语料中的其余迷宫
+    if seeds:
+        game.queue_seeds(seeds[1:])
+
     # 运行游戏
     game.run()
 
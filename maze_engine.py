@@ -0,0 +1,1489 @@
+"""无界面迷宫引擎：迷宫生成、玩家状态与自动求解逻辑，不依赖pygame"""
+
+import os
+import heapq
+import random
+import time
+import logging
+from array import array
+from collections import deque
+from typing import Any, Deque, Dict, List, Set, Tuple, Optional
+from enum import Enum
+from event_log import decision_trace, events_enabled, log_event
+from metrics import episode_metrics, metrics
+
+try:
+    import numpy as np
+except ImportError:  # numpy 是可选依赖，仅 MazeGrid.as_array() 需要
+    np = None
+
+# 迷宫网格字节到地图字符的转换表（0=通道, 1=墙）
+_MAP_CHARS = bytes.maketrans(b"\x00\x01", b".W")
+# 网格字节与二进制数字字符之间的转换表，用于按位打包
+_BIT_CHARS = bytes.maketrans(b"\x00\x01", b"01")
+_BIT_BYTES = bytes.maketrans(b"01", b"\x00\x01")
+
+logger = logging.getLogger("maze.engine")
+
+# 坐标增量到方向名称的映射
+_DIRECTION_NAMES = {(0, -1): "UP", (0, 1): "DOWN", (-1, 0): "LEFT", (1, 0): "RIGHT"}
+
+
+class Direction(Enum):
+    """方向枚举"""
+    UP = (0, -1)
+    DOWN = (0, 1)
+    LEFT = (-1, 0)
+    RIGHT = (1, 0)
+
+
+def new_seed() -> int:
+    """随机选取一个迷宫种子（未指定种子时使用，选出的种子会被记录，迷宫仍然可以复现）"""
+    return random.randrange(1 << 32)
+
+
+class MazeGrid:
+    """
+    紧凑的迷宫网格，每个格子1字节，按行连续存储在bytearray中
+
+    相比嵌套列表，5001x5001的网格只占约25MB。通过 grid[y][x] 访问仍然可用，
+    批量操作可以使用 view()（二维memoryview）或 as_array()（NumPy零拷贝视图）。
+    """
+
+    def __init__(self, width: int, height: int, fill: bool = False):
+        self.width = width
+        self.height = height
+        self.cells = bytearray([1 if fill else 0]) * (width * height)
+
+    def __getitem__(self, y: int) -> memoryview:
+        """返回第y行的可写视图，兼容 grid[y][x] 的访问方式"""
+        start = y * self.width
+        return memoryview(self.cells)[start:start + self.width]
+
+    def get(self, x: int, y: int) -> bool:
+        """读取指定格子"""
+        return self.cells[y * self.width + x] == 1
+
+    def set(self, x: int, y: int, value: bool):
+        """写入指定格子"""
+        self.cells[y * self.width + x] = 1 if value else 0
+
+    def row_bytes(self, y: int) -> bytes:
+        """返回第y行的字节拷贝（每个格子为0或1）"""
+        start = y * self.width
+        return bytes(self.cells[start:start + self.width])
+
+    def view(self) -> memoryview:
+        """返回形状为 (height, width) 的二维memoryview，不拷贝数据"""
+        return memoryview(self.cells).cast("B", (self.height, self.width))
+
+    def as_array(self):
+        """
+        返回形状为 (height, width) 的NumPy uint8数组视图，不拷贝数据
+
+        需要安装numpy，对数组的修改会直接反映到网格上。
+        """
+        if np is None:
+            raise ImportError("as_array() 需要安装 numpy")
+        return np.frombuffer(self.cells, dtype=np.uint8).reshape(self.height, self.width)
+
+    def count(self, value: bool = True) -> int:
+        """统计取值为value的格子数量"""
+        return self.cells.count(1 if value else 0)
+
+    def pack(self) -> bytes:
+        """按行优先把网格打包为每格1位（高位在前，末尾补0），大小约为原来的1/8"""
+        size = len(self.cells)
+        padding = -size % 8
+        bits = self.cells.translate(_BIT_CHARS) + b"0" * padding
+        return int(bits, 2).to_bytes((size + padding) // 8, "big") if size else b""
+
+    @classmethod
+    def unpack(cls, width: int, height: int, data: bytes) -> "MazeGrid":
+        """从 pack() 的结果还原网格"""
+        size = width * height
+        if len(data) * 8 < size:
+            raise ValueError(f"打包数据长度不足: 需要 {size} 位，实际 {len(data) * 8} 位")
+        grid = cls(width, height)
+        bits = format(int.from_bytes(data, "big"), f"0{len(data) * 8}b")[:size]
+        grid.cells[:] = bits.encode("ascii").translate(_BIT_BYTES)
+        return grid
+
+
+def _eller_rows(width: int, height: int, rng: random.Random):
+    """
+    Eller算法：逐行生成迷宫，依次产出每一行的字节（1=墙，0=通道）
+
+    只保留当前一行的集合标签，工作内存为 O(宽度)，与迷宫高度无关。
+    """
+    cols = (width - 1) // 2
+    rows = (height - 1) // 2
+    rand = rng.random
+    wall_row = bytes([1]) * width
+
+    # 上边界
+    yield wall_row
+    emitted = 1
+
+    # sets[c] 是第c列格子所属集合的标签，members 记录每个集合包含的列
+    sets = list(range(cols))
+    members = {c: [c] for c in range(cols)}
+    next_label = cols
+
+    for r in range(rows):
+        last = r == rows - 1
+        line = bytearray(wall_row)
+        for c in range(cols):
+            line[2 * c + 1] = 0
+
+        # 随机连通右侧属于不同集合的格子；最后一行必须连通所有集合
+        for c in range(cols - 1):
+            a, b = sets[c], sets[c + 1]
+            if a != b and (last or rand() < 0.5):
+                line[2 * c + 2] = 0
+                # 将较小的集合合并到较大的集合
+                if len(members[a]) < len(members[b]):
+                    a, b = b, a
+                moved = members.pop(b)
+                for m in moved:
+                    sets[m] = a
+                members[a].extend(moved)
+        yield bytes(line)
+        emitted += 1
+        if last:
+            break
+
+        # 每个集合至少向下打通一个格子
+        below = bytearray(wall_row)
+        next_sets = [-1] * cols
+        for label, group in members.items():
+            down = [c for c in group if rand() < 0.5] or [rng.choice(group)]
+            for c in down:
+                below[2 * c + 1] = 0
+                next_sets[c] = label
+        yield bytes(below)
+        emitted += 1
+
+        # 没有向下连通的格子在下一行成为新的集合
+        members = {}
+        for c in range(cols):
+            if next_sets[c] == -1:
+                next_sets[c] = next_label
+                next_label += 1
+            members.setdefault(next_sets[c], []).append(c)
+        sets = next_sets
+
+    # 下边界（高度为偶数时可能需要多补一行墙）
+    while emitted < height:
+        yield wall_row
+        emitted += 1
+
+
+class MazeGenerator:
+    """
+    迷宫生成器
+
+    支持两种算法：
+    - backtracker: 递归回溯算法（默认），需要整个网格和一个显式栈
+    - eller: Eller算法，逐行生成，可通过 stream_rows() 以 O(宽度) 内存生成超高迷宫
+    """
+    
+    ALGORITHMS = ("backtracker", "eller")
+    
+    def __init__(self, width: int, height: int, algorithm: str = "backtracker", seed: Optional[int] = None):
+        """
+        Args:
+            seed: 随机种子；相同的算法、尺寸和种子总是生成相同的迷宫。为None时随机选取一个种子
+        """
+        if algorithm not in self.ALGORITHMS:
+            raise ValueError(f"不支持的迷宫生成算法: {algorithm}，可选: {', '.join(self.ALGORITHMS)}")
+        self.width = width
+        self.height = height
+        self.algorithm = algorithm
+        self.seed = new_seed() if seed is None else seed
+        # 起点和终点：生成的迷宫总是左上角到右下角，迷宫文件可以在头部另行指定
+        self.start: Tuple[int, int] = (1, 1)
+        self.goal: Tuple[int, int] = (width - 2, height - 2)
+        # 网格在首次访问时才分配，只做流式生成时不需要占用整个网格的内存
+        self._maze: Optional[MazeGrid] = None
+        self._visited: Optional[MazeGrid] = None
+    
+    @classmethod
+    def from_grid(cls, grid: MazeGrid, algorithm: str = "backtracker", seed: Optional[int] = None,
+                  start: Optional[Tuple[int, int]] = None, goal: Optional[Tuple[int, int]] = None) -> "MazeGenerator":
+        """
+        用已有的网格（如从文件或迷宫库还原的迷宫）创建生成器，不重新生成
+
+        Args:
+            start: 起点，默认为 (1, 1)
+            goal: 终点，默认为右下角 (width - 2, height - 2)
+        """
+        generator = cls(grid.width, grid.height, algorithm, seed)
+        generator._maze = grid
+        if start is not None:
+            generator.start = tuple(start)
+        if goal is not None:
+            generator.goal = tuple(goal)
+        return generator
+    
+    @property
+    def maze(self) -> MazeGrid:
+        """迷宫网格：1表示墙，0表示通道"""
+        if self._maze is None:
+            self._maze = MazeGrid(self.width, self.height, fill=True)
+        return self._maze
+    
+    @property
+    def visited(self) -> MazeGrid:
+        """访问标记（递归回溯算法使用）"""
+        if self._visited is None:
+            self._visited = MazeGrid(self.width, self.height, fill=False)
+        return self._visited
+    
+    def is_valid(self, x: int, y: int) -> bool:
+        """检查坐标是否有效"""
+        return 0 <= x < self.width and 0 <= y < self.height
+    
+    def get_neighbors(self, x: int, y: int) -> List[Tuple[int, int]]:
+        """获取未访问的邻居"""
+        neighbors = []
+        for dx, dy in [(0, -2), (0, 2), (-2, 0), (2, 0)]:
+            nx, ny = x + dx, y + dy
+            if self.is_valid(nx, ny) and not self.visited.get(nx, ny):
+                neighbors.append((nx, ny))
+        return neighbors
+    
+    def remove_wall(self, x1: int, y1: int, x2: int, y2: int):
+        """移除两个单元格之间的墙"""
+        # 计算中间位置
+        mx, my = (x1 + x2) // 2, (y1 + y2) // 2
+        self.maze.set(mx, my, False)
+    
+    def rng(self) -> random.Random:
+        """按种子新建的随机数生成器，每次生成都从头使用，不受全局 random 状态和其他生成器影响"""
+        return random.Random(self.seed)
+    
+    def generate(self, start_x: int = 1, start_y: int = 1):
+        """生成迷宫（起始位置只对递归回溯算法有效）"""
+        if self.algorithm == "eller":
+            cells = self.maze.cells
+            width = self.width
+            for y, row in enumerate(self._iter_generated_rows()):
+                cells[y * width:(y + 1) * width] = row
+            return
+        
+        # 确保起始位置是奇数（保证边界是墙）
+        if start_x % 2 == 0:
+            start_x += 1
+        if start_y % 2 == 0:
+            start_y += 1
+        
+        width, height = self.width, self.height
+        maze = self.maze.cells
+        visited = self.visited.cells
+        choice = self.rng().choice
+        
+        # 递归回溯算法，栈中保存扁平索引（y * width + x），大迷宫下比坐标元组省内存
+        start = start_y * width + start_x
+        stack = array("l", [start])
+        visited[start] = 1
+        maze[start] = 0
+        
+        while stack:
+            index = stack[-1]
+            x, y = index % width, index // width
+            neighbors = []
+            if y >= 2 and not visited[index - 2 * width]:
+                neighbors.append(-width)
+            if y + 2 < height and not visited[index + 2 * width]:
+                neighbors.append(width)
+            if x >= 2 and not visited[index - 2]:
+                neighbors.append(-1)
+            if x + 2 < width and not visited[index + 2]:
+                neighbors.append(1)
+            
+            if neighbors:
+                # 随机选择一个未访问的邻居
+                step = choice(neighbors)
+                # 移除墙
+                maze[index + step] = 0
+                # 标记为已访问
+                next_index = index + 2 * step
+                visited[next_index] = 1
+                maze[next_index] = 0
+                # 添加到栈中
+                stack.append(next_index)
+            else:
+                # 回溯
+                stack.pop()
+        
+        # 确保起点和终点是通道
+        self.maze.set(1, 1, False)
+        self.maze.set(self.width - 2, self.height - 2, False)
+    
+    def _iter_generated_rows(self):
+        """逐行产出Eller算法生成的迷宫，并确保起点和终点是通道"""
+        end_x, end_y = self.width - 2, self.height - 2
+        for y, row in enumerate(_eller_rows(self.width, self.height, self.rng())):
+            if y == 1 or y == end_y:
+                line = bytearray(row)
+                if y == 1:
+                    line[1] = 0
+                if y == end_y:
+                    line[end_x] = 0
+                row = bytes(line)
+            yield row
+    
+    def stream_rows(self):
+        """
+        逐行生成迷宫，依次产出每一行的字节（1=墙，0=通道），相同种子总是产出相同的迷宫
+        
+        Eller算法不保存整个网格，工作内存为 O(宽度)，适合生成超高的压力测试迷宫；
+        递归回溯算法需要完整网格：尚未生成时先在内存中生成，再逐行产出当前迷宫。
+        已经生成（或从文件加载）的迷宫直接逐行产出。
+        """
+        if self._maze is None:
+            if self.algorithm == "eller":
+                yield from self._iter_generated_rows()
+                return
+            self.generate()
+        for y in range(self.height):
+            yield self.maze.row_bytes(y)
+    
+    def write_rows(self, path: str) -> int:
+        """
+        以流式方式生成迷宫并写入文本文件（每行一个迷宫行，W=墙，.=通道）
+        
+        Returns:
+            写入的行数
+        """
+        count = 0
+        with open(path, "wb") as f:
+            for row in self.stream_rows():
+                f.write(row.translate(_MAP_CHARS))
+                f.write(b"\n")
+                count += 1
+        return count
+    
+    def compute_distances(self, target_x: int, target_y: int) -> array:
+        """
+        从目标位置做一次广度优先搜索，计算每个格子到目标的路径距离
+
+        Returns:
+            按 y * width + x 索引的扁平距离数组，墙和不可达格子为-1
+        """
+        width = self.width
+        cells = self.maze.cells
+        if not isinstance(cells, bytearray):
+            # mmap 映射的迷宫逐格读取很慢，临时展开为字节网格（每格1字节，只占距离数组的1/4）
+            cells = self.maze.to_grid().cells
+        size = len(cells)
+        distances = array("i", [-1]) * size
+        if self.is_wall(target_x, target_y):
+            return distances
+
+        start = target_y * width + target_x
+        distances[start] = 0
+        frontier = [start]
+        distance = 0
+        # 迷宫边界都是墙，所以左右相邻的扁平索引不会跨行
+        while frontier:
+            distance += 1
+            next_frontier = []
+            for index in frontier:
+                for neighbor in (index - width, index + width, index - 1, index + 1):
+                    if 0 <= neighbor < size and distances[neighbor] == -1 and not cells[neighbor]:
+                        distances[neighbor] = distance
+                        next_frontier.append(neighbor)
+            frontier = next_frontier
+        return distances
+    
+    def is_wall(self, x: int, y: int) -> bool:
+        """检查指定位置是否是墙"""
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.maze.cells[y * self.width + x] == 1
+        return True
+
+
+class Player:
+    """玩家类"""
+    
+    def __init__(self, x: int, y: int):
+        self.x = x
+        self.y = y
+        self.start_x = x
+        self.start_y = y
+    
+    def move(self, dx: int, dy: int, maze: MazeGenerator):
+        """移动玩家"""
+        new_x = self.x + dx
+        new_y = self.y + dy
+        
+        # 检查是否可以移动（不是墙）
+        if not maze.is_wall(new_x, new_y):
+            self.x = new_x
+            self.y = new_y
+            return True
+        return False
+    
+    def reset(self):
+        """重置玩家位置"""
+        self.x = self.start_x
+        self.y = self.start_y
+
+
+class VisitIndex:
+    """
+    访问记录索引
+
+    每个格子一位的访问位图，加上访问过的格子的访问次数和首次访问的步数，移动时增量更新，
+    查询某个位置是否访问过是O(1)，不需要扫描移动历史；完整的移动顺序只保留最近
+    recent_size 步（环形缓冲区），内存与回合长度无关。
+    一个回合只会走到很少一部分格子，访问次数和首次访问步数按扁平索引存在字典中，
+    只有位图的大小与迷宫面积有关（每格1位）。
+    """
+
+    def __init__(self, width: int, height: int, recent_size: int = 64):
+        """
+        Args:
+            width: 迷宫宽度
+            height: 迷宫高度
+            recent_size: 环形缓冲区保留的最近移动步数
+        """
+        self.width = width
+        self.height = height
+        self._bits = bytearray((width * height + 7) >> 3)
+        # 扁平索引 -> 访问次数 / 首次访问的步数，只包含访问过的格子
+        self._counts: Dict[int, int] = {}
+        self._first_step: Dict[int, int] = {}
+        self.recent: Deque[Tuple[int, int]] = deque(maxlen=recent_size)
+        self.unique = 0  # 访问过的不同格子数
+        self.total = 0  # 总访问次数（包含重复访问）
+
+    def visit(self, x: int, y: int, step: int):
+        """记录第 step 步到达 (x, y)"""
+        index = y * self.width + x
+        if not self._bits[index >> 3] >> (index & 7) & 1:
+            self._bits[index >> 3] |= 1 << (index & 7)
+            self._first_step[index] = step
+            self.unique += 1
+        self._counts[index] = self._counts.get(index, 0) + 1
+        self.total += 1
+        self.recent.append((x, y))
+
+    def __contains__(self, pos: Tuple[int, int]) -> bool:
+        # 请求失败或规划无效时位置为None，不是坐标的值一律视为未访问
+        if not isinstance(pos, (tuple, list)) or len(pos) != 2:
+            return False
+        x, y = pos
+        if 0 <= x < self.width and 0 <= y < self.height:
+            index = y * self.width + x
+            return bool(self._bits[index >> 3] >> (index & 7) & 1)
+        return False
+
+    def __len__(self) -> int:
+        return self.unique
+
+    def visit_count(self, x: int, y: int) -> int:
+        """(x, y) 被访问的次数"""
+        return self._counts.get(y * self.width + x, 0)
+
+    def first_visit_step(self, x: int, y: int) -> int:
+        """首次到达 (x, y) 的步数，未访问过时返回-1"""
+        return self._first_step.get(y * self.width + x, -1)
+
+    def recent_moves(self, n: Optional[int] = None) -> List[Tuple[int, int]]:
+        """最近的 n 个位置（按时间顺序，默认为缓冲区中的全部）"""
+        moves = list(self.recent)
+        return moves if n is None else moves[-n:]
+
+    def positions(self):
+        """按首次访问的顺序遍历所有访问过的位置（只遍历访问过的格子，不扫描整个位图）"""
+        width = self.width
+        for index in self._first_step:
+            yield (index % width, index // width)
+
+
+class LoopDetector:
+    """
+    增量循环检测器
+
+    对每个候选周期 p（1..max_period）维护一个计数：最近连续有多少个位置与 p 步之前的
+    位置相同。每次移动把新位置与最近 max_period 个位置各比较一次，开销为 O(max_period)
+    （默认16次比较），与回合长度无关，但不是O(1)。某个周期的计数达到 p * (min_repeats - 1) 时，
+    说明最近的移动把同一段长度为 p 的路径完整重复了 min_repeats 次，即检测到循环；
+    多个周期同时满足时取最小的那个。
+    """
+
+    def __init__(self, max_period: int = 16, min_repeats: int = 2):
+        """
+        Args:
+            max_period: 能检测的最大循环周期（步数）
+            min_repeats: 同一段路径至少完整重复多少次才算循环
+        """
+        self.max_period = max_period
+        self.min_repeats = min_repeats
+        self._history: Deque[Tuple[int, int]] = deque(maxlen=max_period)
+        self._runs = [0] * (max_period + 1)
+        # 最近的移动方向，最多保留 max_period 个，用于描述循环
+        self.directions: Deque[str] = deque(maxlen=max_period)
+        self.period: Optional[int] = None  # 当前检测到的循环周期，没有循环时为None
+        self.repeats = 0  # 当前循环已完整重复的次数
+
+    def update(self, pos: Tuple[int, int]):
+        """记录玩家到达的新位置，并更新循环状态"""
+        history = self._history
+        count = len(history)
+        if count:
+            prev = history[-1]
+            self.directions.append(_DIRECTION_NAMES.get((pos[0] - prev[0], pos[1] - prev[1]), "UNKNOWN"))
+
+        runs = self._runs
+        self.period = None
+        self.repeats = 0
+        for period in range(1, self.max_period + 1):
+            if period <= count and history[count - period] == pos:
+                runs[period] += 1
+                if self.period is None and runs[period] >= period * (self.min_repeats - 1):
+                    self.period = period
+                    self.repeats = runs[period] // period + 1
+            else:
+                runs[period] = 0
+        history.append(pos)
+
+    def recent_directions(self, n: int) -> List[str]:
+        """最近 n 步的移动方向（按时间顺序）"""
+        directions = list(self.directions)
+        return directions[-n:] if n > 0 else []
+
+
+class MazeEngine:
+    """
+    无界面迷宫引擎，持有迷宫、玩家、移动历史与胜利判定
+
+    不依赖pygame和显示设备，可以在CI等无显示环境中以CPU允许的最快速度运行回合。
+    MazeGame 在此基础上只负责渲染和事件处理。
+    """
+
+    def __init__(
+        self,
+        maze_width: int = 21,
+        maze_height: int = 21,
+        verbose: bool = True,
+        algorithm: str = "backtracker",
+        window_size: Optional[int] = None,
+        plan_length: int = 1,
+        max_loop_period: int = 16,
+        seed: Optional[int] = None,
+        maze_store=None,
+        maze_pool=None,
+        maze: Optional[MazeGenerator] = None,
+        distance_hint: Optional[bool] = None
+    ):
+        """
+        Args:
+            seed: 第一个迷宫的种子，之后每次重新生成时种子加1；为None时每个迷宫随机选取种子
+            maze_store: 迷宫库（见 maze_store.MazeStore），设置后从库中取迷宫，没有时生成并保存
+            maze_pool: 迷宫预生成池（见 maze_pool.MazePool），设置后在后台提前生成接下来的迷宫
+            maze: 作为第一个迷宫使用的已有迷宫（如 maze_file.open_maze() 打开的迷宫文件），
+                尺寸、算法、种子、起点和终点都取自该迷宫
+            distance_hint: 是否在每次决策中附带到终点的路径距离（需要距离场）；
+                为None时只对内存中的迷宫附带，mmap 映射的迷宫文件不附带，避免为提示计算整个距离场
+        """
+        if maze is not None:
+            maze_width, maze_height, algorithm, seed = maze.width, maze.height, maze.algorithm, maze.seed
+        self.maze_width = maze_width
+        self.maze_height = maze_height
+        # 是否输出详细日志（无界面批量运行时关闭以免拖慢速度）
+        self.verbose = verbose
+        # 迷宫生成算法，见 MazeGenerator.ALGORITHMS
+        self.algorithm = algorithm
+        # 局部视野大小：为None时向LLM发送完整地图；否则只发送玩家周围 k×k 的窗口，
+        # 每步的提示词长度不再随迷宫大小增长
+        self.window_size = window_size
+        # 规划模式：每次LLM调用最多返回多少步，1表示每次调用只返回一步
+        self.plan_length = plan_length
+        # 循环检测能识别的最大周期（步数）
+        self.max_loop_period = max_loop_period
+
+        # 迷宫种子：指定种子时依次递增，重复运行得到相同的迷宫序列；
+        # seed_queue 中的种子（如语料中的迷宫）优先于递增的种子
+        self.seeded = seed is not None
+        self.seed_queue: Deque[int] = deque()
+        self.maze_store = maze_store
+        self.maze_pool = maze_pool
+        self._distance_hint = distance_hint
+
+        # 生成迷宫；到终点的距离场在首次使用时才计算（预生成池给出的迷宫已附带距离场）
+        if maze is not None:
+            self._set_maze(maze, None)
+        else:
+            self._set_maze(*self._new_maze(seed))
+
+        # 创建玩家（起点）
+        self.player = Player(*self.maze_generator.start)
+
+        # 游戏状态
+        self.won = False
+        # 访问记录（位图 + 访问次数 + 首次访问步数 + 最近移动的环形缓冲区）
+        self.visits = VisitIndex(maze_width, maze_height)
+        self.visits.visit(self.player.x, self.player.y, 0)
+        # 已探索边界：已访问、但仍有未访问通道相邻的格子，每次移动增量更新
+        self.frontier: Set[Tuple[int, int]] = set()
+        self._update_frontier(self.player.x, self.player.y)
+        # 循环检测器，每次移动增量更新
+        self.loop_detector = LoopDetector(max_loop_period)
+        self.loop_detector.update((self.player.x, self.player.y))
+        self.step_count = 0  # 步数统计
+        self.llm_calls = 0  # LLM调用次数
+        self.pending_plan: Deque[Tuple[int, int]] = deque()  # 规划模式下尚未执行的步骤
+        self.episode = 0  # 回合编号，写入决策事件以区分并发运行的回合
+        # 回合录制器（见 episode_record.EpisodeRecorder），为None时不录制
+        self.recorder = None
+
+        # 静态地图缓存（提示词的稳定前缀），迷宫生成器变化时失效
+        self._static_map = ""
+        self._static_map_source: Optional[MazeGenerator] = None
+        self._refill_pool()
+
+    def _log(self, message: str, level: int = logging.INFO):
+        """输出日志（仅在verbose模式下，是否显示由日志级别决定）"""
+        if self.verbose:
+            logger.log(level, message)
+
+    def _generate_maze(self, seed: Optional[int]) -> MazeGenerator:
+        """按种子生成迷宫，设置了迷宫库时从库中取"""
+        if seed is None:
+            seed = new_seed()
+        if self.maze_store is not None:
+            return self.maze_store.get(self.algorithm, self.maze_width, self.maze_height, seed)
+        generator = MazeGenerator(self.maze_width, self.maze_height, self.algorithm, seed)
+        generator.generate()
+        return generator
+
+    def _new_maze(self, seed: Optional[int]) -> Tuple[MazeGenerator, Optional[array]]:
+        """取得新迷宫及其距离场：优先使用预生成池中已经准备好的迷宫，否则距离场为None（首次使用时计算）"""
+        if self.maze_pool is not None:
+            maze = self.maze_pool.take(self.algorithm, self.maze_width, self.maze_height, seed)
+            if maze is not None:
+                # 预生成的迷宫同样写入迷宫库，与直接生成时一致
+                if self.maze_store is not None:
+                    self.maze_store.put(maze[0])
+                return maze
+        return self._generate_maze(seed), None
+
+    def _set_maze(self, generator: MazeGenerator, distances: Optional[array]):
+        """换成新迷宫：起点和终点取自迷宫，距离场为None时在首次使用时计算"""
+        self.maze_generator = generator
+        self._distance_field = distances
+        self.seed = generator.seed
+        self.end_x, self.end_y = generator.goal
+
+    @property
+    def distance_field(self) -> array:
+        """到终点的距离场（按 y * width + x 索引），每个迷宫在首次使用时计算一次"""
+        if self._distance_field is None:
+            self._distance_field = self.maze_generator.compute_distances(self.end_x, self.end_y)
+        return self._distance_field
+
+    @property
+    def distance_hint(self) -> bool:
+        """决策中是否附带到终点的路径距离"""
+        if self._distance_hint is not None:
+            return self._distance_hint
+        return isinstance(self.maze_generator.maze, MazeGrid)
+
+    def _refill_pool(self):
+        """让预生成池开始准备接下来的迷宫"""
+        if self.maze_pool is not None:
+            self.maze_pool.refill(self.algorithm, self.maze_width, self.maze_height,
+                                  self.upcoming_seeds(self.maze_pool.size))
+
+    def upcoming_seeds(self, count: int) -> List[Optional[int]]:
+        """接下来 count 个迷宫的种子（不消耗 seed_queue），None表示随机种子"""
+        seeds: List[Optional[int]] = []
+        last = self.seed
+        for seed in self.seed_queue:
+            if len(seeds) == count:
+                return seeds
+            seeds.append(seed)
+            last = seed
+        while len(seeds) < count:
+            last += 1
+            seeds.append(last if self.seeded else None)
+        return seeds
+
+    def queue_seeds(self, seeds: List[int]):
+        """指定接下来依次使用的迷宫种子（如语料中的迷宫）"""
+        self.seed_queue.extend(seeds)
+        self._refill_pool()
+
+    def next_seed(self) -> Optional[int]:
+        """下一个迷宫的种子：先取 seed_queue，其次在指定过种子时递增，否则为None（随机）"""
+        if self.seed_queue:
+            return self.seed_queue.popleft()
+        if self.seeded:
+            return self.seed + 1
+        return None
+
+    def reset(self, regenerate: bool = True, seed: Optional[int] = None):
+        """
+        重置游戏状态
+
+        Args:
+            regenerate: 是否重新生成迷宫
+            seed: 新迷宫的种子，为None时使用 next_seed()
+        """
+        if regenerate:
+            # 迷宫变化后距离场也随之更换
+            self._set_maze(*self._new_maze(self.next_seed() if seed is None else seed))
+            self.player.start_x, self.player.start_y = self.maze_generator.start
+            self._refill_pool()
+        self.player.reset()
+        self.won = False
+        self.visits = VisitIndex(self.maze_width, self.maze_height)
+        self.visits.visit(self.player.x, self.player.y, 0)
+        self.frontier.clear()
+        self._update_frontier(self.player.x, self.player.y)
+        self.loop_detector = LoopDetector(self.max_loop_period)
+        self.loop_detector.update((self.player.x, self.player.y))
+        self.step_count = 0
+        self.llm_calls = 0
+        self.pending_plan.clear()
+
+    def resize(self, width: int, height: int, seed: Optional[int] = None):
+        """改变迷宫尺寸（必须是奇数）并换成新迷宫"""
+        self.maze_width = width
+        self.maze_height = height
+        self.reset(regenerate=True, seed=seed)
+
+    def check_win(self) -> bool:
+        """检查是否到达终点"""
+        if self.player.x == self.end_x and self.player.y == self.end_y:
+            self.won = True
+        return self.won
+
+    def move_player(self, dx: int, dy: int) -> bool:
+        """按方向移动玩家一步（手动模式），并记录历史与检查胜利"""
+        # 手动移动后，之前规划的路径不再适用
+        self.pending_plan.clear()
+        moved = self.player.move(dx, dy, self.maze_generator)
+        if moved:
+            self._record_move()
+        self.check_win()
+        return moved
+
+    def _record_move(self):
+        """移动后更新步数、访问记录和循环检测"""
+        self.step_count += 1
+        self.visits.visit(self.player.x, self.player.y, self.step_count)
+        self._update_frontier(self.player.x, self.player.y)
+        self.loop_detector.update((self.player.x, self.player.y))
+        if self.recorder is not None:
+            self.recorder.on_move(self.player.x, self.player.y)
+
+    def _update_frontier(self, x: int, y: int):
+        """到达 (x, y) 后更新已探索边界：只有该格子和相邻的已访问格子可能进出边界"""
+        is_wall = self.maze_generator.is_wall
+        visits = self.visits
+        for cx, cy in ((x, y), (x, y - 1), (x, y + 1), (x - 1, y), (x + 1, y)):
+            if (cx, cy) not in visits:
+                continue
+            for dx, dy in ((0, -1), (0, 1), (-1, 0), (1, 0)):
+                nx, ny = cx + dx, cy + dy
+                if not is_wall(nx, ny) and (nx, ny) not in visits:
+                    self.frontier.add((cx, cy))
+                    break
+            else:
+                self.frontier.discard((cx, cy))
+
+    def get_available_directions(self) -> List[str]:
+        """获取当前位置可用的移动方向"""
+        directions = []
+        x, y = self.player.x, self.player.y
+        
+        # 检查四个方向
+        if not self.maze_generator.is_wall(x, y - 1):
+            directions.append("UP")
+        if not self.maze_generator.is_wall(x, y + 1):
+            directions.append("DOWN")
+        if not self.maze_generator.is_wall(x - 1, y):
+            directions.append("LEFT")
+        if not self.maze_generator.is_wall(x + 1, y):
+            directions.append("RIGHT")
+        
+        return directions
+    
+    def _map_rows(self, marks: List[Tuple[int, int, str]]) -> List[str]:
+        """按行整体转换网格字节（0->'.', 1->'W'），再依次写入标记字符"""
+        grid = self.maze_generator.maze
+        rows = [grid.row_bytes(y).translate(_MAP_CHARS).decode("ascii")
+                for y in range(self.maze_height)]
+        for x, y, mark in marks:
+            rows[y] = rows[y][:x] + mark + rows[y][x + 1:]
+        return rows
+    
+    def serialize_maze_state(self) -> str:
+        """将迷宫状态序列化为文本描述"""
+        lines = []
+        lines.append(f"迷宫大小: {self.maze_width} x {self.maze_height}")
+        lines.append("\n迷宫地图 (W=墙, .=通道, P=玩家位置, G=目标位置):")
+        lines.append("")
+        lines.extend(self._map_rows([(self.end_x, self.end_y, "G"), (self.player.x, self.player.y, "P")]))
+        return "\n".join(lines)
+    
+    def serialize_static_map(self) -> str:
+        """
+        序列化不含玩家位置的静态迷宫地图
+        
+        同一个迷宫的结果逐字节相同，作为提示词的稳定前缀以便服务端缓存；
+        每个迷宫只生成一次，迷宫重新生成后自动失效。
+        """
+        if self._static_map_source is not self.maze_generator:
+            lines = []
+            lines.append(f"迷宫大小: {self.maze_width} x {self.maze_height}")
+            lines.append("\n迷宫地图 (W=墙, .=通道, G=目标位置；玩家当前位置见每一步的状态说明):")
+            lines.append("")
+            lines.extend(self._map_rows([(self.end_x, self.end_y, "G")]))
+            self._static_map = "\n".join(lines)
+            self._static_map_source = self.maze_generator
+        return self._static_map
+    
+    def serialize_window_header(self) -> str:
+        """局部视野模式下的静态说明，同一迷宫内保持不变，作为提示词的稳定前缀"""
+        return (
+            f"迷宫大小: {self.maze_width} x {self.maze_height}\n"
+            f"只提供玩家周围 {self.window_size}x{self.window_size} 的局部地图"
+            f" (W=墙, .=通道, o=已访问, P=玩家位置, G=目标位置)，"
+            f"地图以外的区域需要通过探索了解"
+        )
+    
+    def serialize_local_window(self, window_size: int, max_frontier: int = 8) -> str:
+        """
+        序列化玩家周围 k×k 的局部地图，以及已探索边界和目标方向的简要说明
+        
+        Args:
+            window_size: 窗口边长k（偶数会加1，保证玩家位于中心）
+            max_frontier: 最多列出多少个边界格子（离玩家最近的优先）
+        
+        Returns:
+            局部视野的文本描述，长度只与k有关，与迷宫大小无关
+        """
+        radius = window_size // 2
+        px, py = self.player.x, self.player.y
+        visited_set = self.visits
+        is_wall = self.maze_generator.is_wall
+        
+        lines = [f"局部地图 (左上角坐标: ({px - radius}, {py - radius})，越界区域按墙显示):"]
+        for y in range(py - radius, py + radius + 1):
+            line = []
+            for x in range(px - radius, px + radius + 1):
+                if x == px and y == py:
+                    line.append("P")
+                elif x == self.end_x and y == self.end_y:
+                    line.append("G")
+                elif is_wall(x, y):
+                    line.append("W")
+                elif (x, y) in visited_set:
+                    line.append("o")
+                else:
+                    line.append(".")
+            lines.append("".join(line))
+        
+        # 已探索边界由 _update_frontier 增量维护，这里只取离玩家最近的几个（距离相同时按行排列）
+        nearest = heapq.nsmallest(max_frontier, self.frontier,
+                                  key=lambda p: (abs(p[0] - px) + abs(p[1] - py), p[1], p[0]))
+        if nearest:
+            shown = ", ".join(f"({x}, {y})" for x, y in nearest)
+            lines.append(f"\n已探索边界（仍有未探索岔路的已访问位置，共{len(self.frontier)}个，离你最近的）: {shown}")
+        else:
+            lines.append("\n已探索边界: 无")
+        
+        # 目标方向
+        dx, dy = self.end_x - px, self.end_y - py
+        vertical = "下" if dy > 0 else ("上" if dy < 0 else "")
+        horizontal = "右" if dx > 0 else ("左" if dx < 0 else "")
+        lines.append(f"目标方向: {horizontal + vertical or '当前位置'} (dx={dx:+d}, dy={dy:+d})")
+        return "\n".join(lines)
+    
+    def move_to_position(self, target_x: int, target_y: int) -> bool:
+        """移动到指定坐标位置"""
+        # 检查目标位置是否有效且可通行
+        if self.maze_generator.is_wall(target_x, target_y):
+            return False
+        
+        # 检查是否是相邻位置
+        dx = target_x - self.player.x
+        dy = target_y - self.player.y
+        if abs(dx) + abs(dy) != 1:
+            # 如果不是相邻位置，尝试直接设置（可能是LLM返回的坐标）
+            # 但需要验证路径是否可通行
+            if not self.maze_generator.is_wall(target_x, target_y):
+                self.player.x = target_x
+                self.player.y = target_y
+                self._record_move()
+                return True
+            return False
+        
+        # 使用现有的move方法
+        moved = self.player.move(dx, dy, self.maze_generator)
+        if moved:
+            self._record_move()
+        return moved
+    
+    def get_unvisited_adjacent_positions(self) -> List[Tuple[int, int]]:
+        """获取未访问的相邻位置"""
+        unvisited = []
+        x, y = self.player.x, self.player.y
+        
+        for dx, dy in [(0, -1), (0, 1), (-1, 0), (1, 0)]:
+            adj_x, adj_y = x + dx, y + dy
+            if (not self.maze_generator.is_wall(adj_x, adj_y) and 
+                (adj_x, adj_y) not in self.visits):
+                unvisited.append((adj_x, adj_y))
+        
+        return unvisited
+    
+    def detect_loop(self) -> bool:
+        """
+        检测最近的移动是否形成了循环（同一段路径完整重复了至少两次）
+
+        结果由循环检测器在每次移动时增量维护，这里只是读取，
+        周期和重复次数见 loop_detector.period / loop_detector.repeats
+
+        Returns:
+            如果检测到循环返回True，否则返回False
+        """
+        return self.loop_detector.period is not None
+    
+    def get_recent_movement_pattern(self, lookback_steps: int = 6) -> str:
+        """
+        获取最近N步的移动模式描述，用于提示LLM
+        
+        Args:
+            lookback_steps: 没有循环时列出最近多少步
+            
+        Returns:
+            移动模式的文本描述
+        """
+        detector = self.loop_detector
+        if not detector.directions:
+            return "无移动历史"
+        
+        period = detector.period
+        if period is not None:
+            cycle = detector.recent_directions(period)
+            return (f"⚠️ 警告：检测到重复模式！最近 {period * detector.repeats} 步把同一段 {period} 步的路径"
+                    f" ({' -> '.join(cycle)}) 重复了 {detector.repeats} 次，形成了循环移动。请立即改变方向，避免继续重复！")
+        
+        directions = detector.recent_directions(lookback_steps)
+        return f"最近{len(directions)}步移动方向: {' -> '.join(directions)}"
+    
+    def distance_to_goal(self, x: int, y: int) -> Optional[int]:
+        """查询指定位置到终点的迷宫路径距离，墙、越界或不可达时返回None"""
+        if 0 <= x < self.maze_width and 0 <= y < self.maze_height:
+            distance = self.distance_field[y * self.maze_width + x]
+            if distance >= 0:
+                return distance
+        return None
+
+    def _closest_to_target(self, positions: List[Tuple[int, int]]) -> Tuple[int, int]:
+        """从候选位置中选择沿迷宫路径离目标最近的位置（不可达的位置排在最后）"""
+        width = self.maze_width
+        unreachable = len(self.distance_field)
+        def path_distance(p: Tuple[int, int]) -> int:
+            distance = self.distance_field[p[1] * width + p[0]]
+            return distance if distance >= 0 else unreachable
+        return min(positions, key=path_distance)
+
+    def _open_adjacent_positions(self, available_directions: List[str]) -> List[Tuple[int, int]]:
+        """将可用方向转换为相邻坐标"""
+        x, y = self.player.x, self.player.y
+        return [(x + Direction[d].value[0], y + Direction[d].value[1]) for d in available_directions]
+
+    def _validate_plan(self, plan: List[Tuple[int, int]], start: Tuple[int, int]) -> List[Tuple[int, int]]:
+        """返回路径中有效的前缀：每一步都必须可通行且与上一步相邻"""
+        valid = []
+        prev_x, prev_y = start
+        for x, y in plan:
+            if self.maze_generator.is_wall(x, y) or abs(x - prev_x) + abs(y - prev_y) != 1:
+                break
+            valid.append((x, y))
+            prev_x, prev_y = x, y
+        return valid
+
+    def _take_planned_move(self) -> Optional[Tuple[int, int]]:
+        """取出规划路径中的下一步；如果它已不再有效（例如被其他移动打断），丢弃整个规划"""
+        if not self.pending_plan:
+            return None
+        x, y = self.pending_plan.popleft()
+        if self.maze_generator.is_wall(x, y) or abs(x - self.player.x) + abs(y - self.player.y) != 1:
+            self._log(f"   ⚠️  规划路径在 ({x}, {y}) 处失效，丢弃剩余 {len(self.pending_plan)} 步")
+            self.pending_plan.clear()
+            return None
+        return (x, y)
+
+    def _route_to_unexplored(self) -> List[Tuple[int, int]]:
+        """
+        沿已访问的格子到最近的未访问通道格子的最短路径（不含当前位置），没有未探索的位置时返回空列表
+
+        只在循环中且相邻位置都已访问时调用，BFS只经过已访问的格子，开销与已访问的格子数有关。
+        """
+        start = (self.player.x, self.player.y)
+        is_wall = self.maze_generator.is_wall
+        visits = self.visits
+        parents: Dict[Tuple[int, int], Tuple[int, int]] = {start: start}
+        queue = deque([start])
+        while queue:
+            x, y = queue.popleft()
+            for dx, dy in ((0, -1), (0, 1), (-1, 0), (1, 0)):
+                pos = (x + dx, y + dy)
+                if pos in parents or is_wall(*pos):
+                    continue
+                parents[pos] = (x, y)
+                if pos not in visits:
+                    route = [pos]
+                    while route[-1] != start:
+                        route.append(parents[route[-1]])
+                    route.pop()
+                    route.reverse()
+                    return route
+                queue.append(pos)
+        return []
+
+    def _escape_loop(self, available_directions: List[str]) -> Optional[Tuple[int, int]]:
+        """
+        相邻位置都已访问时离开循环的一步
+
+        优先沿已访问的格子走向最近的未探索位置，剩余的路径放入 pending_plan，之后的决策
+        无需调用LLM，避免刚离开循环就被带回去；迷宫已全部探索时，选择不在最近一个周期内的
+        相邻位置中离目标最近的一个。
+        """
+        route = self._route_to_unexplored()
+        if route:
+            self._log(f"\n🛑 检测到循环模式且相邻位置都已访问，沿 {len(route)} 步路径前往最近的未探索位置 {route[-1]}")
+            self.pending_plan.extend(route[1:])
+            return route[0]
+        open_adjacent = self._open_adjacent_positions(available_directions)
+        if not open_adjacent:
+            return None
+        cycle = set(self.visits.recent_moves(self.loop_detector.period))
+        candidates = [p for p in open_adjacent if p not in cycle] or open_adjacent
+        forced_pos = self._closest_to_target(candidates)
+        self._log(f"\n🛑 检测到循环模式，强制选择最近 {self.loop_detector.period} 步以外的位置: {forced_pos}")
+        return forced_pos
+
+    def prepare_decision(self) -> Dict[str, Any]:
+        """
+        收集一次移动决策所需的全部状态
+
+        除访问记录外，上下文只包含快照数据，可以安全地交给后台线程请求LLM；
+        访问记录（visits）是实时索引，请求期间玩家如果移动，回复会作为过期回复被丢弃。
+
+        Returns:
+            决策上下文字典；如果检测到循环，forced_pos 字段给出强制离开循环的位置
+            （见 _escape_loop）；如果规划路径中还有有效的下一步，
+            planned_pos 字段给出该位置。这两种情况都无需调用LLM
+        """
+        self._log(f"\n🎮 自动模式 - 准备调用LLM (步数: {self.step_count})")
+
+        available_directions = self.get_available_directions()
+
+        # 获取未访问的相邻位置
+        unvisited_adjacent = self.get_unvisited_adjacent_positions()
+
+        # 检测循环
+        is_looping = self.detect_loop()
+        recent_pattern = self.get_recent_movement_pattern()
+
+        self._log(f"📋 准备发送给LLM的信息:")
+        self._log(f"   - 未访问相邻位置: {unvisited_adjacent}")
+        if is_looping:
+            self._log(f"   - 循环检测: ⚠️ 检测到循环！周期 {self.loop_detector.period} 步，重复 {self.loop_detector.repeats} 次")
+        else:
+            self._log(f"   - 循环检测: ✅ 无循环")
+        self._log(f"   - {recent_pattern}")
+
+        # 如果检测到循环，强制离开循环：优先选择未访问的相邻位置，
+        # 相邻位置都已访问时沿已访问的格子走到最近的未探索位置
+        forced_pos = None
+        if is_looping:
+            # 循环可能来自之前的规划，丢弃剩余步骤
+            self.pending_plan.clear()
+            if unvisited_adjacent:
+                self._log(f"\n🛑 检测到循环模式，强制选择未访问位置以避免重复移动")
+                # 选择最接近目标的未访问位置
+                forced_pos = self._closest_to_target(unvisited_adjacent)
+                self._log(f"   ✅ 强制选择: {forced_pos} (最接近目标)")
+            else:
+                forced_pos = self._escape_loop(available_directions)
+
+        # 规划模式：优先执行已规划路径中的下一步
+        planned_pos = self._take_planned_move() if forced_pos is None else None
+        if planned_pos is not None:
+            self._log(f"   📜 执行规划路径: {planned_pos} (剩余 {len(self.pending_plan)} 步)")
+        needs_llm = forced_pos is None and planned_pos is None
+        metrics.inc("decisions")
+
+        serialize_start = time.perf_counter()
+        maze_state = self.serialize_window_header() if self.window_size else self.serialize_static_map()
+        local_view = self.serialize_local_window(self.window_size) if self.window_size and needs_llm else ""
+        metrics.observe("serialize", time.perf_counter() - serialize_start)
+
+        return {
+            "maze_state": maze_state,
+            "local_view": local_view,
+            "current_pos": (self.player.x, self.player.y),
+            "target_pos": (self.end_x, self.end_y),
+            "visits": self.visits,
+            "available_directions": available_directions,
+            "unvisited_adjacent": unvisited_adjacent,
+            "is_looping": is_looping,
+            "loop_period": self.loop_detector.period,
+            "loop_repeats": self.loop_detector.repeats,
+            "recent_pattern": recent_pattern,
+            "goal_distance": self.distance_to_goal(self.player.x, self.player.y) if self.distance_hint else None,
+            "forced_pos": forced_pos,
+            "planned_pos": planned_pos,
+            # 本次决策的追踪信息（来源、解析路径、耗时、token用量），执行后写成一条决策事件
+            "trace": {},
+        }
+
+    def request_move(self, decision: Dict[str, Any], llm_client=None):
+        """
+        根据决策上下文获取下一步坐标
+
+        规划模式（plan_length > 1）下调用LLM时返回坐标列表，由 apply_decision 验证并执行。
+
+        没有LLM客户端时使用本地策略（沿距离场选择离目标最近的位置，优先未访问位置），
+        便于在无网络环境下批量运行回合。
+        """
+        local_pos = self._local_move(decision, llm_client)
+        if local_pos is not None:
+            return local_pos
+        kwargs = self._llm_request_kwargs(decision)
+        # LLM客户端在同一上下文中把解析路径和token用量写入追踪信息
+        token = decision_trace.set(decision["trace"])
+        start_time = time.perf_counter()
+        try:
+            if self.plan_length > 1:
+                # 一次调用获取多步路径
+                return llm_client.get_next_plan(**kwargs, max_moves=self.plan_length)
+            # 调用LLM获取下一步移动
+            return llm_client.get_next_move(**kwargs)
+        except Exception as e:
+            decision["trace"]["error"] = str(e)
+            raise
+        finally:
+            decision["trace"]["latency"] = round(time.perf_counter() - start_time, 6)
+            decision_trace.reset(token)
+            self._count_llm_call(decision)
+
+    async def request_move_async(self, decision: Dict[str, Any], llm_client=None):
+        """request_move 的异步版本，llm_client 需要是 AsyncLLMClient"""
+        local_pos = self._local_move(decision, llm_client)
+        if local_pos is not None:
+            return local_pos
+        kwargs = self._llm_request_kwargs(decision)
+        token = decision_trace.set(decision["trace"])
+        start_time = time.perf_counter()
+        try:
+            if self.plan_length > 1:
+                return await llm_client.get_next_plan_async(**kwargs, max_moves=self.plan_length)
+            return await llm_client.get_next_move_async(**kwargs)
+        except Exception as e:
+            decision["trace"]["error"] = str(e)
+            raise
+        finally:
+            decision["trace"]["latency"] = round(time.perf_counter() - start_time, 6)
+            decision_trace.reset(token)
+            self._count_llm_call(decision)
+
+    def _local_move(self, decision: Dict[str, Any], llm_client) -> Optional[Tuple[int, int]]:
+        """不需要调用LLM时直接给出的坐标（强制选择、已规划步骤或本地策略），否则返回None"""
+        if decision["forced_pos"] is not None:
+            decision["trace"]["source"] = "forced"
+            return decision["forced_pos"]
+        if decision["planned_pos"] is not None:
+            decision["trace"]["source"] = "planned"
+            return decision["planned_pos"]
+        decision["trace"]["source"] = "local" if llm_client is None else "llm"
+        if llm_client is None:
+            if decision["unvisited_adjacent"]:
+                return self._closest_to_target(decision["unvisited_adjacent"])
+            # 所有相邻位置都已访问，回溯到离目标最近的位置
+            return self._closest_to_target(self._open_adjacent_positions(decision["available_directions"]))
+        return None
+
+    def _count_llm_call(self, decision: Dict[str, Any]):
+        """统计实际发出的LLM请求：命中决策缓存的决策不计入（缓存命中见 cache_hits 指标）"""
+        if decision["trace"].get("parse") != "cache":
+            self.llm_calls += 1
+
+    def _llm_request_kwargs(self, decision: Dict[str, Any]) -> Dict[str, Any]:
+        """将决策上下文转换为LLM客户端的调用参数"""
+        # 静态迷宫地图（玩家位置等每步变化的状态由LLM客户端放在提示词末尾）
+        maze_state = decision["maze_state"]
+        self._log(f"   - 迷宫状态长度: {len(maze_state) + len(decision['local_view'])} 字符")
+        return {
+            "maze_state": maze_state,
+            "current_pos": decision["current_pos"],
+            "target_pos": decision["target_pos"],
+            "visited": decision["visits"],
+            "available_directions": decision["available_directions"],
+            "is_looping": decision["is_looping"],
+            "recent_pattern": decision["recent_pattern"],
+            "goal_distance": decision["goal_distance"],
+            "local_view": decision["local_view"],
+        }
+
+    def apply_decision(self, decision: Dict[str, Any], next_pos) -> bool:
+        """
+        执行移动决策，失败时回退到离目标最近的未访问相邻位置，或沿距离场回溯
+
+        next_pos 为坐标列表（规划模式）时，只保留从当前位置出发的有效前缀：
+        立即执行第一步，其余步骤留到之后的决策中执行，无需再次调用LLM。
+
+        Returns:
+            是否成功移动
+        """
+        start_time = time.perf_counter()
+        unvisited_adjacent = decision["unvisited_adjacent"]
+        available_directions = decision["available_directions"]
+        choice = next_pos
+
+        if isinstance(next_pos, list):
+            plan = self._validate_plan(next_pos, decision["current_pos"])
+            self._log(f"\n📜 LLM返回 {len(next_pos)} 步规划，其中有效前缀 {len(plan)} 步")
+            if plan:
+                self.pending_plan.extend(plan[1:])
+                next_pos = plan[0]
+            else:
+                # 第一步就无效，直接走下面的失败回退逻辑
+                next_pos = None
+
+        self._log(f"\n🎯 执行移动决策:")
+        self._log(f"   LLM返回的坐标: {next_pos}")
+
+        # 验证：如果LLM返回的位置是已访问的，且存在未访问的相邻位置，则建议改为未访问位置
+        # 但允许回溯（不强制拒绝），因为有时需要回溯才能找到正确路径
+        if next_pos is not None and next_pos in self.visits and unvisited_adjacent:
+            self._log(f"   ⚠️  注意: LLM选择回溯到已访问位置 ({next_pos[0]}, {next_pos[1]})，但存在未访问的相邻位置")
+            self._log(f"   建议改为未访问位置，但如果确实需要回溯，将允许")
+
+        # 执行移动
+        moved = next_pos is not None and self.move_to_position(next_pos[0], next_pos[1])
+
+        if moved:
+            self._log(f"   ✅ 移动成功: ({self.player.x}, {self.player.y})")
+        else:
+            self._log(f"   ❌ 移动失败: 目标位置 {next_pos} 不可达")
+
+        if not moved:
+            metrics.inc("invalid_moves")
+            # 如果移动失败，尝试从未访问的相邻位置中选择
+            if unvisited_adjacent:
+                self._log(f"   🔄 尝试从未访问的相邻位置中选择...")
+                # 选择最接近目标的未访问位置
+                best_pos = self._closest_to_target(unvisited_adjacent)
+                self._log(f"   📍 选择最佳未访问位置: {best_pos}")
+                moved = self.move_to_position(best_pos[0], best_pos[1])
+            elif available_directions:
+                # 如果所有相邻位置都已访问，才允许访问已访问的位置（选择离目标最近的方向）
+                best_x, best_y = self._closest_to_target(self._open_adjacent_positions(available_directions))
+                moved = self.player.move(best_x - self.player.x, best_y - self.player.y, self.maze_generator)
+                if moved:
+                    self._record_move()
+            decision["trace"]["fallback"] = True
+
+        # 检查是否到达终点
+        self.check_win()
+        metrics.observe("move", time.perf_counter() - start_time)
+        self.log_decision(decision, choice, moved)
+        return moved
+
+    def log_decision(self, decision: Dict[str, Any], choice, moved: bool):
+        """
+        把一次决策写成一条结构化事件，并交给回合录制器（两者都未启用时直接返回）
+
+        Args:
+            decision: 决策上下文，其中 trace 字段包含来源、解析路径、耗时和token用量
+            choice: 决策给出的坐标（规划模式下为坐标列表），请求失败时为None
+            moved: 是否成功移动
+        """
+        if self.recorder is None and not events_enabled():
+            return
+        fields = {
+            "episode": self.episode,
+            "step": self.step_count,
+            "pos": decision["current_pos"],
+            "choice": choice,
+            "moved": moved,
+            "new_pos": (self.player.x, self.player.y),
+            "looping": decision["is_looping"],
+            "won": self.won,
+        }
+        fields.update(decision["trace"])
+        if self.recorder is not None:
+            self.recorder.on_decision(fields)
+        log_event("decision", **fields)
+
+    def auto_step(self, llm_client=None) -> bool:
+        """
+        执行一次完整的自动移动（收集状态、获取决策、执行移动）
+
+        LLM请求失败时与 run_episode / run_episode_async 相同：按没有回复处理，
+        由 apply_decision 回退到离目标最近的位置，错误信息记录在决策的追踪信息中。
+        """
+        if self.won:
+            return False
+        decision = self.prepare_decision()
+        try:
+            next_pos = self.request_move(decision, llm_client)
+        except Exception as e:
+            self._log(f"自动移动出错: {e}", logging.WARNING)
+            next_pos = None
+        return self.apply_decision(decision, next_pos)
+
+    def run_episode(self, llm_client=None, max_steps: Optional[int] = None) -> Dict[str, Any]:
+        """
+        无界面运行一个完整回合，不做任何帧率或调用间隔限制
+
+        Args:
+            llm_client: LLM客户端，为None时使用本地策略
+            max_steps: 最大决策次数，默认为迷宫格子数的10倍
+
+        Returns:
+            回合统计：是否成功、步数、决策次数、耗时，以及本回合的指标（metrics 字段）
+        """
+        if max_steps is None:
+            max_steps = self.maze_width * self.maze_height * 10
+
+        start_time = time.perf_counter()
+        decisions = 0
+        errors = 0
+        # 本回合的计数器和分阶段耗时
+        counters: Dict[str, float] = {}
+        token = episode_metrics.set(counters)
+        try:
+            while not self.won and decisions < max_steps:
+                decisions += 1
+                # 与 run_episode_async 使用同一个出错策略：请求失败时传入None，由 apply_decision 回退
+                decision = self.prepare_decision()
+                try:
+                    next_pos = self.request_move(decision, llm_client)
+                except Exception as e:
+                    errors += 1
+                    self._log(f"自动移动出错: {e}", logging.WARNING)
+                    next_pos = None
+                self.apply_decision(decision, next_pos)
+        finally:
+            episode_metrics.reset(token)
+
+        return {
+            "won": self.won,
+            "steps": self.step_count,
+            "decisions": decisions,
+            "llm_calls": self.llm_calls,
+            "errors": errors,
+            "elapsed": time.perf_counter() - start_time,
+            "metrics": counters,
+        }
+
+    async def run_episode_async(self, llm_client=None, max_steps: Optional[int] = None) -> Dict[str, Any]:
+        """
+        run_episode 的异步版本，等待LLM回复时让出事件循环，供批量评测并发运行多个回合
+
+        Args:
+            llm_client: 异步LLM客户端（AsyncLLMClient），为None时使用本地策略
+            max_steps: 最大决策次数，默认为迷宫格子数的10倍
+
+        Returns:
+            回合统计：是否成功、步数、决策次数、耗时，以及本回合的指标（metrics 字段）
+        """
+        if max_steps is None:
+            max_steps = self.maze_width * self.maze_height * 10
+
+        start_time = time.perf_counter()
+        decisions = 0
+        errors = 0
+        # 每个任务有独立的上下文，本回合的指标不会与其他并发回合混在一起
+        counters: Dict[str, float] = {}
+        token = episode_metrics.set(counters)
+        try:
+            while not self.won and decisions < max_steps:
+                decisions += 1
+                decision = self.prepare_decision()
+                try:
+                    next_pos = await self.request_move_async(decision, llm_client)
+                except Exception as e:
+                    errors += 1
+                    self._log(f"自动移动出错: {e}", logging.WARNING)
+                    next_pos = None
+                self.apply_decision(decision, next_pos)
+        finally:
+            episode_metrics.reset(token)
+
+        return {
+            "won": self.won,
+            "steps": self.step_count,
+            "decisions": decisions,
+            "llm_calls": self.llm_calls,
+            "errors": errors,
+            "elapsed": time.perf_counter() - start_time,
+            "metrics": counters,
+        }
+
+
+def run_headless(
+    episodes: int = 1,
+    maze_width: int = 21,
+    maze_height: int = 21,
+    llm_client=None,
+    max_steps: Optional[int] = None,
+    verbose: bool = False,
+    algorithm: str = "backtracker",
+    window_size: Optional[int] = None,
+    plan_length: int = 1,
+    record_dir: Optional[str] = None,
+    seed: Optional[int] = None,
+    seeds: Optional[List[int]] = None,
+    maze_store=None,
+    maze: Optional[MazeGenerator] = None
+) -> List[Dict[str, Any]]:
+    """
+    无界面批量运行多个回合，每个回合使用新生成的迷宫
+
+    Args:
+        record_dir: 设置后把每个回合录制为 record_dir/episode_NNNN.jsonl.gz（可用 replay.py 回放）
+        seed: 第一个回合的迷宫种子，之后依次加1；为None时随机
+        seeds: 依次使用的迷宫种子（如语料中的迷宫），设置后回合数为种子数
+        maze_store: 迷宫库，设置后从库中取迷宫
+        maze: 设置后每个回合都使用这个迷宫（如从迷宫文件打开的基准迷宫），忽略尺寸、算法和种子参数
+
+    Returns:
+        每个回合的统计结果列表，包含迷宫种子
+    """
+    results = []
+    if seeds:
+        episodes, seed = len(seeds), seeds[0]
+    engine = MazeEngine(maze_width, maze_height, verbose=verbose, algorithm=algorithm,
+                        window_size=window_size, plan_length=plan_length, seed=seed, maze_store=maze_store,
+                        maze=maze)
+    if seeds:
+        engine.queue_seeds(seeds[1:])
+    if record_dir:
+        from episode_record import EpisodeRecorder
+        engine.recorder = EpisodeRecorder()
+    for episode in range(episodes):
+        if episode > 0:
+            engine.reset(regenerate=maze is None)
+        engine.episode = episode
+        if engine.recorder is not None:
+            engine.recorder.start(engine)
+        result = engine.run_episode(llm_client, max_steps)
+        result["seed"] = engine.seed
+        if engine.recorder is not None:
+            engine.recorder.save(os.path.join(record_dir, f"episode_{episode:04d}.jsonl.gz"), result)
+        results.append(result)
+    return results
@@ -0,0 +1,250 @@
+"""
+迷宫文件：每格1位的紧凑二进制格式，通过 mmap 读取，超大迷宫不需要整个载入内存
+
+文件结构（小端）：
+    0   4s  魔数 b"MAZP"
+    4   H   版本
+    6   H   数据起始偏移（头部长度）
+    8   I   宽度
+    12  I   高度
+    16  4I  起点 x, y，终点 x, y
+    32  Q   种子
+    40  16s 生成算法（ASCII，末尾补0）
+之后是按行存储的网格，每行 ceil(宽度/8) 字节，高位在前，1=墙，0=通道。
+每行按字节对齐，读取一行或一个格子时只需要定位到对应的字节。
+"""
+
+import argparse
+import mmap
+import os
+import struct
+from typing import BinaryIO, Iterable, Optional, Tuple
+
+from maze_engine import MazeGenerator, MazeGrid
+
+MAGIC = b"MAZP"
+VERSION = 1
+_HEADER = struct.Struct("<4sHHII4IQ16s")
+# 数据从64字节处开始，为以后扩展头部留出空间
+DATA_OFFSET = 64
+
+# 行字节与二进制数字字符之间的转换表
+_BIT_CHARS = bytes.maketrans(b"\x00\x01", b"01")
+_BIT_BYTES = bytes.maketrans(b"01", b"\x00\x01")
+
+
+def _pack_row(row: bytes, stride: int) -> bytes:
+    """把一行网格字节（每格0或1）打包为 stride 字节"""
+    bits = row.translate(_BIT_CHARS) + b"0" * (stride * 8 - len(row))
+    return int(bits, 2).to_bytes(stride, "big")
+
+
+def write_maze(
+    path: str,
+    rows: Iterable[bytes],
+    width: int,
+    height: int,
+    seed: int = 0,
+    algorithm: str = "backtracker",
+    start: Tuple[int, int] = (1, 1),
+    goal: Optional[Tuple[int, int]] = None
+) -> int:
+    """
+    把逐行产出的迷宫写入文件，只需要 O(宽度) 的内存
+
+    Args:
+        rows: 依次产出每一行的字节（1=墙，0=通道），如 MazeGenerator.stream_rows()
+        goal: 终点，默认为右下角 (width - 2, height - 2)
+
+    Returns:
+        写入的字节数
+    """
+    goal = goal or (width - 2, height - 2)
+    stride = (width + 7) // 8
+    header = _HEADER.pack(MAGIC, VERSION, DATA_OFFSET, width, height, *start, *goal, seed,
+                          algorithm.encode("ascii"))
+    count = 0
+    # 先写入同一目录下的临时文件，全部写完并检查通过后再替换目标文件；
+    # 行数或行长度不对、rows 中途抛出异常时删除临时文件，不会留下半截的迷宫文件
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(header.ljust(DATA_OFFSET, b"\x00"))
+            for row in rows:
+                if len(row) != width:
+                    raise ValueError(f"第 {count} 行长度为 {len(row)}，应为 {width}")
+                f.write(_pack_row(row, stride))
+                count += 1
+        if count != height:
+            raise ValueError(f"行数为 {count}，应为 {height}")
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return DATA_OFFSET + stride * height
+
+
+def save_maze(path: str, generator: MazeGenerator) -> int:
+    """
+    保存迷宫生成器中的迷宫
+
+    尚未生成时以流式方式生成（Eller算法只需要 O(宽度) 内存，适合生成超大的基准迷宫）。
+    """
+    return write_maze(path, generator.stream_rows(), generator.width, generator.height,
+                      generator.seed, generator.algorithm, generator.start, generator.goal)
+
+
+def open_maze(path: str) -> MazeGenerator:
+    """
+    以 mmap 方式打开迷宫文件，返回可以直接交给引擎和渲染器使用的迷宫生成器
+
+    起点和终点取自文件头；引擎不会在打开时计算距离场，只在回退策略需要时才计算。
+    """
+    maze = PackedMaze(path)
+    return MazeGenerator.from_grid(maze, maze.algorithm, maze.seed, maze.start, maze.goal)
+
+
+class _PackedCells:
+    """按扁平索引（y * width + x）读取格子，兼容 MazeGrid.cells 的只读访问"""
+
+    __slots__ = ("_maze",)
+
+    def __init__(self, maze: "PackedMaze"):
+        self._maze = maze
+
+    def __len__(self) -> int:
+        return self._maze.width * self._maze.height
+
+    def __getitem__(self, index: int) -> int:
+        if not 0 <= index < len(self):
+            raise IndexError("迷宫格子索引超出范围")
+        y, x = divmod(index, self._maze.width)
+        return self._maze.bit(x, y)
+
+
+class PackedMaze:
+    """
+    mmap 映射的只读迷宫网格
+
+    提供与 MazeGrid 相同的读取接口（get、row_bytes、grid[y][x]、cells[index]、count），
+    MazeGenerator.is_wall、地图序列化和墙壁渲染都可以直接使用；只有被访问到的页才会读入内存，
+    10001×10001 的迷宫文件约 12MB，而展开为 MazeGrid 需要约 100MB。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mmap: Optional[mmap.mmap] = None
+        self._file: BinaryIO = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"迷宫文件为空: {path}")
+        if len(self._mmap) < _HEADER.size:
+            self.close()
+            raise ValueError(f"不是迷宫文件: {path}")
+        (magic, version, offset, width, height, start_x, start_y, goal_x, goal_y, seed,
+         algorithm) = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"不是迷宫文件: {path}")
+        if version > VERSION:
+            self.close()
+            raise ValueError(f"不支持的迷宫文件版本: {version}")
+        self.width = width
+        self.height = height
+        self.start = (start_x, start_y)
+        self.goal = (goal_x, goal_y)
+        self.seed = seed
+        self.algorithm = algorithm.rstrip(b"\x00").decode("ascii")
+        self.stride = (width + 7) // 8
+        self._offset = offset
+        if len(self._mmap) < offset + self.stride * height:
+            self.close()
+            raise ValueError(f"迷宫文件不完整: {path}")
+        self.cells = _PackedCells(self)
+
+    def bit(self, x: int, y: int) -> int:
+        """读取指定格子（1=墙，0=通道）"""
+        return (self._mmap[self._offset + y * self.stride + (x >> 3)] >> (7 - (x & 7))) & 1
+
+    def get(self, x: int, y: int) -> bool:
+        """读取指定格子"""
+        return self.bit(x, y) == 1
+
+    def row_bytes(self, y: int) -> bytes:
+        """返回第y行的字节（每个格子为0或1），与 MazeGrid.row_bytes 相同"""
+        start = self._offset + y * self.stride
+        packed = self._mmap[start:start + self.stride]
+        bits = format(int.from_bytes(packed, "big"), f"0{self.stride * 8}b")[:self.width]
+        return bits.encode("ascii").translate(_BIT_BYTES)
+
+    def __getitem__(self, y: int) -> bytes:
+        """返回第y行，兼容 grid[y][x] 的访问方式"""
+        return self.row_bytes(y)
+
+    def count(self, value: bool = True) -> int:
+        """统计取值为value的格子数量（每行末尾的填充位总是0，不影响墙的计数）"""
+        walls = 0
+        for y in range(self.height):
+            start = self._offset + y * self.stride
+            walls += int.from_bytes(self._mmap[start:start + self.stride], "big").bit_count()
+        return walls if value else self.width * self.height - walls
+
+    def to_grid(self) -> MazeGrid:
+        """展开为可写的 MazeGrid（需要 宽×高 字节的内存）"""
+        grid = MazeGrid(self.width, self.height)
+        for y in range(self.height):
+            grid.cells[y * self.width:(y + 1) * self.width] = self.row_bytes(y)
+        return grid
+
+    def pack(self) -> bytes:
+        """按 MazeGrid.pack() 的格式打包（行之间不对齐）"""
+        return self.to_grid().pack()
+
+    def close(self):
+        """解除映射并关闭文件"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self) -> "PackedMaze":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="创建或查看每格1位的迷宫文件")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="生成迷宫并写入文件（Eller算法以流式生成，内存只与宽度有关）")
+    create.add_argument("path", help="输出文件")
+    create.add_argument("--width", type=int, default=21, help="迷宫宽度（必须是奇数）")
+    create.add_argument("--height", type=int, default=21, help="迷宫高度（必须是奇数）")
+    create.add_argument("--algorithm", choices=MazeGenerator.ALGORITHMS, default="backtracker",
+                        help="迷宫生成算法：backtracker（递归回溯）或 eller（逐行生成）")
+    create.add_argument("--seed", type=int, default=None, help="随机种子，不设置时随机选取")
+    info = commands.add_parser("info", help="输出迷宫文件的头部信息")
+    info.add_argument("path", help="迷宫文件")
+    return parser.parse_args()
+
+
+def main():
+    """主函数"""
+    args = parse_args()
+    if args.command == "create":
+        generator = MazeGenerator(args.width, args.height, args.algorithm, args.seed)
+        size = save_maze(args.path, generator)
+        print(f"已写入 {args.path}: {args.width}x{args.height}, 种子 {generator.seed}, {size} 字节")
+    else:
+        with PackedMaze(args.path) as maze:
+            print(f"迷宫 {maze.width}x{maze.height} ({maze.algorithm}, 种子 {maze.seed}), "
+                  f"起点 {maze.start}, 终点 {maze.goal}, 墙 {maze.count()} 格")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
 import pygame
-import random
+import os
+import re
+import json
 import time
-from typing import List, Tuple, Set, Optional
-from enum import Enum
-from llm_client import LLMClient
-
-# 初始化pygame
-pygame.init()
+import logging
+import cProfile
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+from llm_client import LatencyTracker, LLMClient, run_in_daemon_thread
+from maze_engine import Direction, MazeGenerator, Player, MazeEngine
+from metrics import metrics
 
 # 颜色定义
 BLACK = (0, 0, 0)
@@ -20,167 +23,244 @@ YELLOW = (255, 255, 0)
 CELL_SIZE = 30
 WALL_THICKNESS = 2
 
+logger = logging.getLogger("maze.game")
 
-class Direction(Enum):
-    """方向枚举"""
-    UP = (0, -1)
-    DOWN = (0, 1)
-    LEFT = (-1, 0)
-    RIGHT = (1, 0)
+# 字体查找结果的缓存文件：pygame.font.SysFont 每次启动都要扫描系统字体列表（Linux上调用 fc-list），
+# 缓存解析出的字体文件路径后，之后的启动直接按路径加载
+FONT_CACHE_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "llm-pygame", "fonts.json"
+)
 
+# 匹配网格行字节中连续的墙
+_WALL_RUN = re.compile(rb"\x01+")
 
-class MazeGenerator:
-    """迷宫生成器，使用递归回溯算法"""
-    
-    def __init__(self, width: int, height: int):
-        self.width = width
-        self.height = height
-        # 迷宫网格：True表示墙，False表示通道
-        self.maze = [[True for _ in range(width)] for _ in range(height)]
-        # 访问标记
-        self.visited = [[False for _ in range(width)] for _ in range(height)]
-    
-    def is_valid(self, x: int, y: int) -> bool:
-        """检查坐标是否有效"""
-        return 0 <= x < self.width and 0 <= y < self.height
-    
-    def get_neighbors(self, x: int, y: int) -> List[Tuple[int, int]]:
-        """获取未访问的邻居"""
-        neighbors = []
-        for dx, dy in [(0, -2), (0, 2), (-2, 0), (2, 0)]:
-            nx, ny = x + dx, y + dy
-            if self.is_valid(nx, ny) and not self.visited[ny][nx]:
-                neighbors.append((nx, ny))
-        return neighbors
-    
-    def remove_wall(self, x1: int, y1: int, x2: int, y2: int):
-        """移除两个单元格之间的墙"""
-        # 计算中间位置
-        mx, my = (x1 + x2) // 2, (y1 + y2) // 2
-        self.maze[my][mx] = False
-    
-    def generate(self, start_x: int = 1, start_y: int = 1):
-        """生成迷宫"""
-        # 确保起始位置是奇数（保证边界是墙）
-        if start_x % 2 == 0:
-            start_x += 1
-        if start_y % 2 == 0:
-            start_y += 1
-        
-        # 递归回溯算法
-        stack = [(start_x, start_y)]
-        self.visited[start_y][start_x] = True
-        self.maze[start_y][start_x] = False
-        
-        while stack:
-            x, y = stack[-1]
-            neighbors = self.get_neighbors(x, y)
-            
-            if neighbors:
-                # 随机选择一个未访问的邻居
-                nx, ny = random.choice(neighbors)
-                # 移除墙
-                self.remove_wall(x, y, nx, ny)
-                # 标记为已访问
-                self.visited[ny][nx] = True
-                self.maze[ny][nx] = False
-                # 添加到栈中
-                stack.append((nx, ny))
-            else:
-                # 回溯
-                stack.pop()
-        
-        # 确保起点和终点是通道
-        self.maze[1][1] = False
-        self.maze[self.height - 2][self.width - 2] = False
-    
-    def is_wall(self, x: int, y: int) -> bool:
-        """检查指定位置是否是墙"""
-        if not self.is_valid(x, y):
-            return True
-        return self.maze[y][x]
 
+def _load_font_cache(candidates: List[str]) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """读取缓存的字体查找结果；候选字体列表变化或字体文件已不存在时视为没有缓存"""
+    try:
+        with open(FONT_CACHE_PATH, encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cache, dict) or cache.get("candidates") != candidates:
+        return None
+    path = cache.get("path")
+    if path is not None and not os.path.exists(path):
+        return None
+    return cache.get("name"), path
 
-class Player:
-    """玩家类"""
-    
-    def __init__(self, x: int, y: int):
-        self.x = x
-        self.y = y
-        self.start_x = x
-        self.start_y = y
-    
-    def move(self, dx: int, dy: int, maze: MazeGenerator):
-        """移动玩家"""
-        new_x = self.x + dx
-        new_y = self.y + dy
-        
-        # 检查是否可以移动（不是墙）
-        if not maze.is_wall(new_x, new_y):
-            self.x = new_x
-            self.y = new_y
-            return True
-        return False
-    
-    def reset(self):
-        """重置玩家位置"""
-        self.x = self.start_x
-        self.y = self.start_y
+
+def _save_font_cache(candidates: List[str], name: Optional[str], path: Optional[str]):
+    """保存字体查找结果（写入失败时忽略，下次启动重新查找）"""
+    try:
+        os.makedirs(os.path.dirname(FONT_CACHE_PATH), exist_ok=True)
+        with open(FONT_CACHE_PATH, "w", encoding="utf-8") as f:
+            json.dump({"candidates": candidates, "name": name, "path": path}, f, ensure_ascii=False)
+    except OSError as e:
+        logger.debug(f"无法写入字体缓存 {FONT_CACHE_PATH}: {e}")
 
 
-class MazeGame:
-    """迷宫游戏主类"""
+class MazeGame(MazeEngine):
+    """迷宫游戏主类，在MazeEngine之上负责渲染和事件处理"""
     
     def __init__(
         self,
         maze_width: int = 21,
         maze_height: int = 21,
         auto_mode: bool = False,
-        llm_client: Optional[LLMClient] = None
+        llm_client: Optional[LLMClient] = None,
+        algorithm: str = "backtracker",
+        window_size: Optional[int] = None,
+        plan_length: int = 1,
+        profile_frames: int = 0,
+        profile_output: str = "frame_profile.prof",
+        record_dir: Optional[str] = None,
+        seed: Optional[int] = None,
+        maze_store=None,
+        maze_pool=None,
+        maze: Optional[MazeGenerator] = None
     ):
-        self.maze_width = maze_width
-        self.maze_height = maze_height
-        
-        # 计算窗口大小
-        self.screen_width = maze_width * CELL_SIZE
-        self.screen_height = maze_height * CELL_SIZE
-        
-        # 创建窗口
-        self.screen = pygame.display.set_mode((self.screen_width, self.screen_height))
+        """
+        Args:
+            profile_frames: 启动后用 cProfile 分析的帧数（0表示不分析，游戏中也可以按F4开始）
+            profile_output: 分析结果的输出文件（pstats格式，可用 python -m pstats 查看）
+            record_dir: 设置后把每局游戏录制到该目录（重新开始或退出时保存）
+            seed: 第一个迷宫的种子，按R重新生成时种子加1；为None时随机
+            maze_store: 迷宫库（见 maze_store.MazeStore）
+            maze_pool: 迷宫预生成池（见 maze_pool.MazePool），按R重新开始和改变尺寸时直接换入已生成的迷宫
+            maze: 作为第一个迷宫使用的已有迷宫（如迷宫文件），尺寸取自该迷宫
+        """
+        # 等待预生成池准备好的新尺寸（按 +/- 改变尺寸），准备好之前继续当前迷宫
+        self._pending_size: Optional[Tuple[int, int]] = None
+        # 等待预生成池生成下一个迷宫（按R重新开始），准备好之前继续当前迷宫
+        self._pending_restart = False
+        super().__init__(maze_width, maze_height, algorithm=algorithm, window_size=window_size,
+                         plan_length=plan_length, seed=seed, maze_store=maze_store, maze_pool=maze_pool,
+                         maze=maze)
+        
+        # 只初始化用到的显示和字体子系统（pygame.init() 还会初始化音频等模块，拖慢启动）
+        pygame.display.init()
+        pygame.font.init()
+        
+        # 计算窗口大小并创建窗口
+        self._create_window()
         caption = "迷宫游戏 - 使用方向键移动，到达绿色终点！"
         if auto_mode:
             caption = "迷宫游戏 - AI自动模式 (按T切换手动模式，按R重新开始)"
         pygame.display.set_caption(caption)
         
-        # 生成迷宫
-        self.maze_generator = MazeGenerator(maze_width, maze_height)
-        self.maze_generator.generate()
-        
-        # 创建玩家（起点）
-        self.player = Player(1, 1)
-        
-        # 终点位置
-        self.end_x = maze_width - 2
-        self.end_y = maze_height - 2
-        
         # 游戏状态
         self.running = True
-        self.won = False
         self.clock = pygame.time.Clock()
         
         # 自动模式相关
         self.auto_mode = auto_mode
         self.llm_client = llm_client
-        self.move_history: List[Tuple[int, int]] = [(1, 1)]  # 记录移动历史
         self.last_llm_call_time = 0
         self.llm_call_interval = 1.0  # LLM调用间隔（秒）
-        self.step_count = 0  # 步数统计
+        self.plan_step_interval = 0.15  # 规划模式下执行已规划步骤的间隔（秒），无需调用LLM
+        
+        # 后台LLM请求：每个请求在自己的守护线程中调用LLM，主循环保持绘制和事件响应；
+        # 被丢弃的请求不会挡住下一个请求，退出时也不等待它结束
+        self._pending_move: Optional[Future] = None  # 进行中的LLM请求
+        self._pending_decision: Optional[Dict[str, Any]] = None  # 请求对应的决策上下文
+        self._pending_since = 0.0  # 请求发出的时间
+        self._decision_epoch = 0  # 每次重置游戏时递增，用于丢弃过期的LLM回复
+        
+        # 渲染缓存：静态墙壁图层和上一帧的脏矩形
+        self._wall_surface: Optional[pygame.Surface] = None
+        self._wall_source: Optional[MazeGenerator] = None
+        self._dirty_rects: List[pygame.Rect] = []
+        self._needs_full_redraw = True
+        
+        # 性能浮层（F3切换）：最近帧的处理耗时（不含帧率限制的等待）和绘制耗时
+        self.show_perf = False
+        self.frame_times = LatencyTracker(window=240)
+        self.draw_times = LatencyTracker(window=240)
+        self._perf_lines: List[str] = []
+        self._perf_updated = 0.0
+        
+        # 帧分析：对接下来的若干帧运行 cProfile 并写入文件
+        self.profile_frames = profile_frames or 300
+        self.profile_output = profile_output
+        self._profile_remaining = profile_frames
+        self._profiler: Optional[cProfile.Profile] = None
+        
+        # 回合录制：每局一个文件，按局数编号
+        self.record_dir = record_dir
+        if record_dir:
+            from episode_record import EpisodeRecorder
+            self.recorder = EpisodeRecorder()
+            self.recorder.start(self)
         
         # 初始化字体（支持中文显示）
         self._init_fonts()
     
+    def _create_window(self):
+        """按迷宫尺寸创建（或调整）窗口"""
+        self.screen_width = self.maze_width * CELL_SIZE
+        self.screen_height = self.maze_height * CELL_SIZE
+        self.screen = pygame.display.set_mode((self.screen_width, self.screen_height))
+    
+    def request_resize(self, width: int, height: int):
+        """
+        请求改变迷宫尺寸
+        
+        有预生成池时先在后台生成新尺寸的迷宫，生成完毕后再切换，期间游戏循环不受影响；
+        没有预生成池时立即切换。
+        """
+        width, height = max(width, 5) | 1, max(height, 5) | 1
+        if (width, height) == (self.maze_width, self.maze_height):
+            self._pending_size = None
+            return
+        self._pending_size = (width, height)
+        # 改变尺寸后会换成新尺寸的迷宫，不再等待当前尺寸的下一个迷宫
+        self._pending_restart = False
+        if self.maze_pool is not None:
+            self._refill_pool()
+            logger.info(f"⏳ 正在后台生成 {width}x{height} 的迷宫...")
+        self._apply_pending_resize()
+    
+    def request_restart(self):
+        """
+        按R重新开始
+        
+        与改变尺寸相同：预生成池中的下一个迷宫还没生成完时继续当前迷宫，生成完毕后再切换；
+        池中没有对应的任务时立即在前台生成。
+        """
+        if self._pending_restart or self._pending_size is not None:
+            return
+        if self.maze_pool is not None and self.maze_pool.pending(
+                self.algorithm, self.maze_width, self.maze_height, self.upcoming_seeds(1)[0]):
+            self._pending_restart = True
+            logger.info("⏳ 正在后台生成新迷宫...")
+            self._apply_pending_restart()
+            return
+        self.reset()
+    
+    def _apply_pending_restart(self):
+        """下一个迷宫准备好后重新开始（任务已被取消时直接在前台生成）"""
+        if not self._pending_restart:
+            return
+        seed = self.upcoming_seeds(1)[0]
+        if self.maze_pool.pending(self.algorithm, self.maze_width, self.maze_height, seed) and \
+                not self.maze_pool.ready(self.algorithm, self.maze_width, self.maze_height, seed):
+            return
+        self.reset()
+    
+    def _refill_pool(self):
+        """等待改变尺寸时，预生成池准备的是新尺寸的迷宫"""
+        if self._pending_size is None or self.maze_pool is None:
+            super()._refill_pool()
+            return
+        width, height = self._pending_size
+        self.maze_pool.refill(self.algorithm, width, height, self.upcoming_seeds(self.maze_pool.size))
+    
+    def _apply_pending_resize(self):
+        """新尺寸的迷宫准备好后切换过去"""
+        if self._pending_size is None:
+            return
+        width, height = self._pending_size
+        if self.maze_pool is not None and not self.maze_pool.ready(
+                self.algorithm, width, height, self.upcoming_seeds(1)[0]):
+            return
+        self._pending_size = None
+        self.resize(width, height)
+        self._create_window()
+        self._wall_surface = None
+        self._needs_full_redraw = True
+        logger.info(f"📐 迷宫尺寸: {width}x{height}")
+    
+    def _find_chinese_font(self, chinese_fonts: List[str], test_text: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        按候选列表查找能渲染中文的字体（需要扫描系统字体列表，较慢）
+        
+        Returns:
+            (字体名, 字体文件路径)；路径为None表示pygame默认字体，都不可用时返回 (None, None)
+        """
+        test_char = "中"  # 单个中文字符测试
+        for font_name in chinese_fonts:
+            try:
+                # 与 SysFont 相同：找不到对应的字体文件时使用默认字体
+                font_path = pygame.font.match_font(font_name)
+                test_font = pygame.font.Font(font_path, 14)
+                # 先测试单个中文字符
+                char_surface = test_font.render(test_char, True, WHITE)
+                # 再测试完整文本
+                text_surface = test_font.render(test_text, True, WHITE)
+                
+                # 检查渲染结果是否有效
+                if (char_surface.get_width() > 0 and 
+                    text_surface.get_width() > 0 and
+                    text_surface.get_width() > len(test_text) * 3):  # 确保不是占位符
+                    return font_name, font_path
+            except Exception as e:
+                logger.debug(f"✗ 尝试字体 {font_name} 失败: {e}")
+                continue
+        return None, None
+    
     def _init_fonts(self):
-        """初始化字体，优先使用支持中文的系统字体"""
+        """初始化字体，优先使用支持中文的系统字体（查找结果缓存在磁盘上，之后的启动不再扫描系统字体）"""
         # 优先尝试支持中文的字体（macOS/Linux/Windows）
         # macOS 常用中文字体（按优先级排序）
         chinese_fonts = [
@@ -200,35 +280,28 @@ class MazeGame:
         
         # 测试文本（包含我们要显示的实际字符）
         test_text = "模式: 手动模式 | 步数: 0"
-        test_char = "中"  # 单个中文字符测试
+        
+        cached = _load_font_cache(chinese_fonts)
+        if cached is not None:
+            font_name, font_path = cached
+        else:
+            font_name, font_path = self._find_chinese_font(chinese_fonts, test_text)
+            _save_font_cache(chinese_fonts, font_name, font_path)
         
         # 标记是否找到支持中文的字体
         chinese_font_found = False
-        
-        for font_name in chinese_fonts:
+        if font_name is not None:
             try:
-                test_font = pygame.font.SysFont(font_name, 14)
-                # 先测试单个中文字符
-                char_surface = test_font.render(test_char, True, WHITE)
-                # 再测试完整文本
-                text_surface = test_font.render(test_text, True, WHITE)
-                
-                # 检查渲染结果是否有效
-                if (char_surface.get_width() > 0 and 
-                    text_surface.get_width() > 0 and
-                    text_surface.get_width() > len(test_text) * 3):  # 确保不是占位符
-                    font_small = test_font
-                    font_large = pygame.font.SysFont(font_name, 40)
-                    chinese_font_found = True
-                    print(f"✓ 成功加载支持中文的字体: {font_name}")
-                    break
+                font_small = pygame.font.Font(font_path, 14)
+                font_large = pygame.font.Font(font_path, 40)
+                chinese_font_found = True
+                logger.info(f"✓ 成功加载支持中文的字体: {font_name}" + ("（缓存）" if cached is not None else ""))
             except Exception as e:
-                print(f"✗ 尝试字体 {font_name} 失败: {e}")
-                continue
+                logger.debug(f"✗ 加载字体 {font_name} ({font_path}) 失败: {e}")
         
         # 如果所有中文字体都不可用，使用默认字体
         if not chinese_font_found:
-            print("⚠ 警告: 未找到支持中文的字体，将使用默认字体（可能无法正确显示中文）")
+            logger.warning("⚠ 警告: 未找到支持中文的字体，将使用默认字体（可能无法正确显示中文）")
             try:
                 font_small = pygame.font.Font(None, 28)
                 font_large = pygame.font.Font(None, 40)
@@ -237,7 +310,7 @@ class MazeGame:
                     font_small = pygame.font.SysFont('Arial', 28)
                     font_large = pygame.font.SysFont('Arial', 40)
                 except Exception as e:
-                    print(f"✗ 创建默认字体失败: {e}")
+                    logger.warning(f"✗ 创建默认字体失败: {e}")
         
         # 确保字体已初始化
         if font_small is None or font_large is None:
@@ -247,314 +320,124 @@ class MazeGame:
         try:
             test_surface = font_small.render(test_text, True, WHITE)
             if test_surface.get_width() == 0:
-                print("⚠ 警告: 字体可能不支持中文显示，将使用英文文本")
+                logger.warning("⚠ 警告: 字体可能不支持中文显示，将使用英文文本")
                 self.use_chinese = False
             else:
                 self.use_chinese = True
         except Exception as e:
-            print(f"⚠ 字体测试失败: {e}，将使用英文文本")
+            logger.warning(f"⚠ 字体测试失败: {e}，将使用英文文本")
             self.use_chinese = False
         
         # 赋值给实例变量
         self.font_small = font_small
         self.font_large = font_large
     
-    def get_available_directions(self) -> List[str]:
-        """获取当前位置可用的移动方向"""
-        directions = []
-        x, y = self.player.x, self.player.y
-        
-        # 检查四个方向
-        if not self.maze_generator.is_wall(x, y - 1):
-            directions.append("UP")
-        if not self.maze_generator.is_wall(x, y + 1):
-            directions.append("DOWN")
-        if not self.maze_generator.is_wall(x - 1, y):
-            directions.append("LEFT")
-        if not self.maze_generator.is_wall(x + 1, y):
-            directions.append("RIGHT")
-        
-        return directions
+    @property
+    def ai_thinking(self) -> bool:
+        """是否有进行中的LLM请求"""
+        return self._pending_move is not None
     
-    def serialize_maze_state(self) -> str:
-        """将迷宫状态序列化为文本描述"""
-        lines = []
-        lines.append(f"迷宫大小: {self.maze_width} x {self.maze_height}")
-        lines.append("\n迷宫地图 (W=墙, .=通道, P=玩家位置, G=目标位置):")
-        lines.append("")
-        
-        for y in range(self.maze_height):
-            line = ""
-            for x in range(self.maze_width):
-                if x == self.player.x and y == self.player.y:
-                    line += "P"
-                elif x == self.end_x and y == self.end_y:
-                    line += "G"
-                elif self.maze_generator.is_wall(x, y):
-                    line += "W"
-                else:
-                    line += "."
-            lines.append(line)
-        
-        return "\n".join(lines)
+    def _request_move_in_background(self, decision: Dict[str, Any], epoch: int):
+        """在后台线程中执行的LLM请求，返回(决策轮次, 坐标)"""
+        return epoch, self.request_move(decision, self.llm_client)
     
-    def move_to_position(self, target_x: int, target_y: int) -> bool:
-        """移动到指定坐标位置"""
-        # 检查目标位置是否有效且可通行
-        if self.maze_generator.is_wall(target_x, target_y):
-            return False
-        
-        # 检查是否是相邻位置
-        dx = target_x - self.player.x
-        dy = target_y - self.player.y
-        if abs(dx) + abs(dy) != 1:
-            # 如果不是相邻位置，尝试直接设置（可能是LLM返回的坐标）
-            # 但需要验证路径是否可通行
-            if not self.maze_generator.is_wall(target_x, target_y):
-                self.player.x = target_x
-                self.player.y = target_y
-                self.move_history.append((target_x, target_y))
-                self.step_count += 1
-                return True
-            return False
-        
-        # 使用现有的move方法
-        moved = self.player.move(dx, dy, self.maze_generator)
-        if moved:
-            self.move_history.append((self.player.x, self.player.y))
-            self.step_count += 1
-        return moved
+    def _discard_pending_move(self):
+        """丢弃进行中的LLM请求（已在运行的请求无法中断，在守护线程中自然结束，其回复被忽略）"""
+        if self._pending_move is not None:
+            self._pending_move.cancel()
+        self._pending_move = None
+        self._pending_decision = None
     
-    def get_unvisited_adjacent_positions(self) -> List[Tuple[int, int]]:
-        """获取未访问的相邻位置"""
-        unvisited = []
-        x, y = self.player.x, self.player.y
-        visited_set = set(self.move_history)
-        
-        for dx, dy in [(0, -1), (0, 1), (-1, 0), (1, 0)]:
-            adj_x, adj_y = x + dx, y + dy
-            if (not self.maze_generator.is_wall(adj_x, adj_y) and 
-                (adj_x, adj_y) not in visited_set):
-                unvisited.append((adj_x, adj_y))
-        
-        return unvisited
+    def reset(self, regenerate: bool = True, seed: Optional[int] = None):
+        """重置游戏状态，并丢弃针对旧迷宫的LLM回复"""
+        self._decision_epoch += 1
+        self._pending_restart = False
+        self._discard_pending_move()
+        self._save_recording()
+        super().reset(regenerate, seed)
+        if regenerate:
+            logger.info(f"🎲 新迷宫，种子: {self.seed}")
+        if self.recorder is not None:
+            self.episode += 1
+            self.recorder.start(self)
     
-    def detect_loop(self, lookback_steps: int = 8) -> bool:
-        """
-        检测最近N步是否形成了循环模式（来回重复移动）
-        
-        Args:
-            lookback_steps: 检查最近多少步
-            
-        Returns:
-            如果检测到循环返回True，否则返回False
-        """
-        if len(self.move_history) < lookback_steps:
-            return False
-        
-        # 获取最近N步的位置
-        recent_positions = self.move_history[-lookback_steps:]
-        
-        # 检测模式1: 检查是否有位置重复出现（来回移动）
-        # 如果最近N步中有超过一半的位置是重复的，可能是在循环
-        position_counts = {}
-        for pos in recent_positions:
-            position_counts[pos] = position_counts.get(pos, 0) + 1
-        
-        # 如果某个位置出现3次或以上，且总步数>=6，可能是循环
-        max_repeats = max(position_counts.values()) if position_counts else 0
-        if max_repeats >= 3 and len(recent_positions) >= 6:
-            # 检查是否是简单的来回模式（A->B->A->B）
-            if len(recent_positions) >= 4:
-                # 检查最近4步是否形成ABAB模式
-                last_4 = recent_positions[-4:]
-                if last_4[0] == last_4[2] and last_4[1] == last_4[3] and last_4[0] != last_4[1]:
-                    return True
-                # 检查最近6步是否形成ABCABC模式
-                if len(recent_positions) >= 6:
-                    last_6 = recent_positions[-6:]
-                    if (last_6[0] == last_6[3] and last_6[1] == last_6[4] and 
-                        last_6[2] == last_6[5] and len(set(last_6[:3])) == 3):
-                        return True
-        
-        # 检测模式2: 检查是否在同一个区域反复移动（位置变化很小）
-        if len(recent_positions) >= 6:
-            # 计算最近N步的坐标范围
-            x_coords = [p[0] for p in recent_positions]
-            y_coords = [p[1] for p in recent_positions]
-            x_range = max(x_coords) - min(x_coords)
-            y_range = max(y_coords) - min(y_coords)
-            # 如果坐标范围很小（<=2），且步数很多，可能是在小范围内循环
-            if x_range <= 2 and y_range <= 2 and len(recent_positions) >= 6:
-                return True
-        
-        return False
+    def _save_recording(self):
+        """保存当前这局的录制（没有任何移动时跳过）"""
+        if self.recorder is None or not self.recorder.codes:
+            return
+        path = os.path.join(self.record_dir, f"episode_{self.episode:04d}.jsonl.gz")
+        self.recorder.save(path, {"won": self.won, "steps": self.step_count, "llm_calls": self.llm_calls})
+        logger.info(f"💾 已保存回合录制: {path}")
     
-    def get_recent_movement_pattern(self, lookback_steps: int = 6) -> str:
-        """
-        获取最近N步的移动模式描述，用于提示LLM
+    def _collect_pending_move(self):
+        """如果后台LLM请求已完成，在主线程中应用其结果"""
+        future = self._pending_move
+        if future is None or not future.done():
+            return
+        decision = self._pending_decision
+        self._pending_move = None
+        self._pending_decision = None
+        self.last_llm_call_time = time.time()
         
-        Args:
-            lookback_steps: 检查最近多少步
-            
-        Returns:
-            移动模式的文本描述
-        """
-        if len(self.move_history) < 2:
-            return "无移动历史"
-        
-        recent_steps = min(lookback_steps, len(self.move_history))
-        recent_positions = self.move_history[-recent_steps:]
-        
-        # 计算移动方向序列
-        directions = []
-        for i in range(1, len(recent_positions)):
-            prev = recent_positions[i-1]
-            curr = recent_positions[i]
-            dx = curr[0] - prev[0]
-            dy = curr[1] - prev[1]
-            
-            if dx == 0 and dy == -1:
-                directions.append("UP")
-            elif dx == 0 and dy == 1:
-                directions.append("DOWN")
-            elif dx == -1 and dy == 0:
-                directions.append("LEFT")
-            elif dx == 1 and dy == 0:
-                directions.append("RIGHT")
-            else:
-                directions.append("UNKNOWN")
-        
-        # 检测重复模式
-        if len(directions) >= 4:
-            # 检查ABAB模式
-            if (directions[-4] == directions[-2] and 
-                directions[-3] == directions[-1] and 
-                directions[-4] != directions[-3]):
-                return f"⚠️ 警告：检测到重复模式！最近4步: {' -> '.join(directions[-4:])}，形成了来回移动的循环。请立即改变方向，避免继续重复！"
-            
-            # 检查ABCABC模式
-            if len(directions) >= 6:
-                if (directions[-6] == directions[-3] and 
-                    directions[-5] == directions[-2] and 
-                    directions[-4] == directions[-1]):
-                    return f"⚠️ 警告：检测到重复模式！最近6步: {' -> '.join(directions[-6:])}，形成了循环移动。请立即改变方向！"
-        
-        return f"最近{recent_steps}步移动方向: {' -> '.join(directions)}"
+        try:
+            epoch, next_pos = future.result()
+        except Exception as e:
+            logger.warning(f"自动移动出错: {e}")
+            self.log_decision(decision, None, False)
+            return
+        
+        # 迷宫已重新生成、已切换到手动模式或玩家位置已变化，回复已过期
+        if (epoch != self._decision_epoch or not self.auto_mode or self.won or
+                decision["current_pos"] != (self.player.x, self.player.y)):
+            logger.info(f"   🗑️  丢弃过期的LLM回复: {next_pos}")
+            decision["trace"]["stale"] = True
+            self.log_decision(decision, next_pos, False)
+            return
+        
+        try:
+            self.apply_decision(decision, next_pos)
+        except Exception as e:
+            logger.warning(f"自动移动出错: {e}")
     
     def handle_auto_move(self):
-        """处理自动移动逻辑"""
+        """处理自动移动逻辑（非阻塞：LLM请求在后台线程中进行）"""
+        # 先处理已经返回的LLM回复
+        self._collect_pending_move()
+        
         if not self.auto_mode or self.won or not self.llm_client:
             return
         
+        # 上一个请求还在进行中，主循环继续绘制
+        if self._pending_move is not None:
+            return
+        
         current_time = time.time()
-        # 检查是否到了调用LLM的时间
-        if current_time - self.last_llm_call_time < self.llm_call_interval:
+        # 检查是否到了调用LLM的时间（执行已规划的步骤时使用更短的间隔）
+        interval = self.plan_step_interval if self.pending_plan else self.llm_call_interval
+        if current_time - self.last_llm_call_time < interval:
             return
         
         try:
-            print(f"\n🎮 自动模式 - 准备调用LLM (步数: {self.step_count})")
-            
-            # 获取迷宫状态
-            maze_state = self.serialize_maze_state()
-            current_pos = (self.player.x, self.player.y)
-            target_pos = (self.end_x, self.end_y)
-            available_directions = self.get_available_directions()
-            
-            # 获取未访问的相邻位置
-            unvisited_adjacent = self.get_unvisited_adjacent_positions()
-            
-            # 检测循环
-            is_looping = self.detect_loop()
-            recent_pattern = self.get_recent_movement_pattern()
-            
-            print(f"📋 准备发送给LLM的信息:")
-            print(f"   - 迷宫状态长度: {len(maze_state)} 字符")
-            print(f"   - 未访问相邻位置: {unvisited_adjacent}")
-            print(f"   - 循环检测: {'⚠️ 检测到循环！' if is_looping else '✅ 无循环'}")
-            print(f"   - {recent_pattern}")
-            
-            # 如果检测到循环，且存在未访问的相邻位置，强制选择未访问位置
-            if is_looping and unvisited_adjacent:
-                print(f"\n🛑 检测到循环模式，强制选择未访问位置以避免重复移动")
-                # 选择最接近目标的未访问位置
-                best_pos = min(unvisited_adjacent, 
-                             key=lambda p: abs(p[0] - target_pos[0]) + abs(p[1] - target_pos[1]))
-                print(f"   ✅ 强制选择: {best_pos} (最接近目标)")
-                next_pos = best_pos
-            else:
-                # 调用LLM获取下一步移动
-                next_pos = self.llm_client.get_next_move(
-                    maze_state,
-                    current_pos,
-                    target_pos,
-                    self.move_history,
-                    available_directions,
-                    is_looping,
-                    recent_pattern
-                )
-            
-            # 更新最后调用时间
-            self.last_llm_call_time = current_time
-            
-            print(f"\n🎯 执行移动决策:")
-            print(f"   LLM返回的坐标: {next_pos}")
-            
-            # 验证：如果LLM返回的位置是已访问的，且存在未访问的相邻位置，则建议改为未访问位置
-            # 但允许回溯（不强制拒绝），因为有时需要回溯才能找到正确路径
-            if next_pos in self.move_history and unvisited_adjacent:
-                print(f"   ⚠️  注意: LLM选择回溯到已访问位置 ({next_pos[0]}, {next_pos[1]})，但存在未访问的相邻位置")
-                print(f"   建议改为未访问位置，但如果确实需要回溯，将允许")
-                # 可以选择改为未访问位置，但这里我们信任LLM的判断，允许回溯
-                # 如果希望强制避免回溯，可以取消下面的注释：
-                # best_pos = min(unvisited_adjacent, 
-                #              key=lambda p: abs(p[0] - target_pos[0]) + abs(p[1] - target_pos[1]))
-                # next_pos = best_pos
-                # print(f"✅ 改为移动到: ({next_pos[0]}, {next_pos[1]})")
-            
-            # 执行移动
-            moved = self.move_to_position(next_pos[0], next_pos[1])
-            
-            if moved:
-                print(f"   ✅ 移动成功: ({self.player.x}, {self.player.y})")
-            else:
-                print(f"   ❌ 移动失败: 目标位置 {next_pos} 不可达")
-            
-            if not moved:
-                # 如果移动失败，尝试从未访问的相邻位置中选择
-                if unvisited_adjacent:
-                    print(f"   🔄 尝试从未访问的相邻位置中选择...")
-                    # 选择最接近目标的未访问位置
-                    best_pos = min(unvisited_adjacent, 
-                                 key=lambda p: abs(p[0] - target_pos[0]) + abs(p[1] - target_pos[1]))
-                    print(f"   📍 选择最佳未访问位置: {best_pos}")
-                    moved = self.move_to_position(best_pos[0], best_pos[1])
-                elif available_directions:
-                    # 如果所有相邻位置都已访问，才允许访问已访问的位置
-                    import random
-                    direction = random.choice(available_directions)
-                    if direction == "UP":
-                        _ = self.player.move(0, -1, self.maze_generator)
-                    elif direction == "DOWN":
-                        _ = self.player.move(0, 1, self.maze_generator)
-                    elif direction == "LEFT":
-                        _ = self.player.move(-1, 0, self.maze_generator)
-                    elif direction == "RIGHT":
-                        _ = self.player.move(1, 0, self.maze_generator)
-                    if (self.player.x, self.player.y) not in self.move_history:
-                        self.move_history.append((self.player.x, self.player.y))
-                    self.step_count += 1
-            
-            # 检查是否到达终点
-            if self.player.x == self.end_x and self.player.y == self.end_y:
-                self.won = True
-            
-            self.last_llm_call_time = current_time
-        
+            decision = self.prepare_decision()
         except Exception as e:
-            print(f"自动移动出错: {e}")
+            logger.warning(f"自动移动出错: {e}")
             # 出错时也更新时间，避免频繁重试
             self.last_llm_call_time = current_time
+            return
+        
+        # 与无界面模式相同，经由 _local_move 取强制选择或已规划的步骤，并在追踪信息中记录来源
+        local_pos = self._local_move(decision, self.llm_client)
+        if local_pos is not None:
+            # 强制选择的位置和已规划的步骤无需调用LLM，直接执行
+            self.apply_decision(decision, local_pos)
+            self.last_llm_call_time = current_time
+            return
+        
+        self._pending_decision = decision
+        self._pending_since = current_time
+        self._pending_move = run_in_daemon_thread(
+            self._request_move_in_background, decision, self._decision_epoch
+        )
     
     def handle_events(self):
         """处理事件"""
@@ -573,43 +456,98 @@ class MazeGame:
                             caption = "迷宫游戏 - 手动模式 (使用方向键移动，按T切换自动模式，按R重新开始)"
                         pygame.display.set_caption(caption)
                 elif event.key == pygame.K_r:
-                    # 重新生成迷宫
-                    self.maze_generator = MazeGenerator(self.maze_width, self.maze_height)
-                    self.maze_generator.generate()
-                    self.player.reset()
-                    self.won = False
-                    self.move_history = [(1, 1)]
-                    self.step_count = 0
+                    # 重新生成迷宫（下一个迷宫还在后台生成时，生成完毕后再切换）
+                    self.request_restart()
+                elif event.key in (pygame.K_EQUALS, pygame.K_PLUS, pygame.K_KP_PLUS):
+                    # 放大迷宫
+                    size = self._pending_size or (self.maze_width, self.maze_height)
+                    self.request_resize(size[0] + 10, size[1] + 10)
+                elif event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+                    # 缩小迷宫
+                    size = self._pending_size or (self.maze_width, self.maze_height)
+                    self.request_resize(size[0] - 10, size[1] - 10)
+                elif event.key == pygame.K_F3:
+                    # 切换性能浮层；关闭后整屏重绘以擦除浮层
+                    self.show_perf = not self.show_perf
+                    self._needs_full_redraw = True
+                elif event.key == pygame.K_F4:
+                    # 开始分析接下来的若干帧
+                    if self._profiler is None:
+                        self._profile_remaining = self.profile_frames
                 elif not self.won and not self.auto_mode:
                     # 手动模式下的移动控制
-                    moved = False
                     if event.key == pygame.K_UP or event.key == pygame.K_w:
-                        moved = self.player.move(0, -1, self.maze_generator)
+                        self.move_player(0, -1)
                     elif event.key == pygame.K_DOWN or event.key == pygame.K_s:
-                        moved = self.player.move(0, 1, self.maze_generator)
+                        self.move_player(0, 1)
                     elif event.key == pygame.K_LEFT or event.key == pygame.K_a:
-                        moved = self.player.move(-1, 0, self.maze_generator)
+                        self.move_player(-1, 0)
                     elif event.key == pygame.K_RIGHT or event.key == pygame.K_d:
-                        moved = self.player.move(1, 0, self.maze_generator)
-                    
-                    if moved:
-                        self.move_history.append((self.player.x, self.player.y))
-                        self.step_count += 1
-                    
-                    # 检查是否到达终点
-                    if self.player.x == self.end_x and self.player.y == self.end_y:
-                        self.won = True
+                        self.move_player(1, 0)
     
-    def draw(self):
-        """绘制游戏画面"""
-        self.screen.fill(BLACK)
+    def _build_wall_surface(self) -> pygame.Surface:
+        """将迷宫墙壁预渲染到一个静态图层上，只在迷宫重新生成时调用"""
+        surface = pygame.Surface((self.screen_width, self.screen_height)).convert()
+        surface.fill(BLACK)
         
-        # 绘制迷宫
+        # 直接扫描网格的行字节，按行合并连续的墙，减少填充调用次数
+        grid = self.maze_generator.maze
         for y in range(self.maze_height):
-            for x in range(self.maze_width):
-                if self.maze_generator.is_wall(x, y):
-                    rect = pygame.Rect(x * CELL_SIZE, y * CELL_SIZE, CELL_SIZE, CELL_SIZE)
-                    pygame.draw.rect(self.screen, WHITE, rect)
+            for run in _WALL_RUN.finditer(grid.row_bytes(y)):
+                surface.fill(WHITE, pygame.Rect(
+                    run.start() * CELL_SIZE, y * CELL_SIZE,
+                    (run.end() - run.start()) * CELL_SIZE, CELL_SIZE
+                ))
+        return surface
+    
+    def _get_wall_surface(self) -> pygame.Surface:
+        """获取缓存的墙壁图层，迷宫生成器变化时重建"""
+        if self._wall_surface is None or self._wall_source is not self.maze_generator:
+            self._wall_surface = self._build_wall_surface()
+            self._wall_source = self.maze_generator
+            # 背景变化后需要整屏刷新
+            self._dirty_rects = []
+            self._needs_full_redraw = True
+        return self._wall_surface
+    
+    def _draw_text_box(self, text: str, padding: int, alpha: int,
+                       topleft: Optional[Tuple[int, int]] = None) -> pygame.Rect:
+        """绘制带半透明背景框的文本，未指定位置时居中显示，返回占用的矩形区域"""
+        text_surface = self.font_small.render(text, True, WHITE)
+        text_width, text_height = text_surface.get_size()
+        box_size = (text_width + padding * 2, text_height + padding * 2)
+        
+        if topleft is None:
+            bg_rect = pygame.Rect((0, 0), box_size)
+            bg_rect.center = (self.screen_width // 2, self.screen_height // 2)
+        else:
+            bg_rect = pygame.Rect(topleft, box_size)
+        
+        # 创建半透明黑色背景框
+        bg_surface = pygame.Surface(box_size)
+        bg_surface.set_alpha(alpha)
+        bg_surface.fill(BLACK)
+        self.screen.blit(bg_surface, bg_rect)
+        
+        # 绘制文本
+        self.screen.blit(text_surface, text_surface.get_rect(center=bg_rect.center))
+        return bg_rect
+    
+    def draw(self):
+        """
+        绘制游戏画面
+        
+        墙壁只在迷宫变化时预渲染一次；每帧先用墙壁图层擦除上一帧的玩家、终点和文字区域，
+        再重新绘制它们，最后只刷新这些脏矩形，而不是整屏重绘。
+        """
+        wall_surface = self._get_wall_surface()
+        
+        if self._needs_full_redraw:
+            self.screen.blit(wall_surface, (0, 0))
+        else:
+            # 用静态图层恢复上一帧绘制过的区域
+            for rect in self._dirty_rects:
+                self.screen.blit(wall_surface, rect, rect)
         
         # 绘制终点
         end_rect = pygame.Rect(
@@ -634,24 +572,22 @@ class MazeGame:
         if getattr(self, 'use_chinese', True):
             mode_text = "自动模式" if self.auto_mode else "手动模式"
             info_text = f"模式: {mode_text} | 步数: {self.step_count}"
+            if self.ai_thinking:
+                info_text += f" | AI思考中... {time.time() - self._pending_since:.1f}s"
+            if self._pending_restart or self._pending_size is not None:
+                info_text += " | 正在生成新迷宫..."
         else:
             mode_text = "Auto" if self.auto_mode else "Manual"
             info_text = f"Mode: {mode_text} | Steps: {self.step_count}"
+            if self.ai_thinking:
+                info_text += f" | AI thinking... {time.time() - self._pending_since:.1f}s"
+            if self._pending_restart or self._pending_size is not None:
+                info_text += " | Generating maze..."
+        hud_rect = self._draw_text_box(info_text, padding=8, alpha=200, topleft=(5, 5))
         
-        # 渲染文本
-        mode_surface = self.font_small.render(info_text, True, WHITE)
-        text_width, text_height = mode_surface.get_size()
-        
-        # 创建半透明黑色背景框
-        padding = 8
-        bg_rect = pygame.Rect(5, 5, text_width + padding * 2, text_height + padding * 2)
-        bg_surface = pygame.Surface((text_width + padding * 2, text_height + padding * 2))
-        bg_surface.set_alpha(200)  # 半透明
-        bg_surface.fill(BLACK)
-        self.screen.blit(bg_surface, bg_rect)
-        
-        # 绘制文本
-        self.screen.blit(mode_surface, (5 + padding, 5 + padding))
+        frame_rects = [end_rect, player_rect, hud_rect]
+        if self.show_perf:
+            frame_rects.append(self._draw_perf_overlay((5, hud_rect.bottom + 5)))
         
         # 如果获胜，显示提示（带半透明背景框）
         if self.won:
@@ -659,37 +595,116 @@ class MazeGame:
                 win_text = f"恭喜！你赢了！步数: {self.step_count} | 按R重新开始"
             else:
                 win_text = f"Congratulations! Steps: {self.step_count} | Press R to restart"
-            text_surface = self.font_small.render(win_text, True, WHITE)
-            text_width, text_height = text_surface.get_size()
-            
-            # 创建半透明黑色背景框
-            padding = 15
-            bg_rect = pygame.Rect(
-                (self.screen_width - text_width - padding * 2) // 2,
-                (self.screen_height - text_height - padding * 2) // 2,
-                text_width + padding * 2,
-                text_height + padding * 2
-            )
-            bg_surface = pygame.Surface((text_width + padding * 2, text_height + padding * 2))
-            bg_surface.set_alpha(220)  # 半透明
-            bg_surface.fill(BLACK)
-            self.screen.blit(bg_surface, bg_rect)
-            
-            # 绘制文本
-            text_rect = text_surface.get_rect(center=(self.screen_width // 2, self.screen_height // 2))
-            self.screen.blit(text_surface, text_rect)
-        
-        pygame.display.flip()
+            frame_rects.append(self._draw_text_box(win_text, padding=15, alpha=220))
+        
+        if self._needs_full_redraw:
+            pygame.display.flip()
+            self._needs_full_redraw = False
+        else:
+            # 只刷新上一帧和本帧绘制过的区域
+            pygame.display.update(self._dirty_rects + frame_rects)
+        self._dirty_rects = frame_rects
+    
+    def _perf_overlay_lines(self) -> List[str]:
+        """性能浮层的文本行，每0.25秒更新一次，避免每帧排序样本"""
+        now = time.time()
+        if self._perf_lines and now - self._perf_updated < 0.25:
+            return self._perf_lines
+        self._perf_updated = now
+        
+        frame = self.frame_times.summary()
+        draw = self.draw_times.summary()
+        chinese = getattr(self, 'use_chinese', True)
+        lines = [f"FPS: {self.clock.get_fps():.0f}"]
+        if frame["count"]:
+            lines.append(f"{'帧耗时' if chinese else 'Frame'} p50/p95/p99: "
+                         f"{frame['p50'] * 1000:.1f}/{frame['p95'] * 1000:.1f}/{frame['p99'] * 1000:.1f} ms")
+            lines.append(f"{'绘制' if chinese else 'Draw'} p50/p95: {draw['p50'] * 1000:.2f}/{draw['p95'] * 1000:.2f} ms")
+        
+        if self.ai_thinking:
+            age = f"{now - self._pending_since:.1f}s"
+        else:
+            age = "无" if chinese else "none"
+        lines.append(f"{'进行中的LLM请求' if chinese else 'In-flight LLM'}: {age}")
+        if self.llm_client:
+            decision = self.llm_client.latency_stats()
+            if decision["count"]:
+                lines.append(f"{'决策耗时' if chinese else 'Decision'} p50/p95: {decision['p50']:.2f}/{decision['p95']:.2f} s")
+        decisions = metrics.counters["decisions"]
+        if decisions:
+            tokens = metrics.counters["prompt_tokens"] + metrics.counters["completion_tokens"]
+            lines.append(f"{'token/步' if chinese else 'Tokens/step'}: {tokens / decisions:.0f}")
+        if self._profiler is not None:
+            lines.append(f"{'分析中，剩余' if chinese else 'Profiling, frames left'}: {self._profile_remaining}")
+        self._perf_lines = lines
+        return lines
+    
+    def _draw_perf_overlay(self, topleft: Tuple[int, int]) -> pygame.Rect:
+        """绘制多行性能浮层，返回占用的矩形区域"""
+        surfaces = [self.font_small.render(line, True, WHITE) for line in self._perf_overlay_lines()]
+        padding = 6
+        width = max(surface.get_width() for surface in surfaces) + padding * 2
+        height = sum(surface.get_height() for surface in surfaces) + padding * 2
+        bg_rect = pygame.Rect(topleft, (width, height)).clip(self.screen.get_rect())
+        
+        bg_surface = pygame.Surface(bg_rect.size)
+        bg_surface.set_alpha(200)
+        bg_surface.fill(BLACK)
+        self.screen.blit(bg_surface, bg_rect)
+        y = bg_rect.top + padding
+        for surface in surfaces:
+            self.screen.blit(surface, (bg_rect.left + padding, y))
+            y += surface.get_height()
+        return bg_rect
+    
+    def _update_profiler(self):
+        """按需开始或结束帧分析，分析结束时写入统计文件"""
+        if self._profile_remaining <= 0:
+            return
+        if self._profiler is None:
+            logger.info(f"⏱️  开始分析 {self._profile_remaining} 帧")
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+            return
+        self._profile_remaining -= 1
+        if self._profile_remaining == 0:
+            self._stop_profiler()
+    
+    def _stop_profiler(self):
+        """停止帧分析并写入统计文件"""
+        if self._profiler is None:
+            return
+        self._profiler.disable()
+        self._profiler.dump_stats(self.profile_output)
+        self._profiler = None
+        self._profile_remaining = 0
+        logger.info(f"⏱️  帧分析结果已写入 {self.profile_output}（python -m pstats {self.profile_output}）")
     
     def run(self):
         """运行游戏主循环"""
         while self.running:
+            self._update_profiler()
+            frame_start = time.perf_counter()
             self.handle_events()
-            if self.auto_mode:
-                self.handle_auto_move()
+            self._apply_pending_resize()
+            self._apply_pending_restart()
+            self.handle_auto_move()
+            draw_start = time.perf_counter()
             self.draw()
+            frame_end = time.perf_counter()
+            metrics.observe("draw", frame_end - draw_start)
+            self.draw_times.record(frame_end - draw_start)
+            self.frame_times.record(frame_end - frame_start)
             self.clock.tick(60)
         
+        # 提前退出时也写出已收集的分析结果
+        self._stop_profiler()
+        self._save_recording()
+        
+        # 不等待进行中的LLM请求（守护线程），直接退出
+        self._discard_pending_move()
+        if self.maze_pool is not None:
+            self.maze_pool.close()
         pygame.quit()
 
 
@@ -0,0 +1,127 @@
+"""迷宫预生成池：在后台进程中提前生成接下来要用的迷宫，重新开始或改变尺寸时直接换入，不阻塞游戏循环"""
+
+import multiprocessing
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from maze_engine import MazeGenerator, MazeGrid, new_seed
+
+MazeKey = Tuple[str, int, int, int]
+
+
+def _build_maze(algorithm: str, width: int, height: int, seed: int) -> Tuple[bytes, bytes]:
+    """在工作进程中生成迷宫并计算到终点的距离场，返回按位打包的布局和距离数组的字节"""
+    generator = MazeGenerator(width, height, algorithm, seed)
+    generator.generate()
+    distances = generator.compute_distances(width - 2, height - 2)
+    return generator.maze.pack(), distances.tobytes()
+
+
+class MazePool:
+    """
+    迷宫预生成池
+
+    递归回溯生成和距离场计算都是纯Python循环，大迷宫上需要几百毫秒甚至几秒；
+    默认在独立进程中运行，不与游戏循环争抢GIL。结果按（算法, 宽, 高, 种子）索引，
+    种子已知时（指定了 --seed 或使用语料）提前生成的正是接下来要用的迷宫，
+    否则预先随机选取种子。所有方法都只应在主线程中调用。
+    """
+
+    def __init__(self, size: int = 2, processes: bool = True):
+        """
+        Args:
+            size: 保持预生成的迷宫数
+            processes: 是否在独立进程中生成（False时使用后台线程）
+        """
+        self.size = size
+        self._executor: Executor
+        if processes:
+            # 使用 spawn 启动工作进程：游戏进程中已有pygame和LLM请求线程，fork 不安全
+            self._executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="maze-pool")
+        # 按提交顺序排列的预生成任务；_random 中的键是池自己选取的随机种子
+        self._pending: "OrderedDict[MazeKey, Future]" = OrderedDict()
+        self._random: List[MazeKey] = []
+
+    def _submit(self, key: MazeKey):
+        if key not in self._pending:
+            self._pending[key] = self._executor.submit(_build_maze, *key)
+
+    def _key(self, algorithm: str, width: int, height: int, seed: Optional[int]) -> Optional[MazeKey]:
+        """查找对应的预生成任务：seed为None时取最早提交的随机种子任务"""
+        if seed is not None:
+            key = (algorithm, width, height, seed)
+            return key if key in self._pending else None
+        for key in self._random:
+            if key[:3] == (algorithm, width, height):
+                return key
+        return None
+
+    def refill(self, algorithm: str, width: int, height: int, seeds: List[Optional[int]]):
+        """
+        保证接下来的迷宫都在生成或已生成，并取消不再需要的任务（如改变尺寸之前的迷宫）
+
+        Args:
+            seeds: 接下来依次要用的种子，None表示任意随机种子
+        """
+        wanted = {(algorithm, width, height, seed) for seed in seeds if seed is not None}
+        random_count = sum(1 for seed in seeds if seed is None)
+        random_keys = [key for key in self._random if key[:3] == (algorithm, width, height)][:random_count]
+        for key in list(self._pending):
+            if key not in wanted and key not in random_keys:
+                self._pending.pop(key).cancel()
+        self._random = random_keys
+
+        for key in sorted(wanted, key=lambda k: seeds.index(k[3])):
+            self._submit(key)
+        while len(self._random) < random_count:
+            key = (algorithm, width, height, new_seed())
+            self._submit(key)
+            self._random.append(key)
+
+    def pending(self, algorithm: str, width: int, height: int, seed: Optional[int] = None) -> bool:
+        """池中是否有对应的迷宫（正在生成或已生成完毕）"""
+        return self._key(algorithm, width, height, seed) is not None
+
+    def ready(self, algorithm: str, width: int, height: int, seed: Optional[int] = None) -> bool:
+        """对应的迷宫是否已经生成完毕"""
+        key = self._key(algorithm, width, height, seed)
+        return key is not None and self._pending[key].done()
+
+    def take(self, algorithm: str, width: int, height: int,
+             seed: Optional[int] = None) -> Optional[Tuple[MazeGenerator, array]]:
+        """
+        取出预生成的迷宫和距离场
+
+        池中没有对应的迷宫、任务仍在进行或生成失败时返回None，调用方应自行生成；不等待进行中的任务，
+        避免在工作进程繁忙时阻塞游戏循环。游戏窗口先用 ready() 等到迷宫生成完毕再调用。
+        """
+        key = self._key(algorithm, width, height, seed)
+        if key is None:
+            return None
+        future = self._pending.pop(key)
+        if key in self._random:
+            self._random.remove(key)
+        if not future.done():
+            # 调用方会自行生成这个迷宫，尚未开始的任务直接取消，已在生成的任务结果被丢弃
+            future.cancel()
+            return None
+        try:
+            layout, distance_bytes = future.result()
+        except Exception:
+            return None
+        generator = MazeGenerator.from_grid(MazeGrid.unpack(width, height, layout), algorithm, key[3])
+        distances = array("i")
+        distances.frombytes(distance_bytes)
+        return generator, distances
+
+    def close(self):
+        """取消尚未开始的任务并关闭工作进程（不等待正在生成的迷宫）"""
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        self._random = []
+        self._executor.shutdown(wait=False, cancel_futures=True)
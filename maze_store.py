@@ -0,0 +1,164 @@
+"""迷宫库：按 (算法, 宽, 高, 种子) 保存生成好的迷宫，并把一组迷宫保存为命名的语料，供重复运行和模型对比"""
+
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from maze_engine import MazeGenerator, MazeGrid
+
+MazeKey = Tuple[str, int, int, int]
+
+
+class MazeStore:
+    """
+    迷宫库
+
+    相同的算法、尺寸和种子总是生成相同的迷宫，迷宫库只是省去重复生成的时间：
+    内存中按LRU保留最近使用的网格；指定 db_path 时把网格按位打包（每格1位）写入SQLite，
+    重启后直接读取。语料（corpus）是一个有名字的迷宫列表，两次运行使用同一个语料时
+    面对的是完全相同的迷宫，结果可以直接比较。
+    """
+
+    def __init__(self, db_path: Optional[str] = None, max_entries: int = 256):
+        """
+        Args:
+            db_path: SQLite数据库文件路径，为None时只在内存中保存
+            max_entries: 内存中最多保留的迷宫数
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._grids: "OrderedDict[MazeKey, MazeGrid]" = OrderedDict()
+        self._corpora: Dict[str, List[Dict[str, object]]] = {}
+        # 批量评测和游戏的后台线程可能同时取迷宫，所有访问都需要加锁
+        self._lock = threading.Lock()
+
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS mazes (algorithm TEXT NOT NULL, width INTEGER NOT NULL, "
+                "height INTEGER NOT NULL, seed INTEGER NOT NULL, layout BLOB NOT NULL, "
+                "PRIMARY KEY (algorithm, width, height, seed))"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS corpus (name TEXT NOT NULL, position INTEGER NOT NULL, "
+                "algorithm TEXT NOT NULL, width INTEGER NOT NULL, height INTEGER NOT NULL, seed INTEGER NOT NULL, "
+                "PRIMARY KEY (name, position))"
+            )
+            self._db.commit()
+
+    def get(self, algorithm: str, width: int, height: int, seed: int) -> MazeGenerator:
+        """取出指定的迷宫，库中没有时生成并保存"""
+        key = (algorithm, width, height, seed)
+        with self._lock:
+            grid = self._grids.get(key)
+            if grid is not None:
+                self._grids.move_to_end(key)
+            elif self._db is not None:
+                row = self._db.execute(
+                    "SELECT layout FROM mazes WHERE algorithm = ? AND width = ? AND height = ? AND seed = ?", key
+                ).fetchone()
+                if row is not None:
+                    grid = MazeGrid.unpack(width, height, row[0])
+                    self._remember(key, grid)
+            if grid is not None:
+                self.hits += 1
+                return MazeGenerator.from_grid(grid, algorithm, seed)
+            self.misses += 1
+
+        # 生成不需要持有锁，其他线程可以同时取已有的迷宫
+        generator = MazeGenerator(width, height, algorithm, seed)
+        generator.generate()
+        self.put(generator)
+        return generator
+
+    def put(self, generator: MazeGenerator):
+        """保存在别处生成好的迷宫（如预生成池中的迷宫）"""
+        key = (generator.algorithm, generator.width, generator.height, generator.seed)
+        with self._lock:
+            self._remember(key, generator.maze)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO mazes (algorithm, width, height, seed, layout) VALUES (?, ?, ?, ?, ?)",
+                    key + (generator.maze.pack(),)
+                )
+                self._db.commit()
+
+    def _remember(self, key: MazeKey, grid: MazeGrid):
+        """写入内存LRU，超出容量时淘汰最久未使用的迷宫"""
+        self._grids[key] = grid
+        self._grids.move_to_end(key)
+        while len(self._grids) > self.max_entries:
+            self._grids.popitem(last=False)
+
+    def create_corpus(self, name: str, mazes: List[Dict[str, object]]):
+        """
+        保存（或覆盖）一个语料，并预先生成其中的迷宫
+
+        Args:
+            mazes: 迷宫列表，每项包含 algorithm、width、height、seed
+        """
+        mazes = [
+            {"algorithm": m["algorithm"], "width": m["width"], "height": m["height"], "seed": m["seed"]}
+            for m in mazes
+        ]
+        for m in mazes:
+            self.get(m["algorithm"], m["width"], m["height"], m["seed"])
+        with self._lock:
+            self._corpora[name] = mazes
+            if self._db is not None:
+                self._db.execute("DELETE FROM corpus WHERE name = ?", (name,))
+                self._db.executemany(
+                    "INSERT INTO corpus (name, position, algorithm, width, height, seed) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(name, i, m["algorithm"], m["width"], m["height"], m["seed"]) for i, m in enumerate(mazes)]
+                )
+                self._db.commit()
+
+    def corpus(self, name: str) -> Optional[List[Dict[str, object]]]:
+        """读取语料中的迷宫列表（按保存时的顺序），语料不存在时返回None"""
+        with self._lock:
+            mazes = self._corpora.get(name)
+            if mazes is None and self._db is not None:
+                rows = self._db.execute(
+                    "SELECT algorithm, width, height, seed FROM corpus WHERE name = ? ORDER BY position", (name,)
+                ).fetchall()
+                if rows:
+                    mazes = [{"algorithm": a, "width": w, "height": h, "seed": s} for a, w, h, s in rows]
+                    self._corpora[name] = mazes
+        return list(mazes) if mazes is not None else None
+
+    def corpus_names(self) -> List[str]:
+        """所有语料的名称"""
+        with self._lock:
+            names = set(self._corpora)
+            if self._db is not None:
+                names.update(row[0] for row in self._db.execute("SELECT DISTINCT name FROM corpus"))
+        return sorted(names)
+
+    def stats(self) -> dict:
+        """返回命中统计"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._grids),
+        }
+
+    def close(self):
+        """关闭SQLite连接"""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def build_corpus(count: int, sizes: List[Tuple[int, int]], algorithm: str = "backtracker",
+                 seed_start: int = 0) -> List[Dict[str, object]]:
+    """生成语料的迷宫列表：尺寸依次轮换，种子从 seed_start 开始递增"""
+    mazes = []
+    for i in range(count):
+        width, height = sizes[i % len(sizes)]
+        mazes.append({"algorithm": algorithm, "width": width, "height": height, "seed": seed_start + i})
+    return mazes
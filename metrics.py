@@ -0,0 +1,201 @@
+"""性能指标：分阶段耗时直方图和计数器，导出为 Prometheus 文本格式（文件或HTTP端点）和每回合CSV"""
+
+import csv
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+# 计时的阶段：序列化地图、构建提示词、API调用（含重试和对冲）、解析响应、执行移动、绘制画面
+PHASES = ("serialize", "prompt", "api", "parse", "move", "draw")
+
+# 计数器名称及说明
+COUNTERS = {
+    "decisions": "决策次数",
+    "api_calls": "LLM API 调用次数（包含重试和对冲）",
+    "cache_hits": "决策缓存命中次数",
+    "cache_bypasses": "检测到循环时绕过决策缓存的次数",
+    "parse_fallbacks": "JSON解析失败后从文本中提取坐标的次数",
+    "parse_failures": "无法解析LLM响应的次数",
+    "invalid_moves": "决策给出的位置不可达、改用回退策略的次数",
+    "prompt_tokens": "输入token数",
+    "cached_tokens": "命中提示词缓存的输入token数",
+    "completion_tokens": "输出token数",
+}
+
+# 耗时直方图的桶上界（秒）
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 每回合的CSV字段（除回合统计外）：各计数器和各阶段的累计耗时
+EPISODE_FIELDS = list(COUNTERS) + [f"time_{phase}" for phase in PHASES]
+
+# 当前回合的指标，由引擎在每个回合开始时设置，记录指标时同时累加到其中
+episode_metrics: ContextVar[Optional[dict]] = ContextVar("episode_metrics", default=None)
+
+
+class Metrics:
+    """
+    进程内的指标注册表
+
+    计数器和直方图的更新都很轻量（一次加锁和几次加法），可以在游戏循环、后台LLM线程和
+    异步任务中同时调用；导出时再统一格式化。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = dict.fromkeys(COUNTERS, 0)
+        # 每个阶段：各个桶的计数（非累计）、耗时总和、次数
+        self._buckets = {phase: [0] * (len(BUCKETS) + 1) for phase in PHASES}
+        self._sums = dict.fromkeys(PHASES, 0.0)
+        self._counts = dict.fromkeys(PHASES, 0)
+
+    def inc(self, name: str, value: float = 1):
+        """累加计数器"""
+        episode = episode_metrics.get()
+        with self._lock:
+            self.counters[name] += value
+            if episode is not None:
+                episode[name] = episode.get(name, 0) + value
+
+    def observe(self, phase: str, seconds: float):
+        """记录一次阶段耗时"""
+        index = bisect_left(BUCKETS, seconds)
+        episode = episode_metrics.get()
+        with self._lock:
+            self._buckets[phase][index] += 1
+            self._sums[phase] += seconds
+            self._counts[phase] += 1
+            if episode is not None:
+                key = f"time_{phase}"
+                episode[key] = episode.get(key, 0.0) + seconds
+
+    @contextmanager
+    def time(self, phase: str):
+        """统计代码块耗时的上下文管理器"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start_time)
+
+    def reset(self):
+        """清空所有指标"""
+        with self._lock:
+            self.counters = dict.fromkeys(COUNTERS, 0)
+            self._buckets = {phase: [0] * (len(BUCKETS) + 1) for phase in PHASES}
+            self._sums = dict.fromkeys(PHASES, 0.0)
+            self._counts = dict.fromkeys(PHASES, 0)
+
+    def phase_summary(self) -> Dict[str, Dict[str, float]]:
+        """各阶段的次数、总耗时和平均耗时"""
+        with self._lock:
+            return {
+                phase: {
+                    "count": self._counts[phase],
+                    "total": self._sums[phase],
+                    "mean": self._sums[phase] / self._counts[phase] if self._counts[phase] else 0.0,
+                }
+                for phase in PHASES
+            }
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        with self._lock:
+            counters = dict(self.counters)
+            buckets = {phase: list(counts) for phase, counts in self._buckets.items()}
+            sums = dict(self._sums)
+            counts = dict(self._counts)
+
+        lines = []
+        for name, help_text in COUNTERS.items():
+            lines.append(f"# HELP maze_{name}_total {help_text}")
+            lines.append(f"# TYPE maze_{name}_total counter")
+            lines.append(f"maze_{name}_total {counters[name]:g}")
+
+        lines.append("# HELP maze_phase_seconds 每个阶段的耗时（秒）")
+        lines.append("# TYPE maze_phase_seconds histogram")
+        for phase in PHASES:
+            cumulative = 0
+            for bound, count in zip(BUCKETS, buckets[phase]):
+                cumulative += count
+                lines.append(f'maze_phase_seconds_bucket{{phase="{phase}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'maze_phase_seconds_bucket{{phase="{phase}",le="+Inf"}} {counts[phase]}')
+            lines.append(f'maze_phase_seconds_sum{{phase="{phase}"}} {sums[phase]:.6f}')
+            lines.append(f'maze_phase_seconds_count{{phase="{phase}"}} {counts[phase]}')
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """写入 Prometheus 文本文件（先写临时文件再替换，采集方不会读到一半的内容）"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """在后台线程中启动 /metrics HTTP 端点，返回服务器对象（调用 shutdown() 停止）"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+
+# 进程内共享的指标注册表
+metrics = Metrics()
+
+
+def write_episode_csv(path: str, results: List[Dict[str, Any]]):
+    """
+    将每个回合的统计和指标写入CSV
+
+    Args:
+        results: run_episode 返回的回合统计列表，指标位于每项的 metrics 字段
+    """
+    fields = ["episode", "seed", "won", "steps", "errors", "elapsed"] + EPISODE_FIELDS
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        for index, result in enumerate(results):
+            row = {"episode": index, **result, **dict.fromkeys(EPISODE_FIELDS, 0), **result.get("metrics", {})}
+            for key in ["elapsed"] + [f"time_{phase}" for phase in PHASES]:
+                row[key] = f"{row[key]:.6f}"
+            writer.writerow(row)
+
+
+def print_latency_stats(llm_client):
+    """输出每步LLM决策耗时的分位数以及重试、对冲次数（llm_client 为 LLMClient 或 AsyncLLMClient）"""
+    stats = llm_client.latency_stats()
+    if not stats["count"]:
+        return
+    print(f"LLM决策耗时: p50 {stats['p50']:.3f}s, p95 {stats['p95']:.3f}s, p99 {stats['p99']:.3f}s "
+          f"(重试 {stats['retries']} 次, 对冲 {stats['hedges']} 次, 对冲胜出 {stats['hedge_wins']} 次, "
+          f"失败 {stats['failures']} 次)")
+    if stats["early_stops"]:
+        print(f"流式响应提前结束: {stats['early_stops']} 次")
+
+
+def print_phase_stats():
+    """输出各阶段的平均耗时"""
+    phases = [(phase, stats) for phase, stats in metrics.phase_summary().items() if stats["count"]]
+    if phases:
+        print("分阶段平均耗时: " + ", ".join(f"{phase} {stats['mean'] * 1000:.3f}ms" for phase, stats in phases))
@@ -0,0 +1,549 @@
+"""本地 OpenAI 兼容模拟服务：实现聊天补全接口，按可配置的策略、延迟和错误分布返回迷宫决策，用于离线压测"""
+
+import re
+import json
+import math
+import time
+import random
+import argparse
+import sys
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+DIRECTION_DELTAS = {"UP": (0, -1), "DOWN": (0, 1), "LEFT": (-1, 0), "RIGHT": (1, 0)}
+
+_POS_RE = {
+    "current": re.compile(r"当前位置: \((\d+), (\d+)\)"),
+    "target": re.compile(r"目标位置: \((\d+), (\d+)\)"),
+}
+_DIRECTIONS_RE = re.compile(r"可用移动方向（可通行的方向）: ([A-Z, ]*)")
+_UNVISITED_RE = re.compile(r"\((\d+), (\d+)\) ✅")
+_MAX_MOVES_RE = re.compile(r"接下来最多(\d+)步")
+_MAP_ROW_RE = re.compile(r"^[W.G]+$", re.MULTILINE)
+_WINDOW_RE = re.compile(r"左上角坐标: \((-?\d+), (-?\d+)\)[^\n]*\n((?:[W.oPG]+\n?)+)")
+_FRONTIER_RE = re.compile(r"已探索边界（[^）]*）: (.*)")
+_COORD_RE = re.compile(r"\((-?\d+), (-?\d+)\)")
+
+POLICIES = ("random", "optimal", "malformed")
+
+# 故意构造的错误响应，覆盖客户端的各种解析回退路径
+MALFORMED_REPLIES = (
+    "我觉得应该往右走",
+    '{"x": 3, "y":',
+    '```json\n{"col": 1, "row": 2}\n```',
+    "",
+    "下一步: x=abc",
+)
+
+# 模拟模型在JSON之后附加的解释文字
+TRAILING_EXPLANATION = "选择这个位置是因为它没有被访问过，并且沿通道离目标更近。"
+
+# 流式响应中每个片段的字符数（大约一个token）
+STREAM_PIECE_CHARS = 4
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认的监听队列只有5，并发压测时多余的连接会被丢弃并等待重传
+    request_queue_size = 256
+
+    def handle_error(self, request, client_address):
+        # 客户端超时或取消对冲请求后会提前断开连接，这是压测中的正常情况
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class MazeOracle:
+    """从请求的提示词中还原迷宫，并按策略选择下一步"""
+
+    def __init__(self, policy: str, rng: random.Random):
+        self.policy = policy
+        self.rng = rng
+        # 同一迷宫的距离场只计算一次（键为地图文本）
+        self._distance_fields: Dict[str, Dict[Tuple[int, int], int]] = {}
+        self._lock = threading.Lock()
+
+    def _distance_field(self, map_rows: List[str]) -> Dict[Tuple[int, int], int]:
+        """以目标为起点BFS，得到每个通道格子到目标的距离"""
+        key = "\n".join(map_rows)
+        with self._lock:
+            field = self._distance_fields.get(key)
+        if field is not None:
+            return field
+
+        goal = next((x, y) for y, row in enumerate(map_rows) for x, ch in enumerate(row) if ch == "G")
+        field = {goal: 0}
+        queue = deque([goal])
+        while queue:
+            x, y = queue.popleft()
+            for dx, dy in DIRECTION_DELTAS.values():
+                nx, ny = x + dx, y + dy
+                if (nx, ny) not in field and 0 <= ny < len(map_rows) and 0 <= nx < len(map_rows[ny]) \
+                        and map_rows[ny][nx] != "W":
+                    field[(nx, ny)] = field[(x, y)] + 1
+                    queue.append((nx, ny))
+
+        with self._lock:
+            if len(self._distance_fields) >= 64:
+                self._distance_fields.clear()
+            self._distance_fields[key] = field
+        return field
+
+    def choose_path(self, map_text: str, prompt: str, max_moves: int) -> List[Tuple[int, int]]:
+        """
+        选择接下来最多 max_moves 步的路径
+
+        optimal 策略在提示词带有完整地图时沿最短路径前进；
+        只有局部视野时见 _explore_step。
+        """
+        current = tuple(int(v) for v in _POS_RE["current"].search(prompt).groups())
+        target = tuple(int(v) for v in _POS_RE["target"].search(prompt).groups())
+        directions_match = _DIRECTIONS_RE.search(prompt)
+        directions = [d.strip() for d in directions_match.group(1).split(",") if d.strip()] if directions_match else []
+        first_steps = [(current[0] + DIRECTION_DELTAS[d][0], current[1] + DIRECTION_DELTAS[d][1])
+                       for d in directions if d in DIRECTION_DELTAS]
+        if not first_steps:
+            return [current]
+
+        if self.policy == "random":
+            return [self.rng.choice(first_steps)]
+
+        map_rows = _MAP_ROW_RE.findall(map_text)
+        if not map_rows or not any("G" in row for row in map_rows):
+            return [self._explore_step(prompt, current, target, first_steps)]
+
+        field = self._distance_field(map_rows)
+        path = []
+        pos = current
+        for _ in range(max_moves):
+            if field.get(pos) == 0:
+                break
+            neighbours = [(pos[0] + dx, pos[1] + dy) for dx, dy in DIRECTION_DELTAS.values()]
+            pos = min((p for p in neighbours if p in field), key=field.get, default=None)
+            if pos is None:
+                break
+            path.append(pos)
+        return path or [first_steps[0]]
+
+    def _explore_step(self, prompt: str, current: Tuple[int, int], target: Tuple[int, int],
+                      first_steps: List[Tuple[int, int]]) -> Tuple[int, int]:
+        """
+        只有局部视野时的下一步
+
+        优先选择未访问的相邻位置（离目标近的优先）；相邻位置都已访问时，在局部地图中沿通道
+        走向最近的目标或未访问格子，局部地图中没有时走向提示词列出的最近的已探索边界。
+        距离相同时用服务的随机数打破平局，不会在两个已访问的格子之间来回移动。
+        """
+        def manhattan(p: Tuple[int, int], goal: Tuple[int, int]) -> int:
+            return abs(p[0] - goal[0]) + abs(p[1] - goal[1])
+
+        def pick(candidates: List[Tuple[int, int]], goal: Tuple[int, int]) -> Tuple[int, int]:
+            best = min(manhattan(p, goal) for p in candidates)
+            return self.rng.choice([p for p in candidates if manhattan(p, goal) == best])
+
+        unvisited = {(int(x), int(y)) for x, y in _UNVISITED_RE.findall(prompt)}
+        fresh = [p for p in first_steps if p in unvisited]
+        if fresh:
+            return pick(fresh, target)
+
+        window = _WINDOW_RE.search(prompt)
+        if window:
+            left, top = int(window.group(1)), int(window.group(2))
+            rows = window.group(3).split()
+            cells = {(left + x, top + y): ch for y, row in enumerate(rows) for x, ch in enumerate(row)}
+            # 在局部地图内BFS，记录每个格子是从哪一个第一步到达的
+            first = {p: p for p in first_steps if cells.get(p, "W") != "W"}
+            queue = deque(first)
+            seen = set(first) | {current}
+            while queue:
+                pos = queue.popleft()
+                if cells[pos] in ".G":
+                    return first[pos]
+                for dx, dy in DIRECTION_DELTAS.values():
+                    nxt = (pos[0] + dx, pos[1] + dy)
+                    if nxt not in seen and cells.get(nxt, "W") != "W":
+                        seen.add(nxt)
+                        first[nxt] = first[pos]
+                        queue.append(nxt)
+
+        frontier_match = _FRONTIER_RE.search(prompt)
+        frontier = [(int(x), int(y)) for x, y in _COORD_RE.findall(frontier_match.group(1))] if frontier_match else []
+        frontier = [p for p in frontier if p != current]
+        goal = min(frontier, key=lambda p: manhattan(p, current)) if frontier else target
+        return pick(first_steps, goal)
+
+
+class MockLLMServer:
+    """
+    OpenAI 兼容的本地模拟服务
+
+    实现 POST .../chat/completions：从提示词中解析迷宫、当前位置和可用方向，
+    按策略返回 {"x", "y"}（规划模式的请求返回 {"path": [...]}）。
+    延迟服从对数正态分布，可以按比例注入 500/429 错误、挂起请求和格式错误的回复。
+    token 数按字符数粗略估算，同一前缀（系统提示词 + 地图）第二次出现时计为缓存命中。
+
+    可以在进程内使用：
+
+        with MockLLMServer(policy="optimal", latency_ms=200) as server:
+            client = LLMClient(api_key="test", base_url=server.base_url)
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        policy: str = "optimal",
+        latency_ms: float = 0.0,
+        latency_sigma: float = 0.5,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        hang_rate: float = 0.0,
+        hang_seconds: float = 30.0,
+        malformed_rate: float = 0.0,
+        token_ms: float = 0.0,
+        trailing_tokens: int = 0,
+        seed: Optional[int] = None
+    ):
+        """
+        初始化模拟服务
+
+        Args:
+            host: 监听地址
+            port: 监听端口，0表示自动分配
+            policy: 决策策略：random（随机可通行方向）、optimal（最短路径）或 malformed（总是返回错误格式）
+            latency_ms: 延迟的中位数（毫秒）
+            latency_sigma: 对数正态分布的形状参数，越大长尾越明显，0表示固定延迟
+            error_rate: 返回 500 错误的比例
+            rate_limit_rate: 返回 429 错误的比例
+            hang_rate: 挂起 hang_seconds 秒后才回复的比例（用于测试客户端超时）
+            hang_seconds: 挂起的时长
+            malformed_rate: 返回格式错误回复的比例
+            token_ms: 每个输出片段（约一个token）的生成时间（毫秒），延迟之后按回复长度额外等待
+            trailing_tokens: 在决策JSON之后附加约多少个token的解释文字，模拟啰嗦的模型
+            seed: 随机种子，固定后延迟、错误和随机策略都可以复现
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"未知的策略: {policy}，可选: {', '.join(POLICIES)}")
+        self.policy = policy
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.malformed_rate = malformed_rate
+        self.token_ms = token_ms
+        self.trailing_tokens = trailing_tokens
+        self.rng = random.Random(seed)
+        self.oracle = MazeOracle(policy, self.rng)
+        self.stats = {"requests": 0, "errors": 0, "malformed": 0}
+        self._seen_prefixes = set()
+        self._lock = threading.Lock()
+
+        self.httpd = _HTTPServer((host, port), self._make_handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        """供 OPENAI_BASE_URL 使用的地址"""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # 保持长连接，和真实服务一样让客户端复用连接池；
+            # 响应头和响应体分两次写出，不关闭Nagle算法时会与延迟确认叠加出约40ms的额外延迟
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except json.JSONDecodeError:
+                    self._send_json(400, {"error": {"message": "invalid JSON body", "type": "invalid_request_error"}})
+                    return
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": f"unknown path {self.path}", "type": "invalid_request_error"}})
+                    return
+                status, payload = server.handle_completion(body)
+                if status == 200 and body.get("stream"):
+                    include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+                    self._send_stream(server.stream_chunks(payload, include_usage))
+                else:
+                    self._send_json(status, payload)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._send_json(200, {"object": "list", "data": [{"id": "mock-maze", "object": "model"}]})
+                else:
+                    self._send_json(404, {"error": {"message": f"unknown path {self.path}", "type": "invalid_request_error"}})
+
+            def _send_json(self, status: int, payload: dict):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, chunks):
+                # 分块传输编码的 server-sent events，连接可以继续复用
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for chunk in chunks:
+                    self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self._write_chunk(b"data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _write_chunk(self, data: bytes):
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+
+            def log_message(self, format, *args):
+                # 压测时每个请求都打印会严重拖慢服务
+                pass
+
+        return Handler
+
+    def _draw(self) -> Tuple[float, float, float, float, float]:
+        """加锁抽取本次请求用到的所有随机数，保证多线程下按种子可复现"""
+        with self._lock:
+            return tuple(self.rng.random() for _ in range(4)) + (self.rng.gauss(0.0, 1.0),)
+
+    def _sleep_latency(self, hang: bool, noise: float):
+        """按对数正态分布模拟延迟"""
+        if hang:
+            time.sleep(self.hang_seconds)
+        elif self.latency_ms > 0:
+            time.sleep(self.latency_ms * math.exp(self.latency_sigma * noise) / 1000.0)
+
+    def handle_completion(self, body: dict) -> Tuple[int, dict]:
+        """处理一次聊天补全请求，返回 (HTTP状态码, 响应JSON)"""
+        error_roll, limit_roll, hang_roll, malformed_roll, noise = self._draw()
+        with self._lock:
+            self.stats["requests"] += 1
+        self._sleep_latency(hang_roll < self.hang_rate, noise)
+
+        if error_roll < self.error_rate:
+            with self._lock:
+                self.stats["errors"] += 1
+            return 500, {"error": {"message": "mock server error", "type": "server_error"}}
+        if limit_roll < self.rate_limit_rate:
+            with self._lock:
+                self.stats["errors"] += 1
+            return 429, {"error": {"message": "mock rate limit", "type": "rate_limit_error"}}
+
+        messages = body.get("messages", [])
+        prompt = messages[-1]["content"] if messages else ""
+        map_text = "\n".join(m["content"] for m in messages[:-1])
+        if self.policy == "malformed" or malformed_roll < self.malformed_rate:
+            with self._lock:
+                self.stats["malformed"] += 1
+                content = self.rng.choice(MALFORMED_REPLIES)
+        else:
+            content = self._decide(map_text, prompt, _output_schema_keys(body))
+            # 结构化输出的回复只有JSON本身
+            if self.trailing_tokens > 0 and not _output_schema_keys(body):
+                repeats = self.trailing_tokens // len(TRAILING_EXPLANATION) + 1
+                content += "\n\n" + (TRAILING_EXPLANATION * repeats)[:self.trailing_tokens]
+
+        # 流式响应在发送每个片段时等待生成时间
+        if not body.get("stream") and self.token_ms > 0:
+            time.sleep(len(_split_pieces(content)) * self.token_ms / 1000.0)
+        payload = self._completion_payload(body.get("model", "mock-maze"), messages, content)
+        if body.get("tools"):
+            # 强制的工具调用：决策放在工具调用的参数中
+            tool_name = body["tools"][0]["function"]["name"]
+            payload["choices"][0]["message"] = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": f"call_{payload['id']}",
+                    "type": "function",
+                    "function": {"name": tool_name, "arguments": content},
+                }],
+            }
+            payload["choices"][0]["finish_reason"] = "tool_calls"
+        return 200, payload
+
+    def stream_chunks(self, payload: dict, include_usage: bool):
+        """把完整的响应拆成 chat.completion.chunk 片段，按 token_ms 逐个生成"""
+        base = {"id": payload["id"], "object": "chat.completion.chunk",
+                "created": payload["created"], "model": payload["model"]}
+        message = payload["choices"][0]["message"]
+        tool_call = message["tool_calls"][0] if message.get("tool_calls") else None
+        content = tool_call["function"]["arguments"] if tool_call else message["content"]
+        for i, piece in enumerate(_split_pieces(content)):
+            if self.token_ms > 0:
+                time.sleep(self.token_ms / 1000.0)
+            if tool_call:
+                call_delta = {"index": 0, "function": {"arguments": piece}}
+                if i == 0:
+                    call_delta.update(id=tool_call["id"], type="function")
+                    call_delta["function"]["name"] = tool_call["function"]["name"]
+                delta = {"tool_calls": [call_delta]}
+            else:
+                delta = {"content": piece}
+            if i == 0:
+                delta["role"] = "assistant"
+            yield {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+        finish_reason = payload["choices"][0]["finish_reason"]
+        yield {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]}
+        if include_usage:
+            yield {**base, "choices": [], "usage": payload["usage"]}
+
+    def _decide(self, map_text: str, prompt: str, schema_keys: List[str]) -> str:
+        """
+        按策略生成回复文本
+
+        规划模式的请求返回路径；请求带有结构化输出的 schema（或工具参数）时，
+        按其中的字段返回方向枚举 {"direction": ...} 或方向序列 {"moves": [...]}。
+        """
+        max_moves_match = _MAX_MOVES_RE.search(prompt)
+        try:
+            current = tuple(int(v) for v in _POS_RE["current"].search(prompt).groups())
+            max_moves = int(max_moves_match.group(1)) if max_moves_match else 1
+            path = self.oracle.choose_path(map_text, prompt, max_moves)
+        except AttributeError:
+            # 提示词中找不到位置信息，不是迷宫游戏发来的请求
+            return "无法从提示词中解析当前位置"
+
+        directions = []
+        for x, y in path:
+            step = (x - current[0], y - current[1])
+            directions.extend(d for d, delta in DIRECTION_DELTAS.items() if delta == step)
+            current = (x, y)
+        if "moves" in schema_keys:
+            return json.dumps({"moves": directions})
+        if "direction" in schema_keys:
+            return json.dumps({"direction": directions[0] if directions else "UP"})
+        if max_moves_match:
+            return json.dumps({"path": [{"x": x, "y": y} for x, y in path]})
+        x, y = path[0]
+        return json.dumps({"x": x, "y": y})
+
+    def _completion_payload(self, model: str, messages: List[dict], content: str) -> dict:
+        """构造 chat.completion 响应，token 数按字符数粗略估算"""
+        prefix = "".join(m["content"] for m in messages[:-1])
+        prompt_tokens = sum(_estimate_tokens(m["content"]) for m in messages)
+        with self._lock:
+            cached = prefix in self._seen_prefixes
+            self._seen_prefixes.add(prefix)
+        cached_tokens = _estimate_tokens(prefix) if cached else 0
+        completion_tokens = _estimate_tokens(content)
+        return {
+            "id": f"chatcmpl-mock-{time.time_ns()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        }
+
+    def start(self) -> "MockLLMServer":
+        """在后台线程中启动服务"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止服务"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "MockLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _output_schema_keys(body: dict) -> List[str]:
+    """请求中约束输出格式的 schema 的字段名（结构化输出或工具参数），没有时返回空列表"""
+    schema = None
+    if body.get("tools"):
+        schema = body["tools"][0].get("function", {}).get("parameters")
+    elif (body.get("response_format") or {}).get("type") == "json_schema":
+        schema = body["response_format"].get("json_schema", {}).get("schema")
+    return list((schema or {}).get("properties", {}))
+
+
+def _split_pieces(text: str) -> List[str]:
+    """把回复文本切成大约一个token的片段"""
+    return [text[i:i + STREAM_PIECE_CHARS] for i in range(0, len(text), STREAM_PIECE_CHARS)] or [""]
+
+
+def _estimate_tokens(text: str) -> int:
+    """粗略估算token数：ASCII约4个字符一个token，中文约一个字一个token"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容模拟服务，用于离线压测迷宫 AI")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8000, help="监听端口")
+    parser.add_argument("--policy", choices=POLICIES, default="optimal",
+                        help="决策策略：random（随机）、optimal（最短路径）或 malformed（错误格式）")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="延迟中位数（毫秒）")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="延迟对数正态分布的形状参数，越大长尾越明显")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 错误的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 错误的比例")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="挂起请求的比例")
+    parser.add_argument("--hang-seconds", type=float, default=30.0, help="挂起的时长（秒）")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="返回格式错误回复的比例")
+    parser.add_argument("--token-ms", type=float, default=0.0, help="每个输出token的生成时间（毫秒）")
+    parser.add_argument("--trailing-tokens", type=int, default=0, help="在决策JSON之后附加的解释文字长度（token数）")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    return parser.parse_args()
+
+
+def main():
+    """主函数"""
+    args = parse_args()
+    server = MockLLMServer(
+        host=args.host,
+        port=args.port,
+        policy=args.policy,
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        hang_rate=args.hang_rate,
+        hang_seconds=args.hang_seconds,
+        malformed_rate=args.malformed_rate,
+        token_ms=args.token_ms,
+        trailing_tokens=args.trailing_tokens,
+        seed=args.seed
+    )
+    print(f"🧪 模拟LLM服务已启动: {server.base_url} (策略: {args.policy})")
+    print(f"   设置 OPENAI_BASE_URL={server.base_url} 即可让游戏使用该服务")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(f"📊 共处理 {server.stats['requests']} 个请求, 错误 {server.stats['errors']} 个, "
+              f"格式错误 {server.stats['malformed']} 个")
+
+
+if __name__ == "__main__":
+    main()
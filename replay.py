@@ -0,0 +1,136 @@
+"""回合回放：读取 --record 录制的回合文件，在终端或游戏窗口中逐步重现"""
+
+import sys
+import time
+import argparse
+from typing import Any, Dict, List
+from episode_record import EpisodeRecording
+
+
+def format_decision(decision: Dict[str, Any]) -> str:
+    """把一个决策的元数据格式化为一行"""
+    parts = [f"选择 {decision.get('choice')}", f"来源 {decision.get('source', '?')}"]
+    if not decision.get("moved"):
+        parts.append("未移动")
+    for key in ("parse", "latency", "prompt_tokens", "completion_tokens", "usage_estimated", "retries", "hedges",
+                "fallback", "error", "stale"):
+        if key in decision:
+            value = decision[key]
+            parts.append(f"{key} {value:.3f}s" if key == "latency" else f"{key} {value}")
+    return ", ".join(parts)
+
+
+def print_summary(recording: EpisodeRecording):
+    """输出回合概要"""
+    result = recording.result
+    print(f"迷宫 {recording.width}x{recording.height} ({recording.header.get('algorithm')}, "
+          f"种子 {recording.header.get('seed')}), "
+          f"起点 {recording.start}, 终点 {recording.goal}")
+    print(f"移动 {recording.steps} 步, 决策 {len(recording.decisions)} 次, "
+          f"结果: {'成功' if result.get('won') else '未完成'}")
+    if "llm_calls" in result:
+        print(f"LLM调用 {result['llm_calls']} 次, 出错 {result.get('errors', 0)} 次")
+
+
+def print_step(recording: EpisodeRecording, step: int):
+    """输出第 step 步的地图和产生该步的决策"""
+    print(f"\n第 {step}/{recording.steps} 步, 位置 {recording.positions[step]}")
+    print(recording.render_text(step))
+    for decision in recording.decisions_by_step.get(step, []):
+        print(f"  {format_decision(decision)}")
+
+
+def play_text(recording: EpisodeRecording, start: int, speed: float):
+    """在终端中从 start 步开始依次输出每一步，speed 为每秒步数（0表示不等待）"""
+    for step in range(start, recording.steps + 1):
+        print_step(recording, step)
+        if speed > 0:
+            time.sleep(1 / speed)
+
+
+def play_gui(recording: EpisodeRecording, start: int, speed: float):
+    """
+    在游戏窗口中回放
+
+    空格暂停/继续，←/→ 单步后退/前进，↑/↓ 调整速度，Home/End 跳到开头/结尾，Esc 退出。
+    """
+    import pygame
+    from maze_game import MazeGame
+
+    # 直接使用录制的迷宫（起点和终点也取自录制），不生成新迷宫
+    game = MazeGame(maze=recording.maze_generator())
+    pygame.display.set_caption("迷宫回放 - 空格暂停，←/→ 单步，↑/↓ 调速，Home/End 跳转")
+
+    step = start
+    speed = speed or 10.0
+    playing = True
+    last_advance = time.perf_counter()
+    while game.running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                game.running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    game.running = False
+                elif event.key == pygame.K_SPACE:
+                    playing = not playing
+                elif event.key == pygame.K_RIGHT:
+                    step, playing = min(step + 1, recording.steps), False
+                elif event.key == pygame.K_LEFT:
+                    step, playing = max(step - 1, 0), False
+                elif event.key == pygame.K_UP:
+                    speed *= 2
+                elif event.key == pygame.K_DOWN:
+                    speed = max(speed / 2, 0.5)
+                elif event.key == pygame.K_HOME:
+                    step = 0
+                elif event.key == pygame.K_END:
+                    step = recording.steps
+
+        now = time.perf_counter()
+        if playing and step < recording.steps and now - last_advance >= 1 / speed:
+            step += 1
+            last_advance = now
+
+        game.player.x, game.player.y = recording.positions[step]
+        game.step_count = step
+        game.won = step == recording.steps and bool(recording.result.get("won"))
+        game.draw()
+        game.clock.tick(60)
+    pygame.quit()
+
+
+def parse_args(argv: List[str] = None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="回放 --record 录制的迷宫回合")
+    parser.add_argument("file", help="回合录制文件（.jsonl.gz）")
+    parser.add_argument("--step", type=int, default=None, help="输出第N步的地图和决策（默认最后一步）")
+    parser.add_argument("--play", action="store_true", help="从 --step（默认第0步）开始依次输出每一步")
+    parser.add_argument("--speed", type=float, default=0.0, help="回放速度（步/秒），0表示不等待（窗口模式默认10）")
+    parser.add_argument("--gui", action="store_true", help="在游戏窗口中回放")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None):
+    """主函数"""
+    args = parse_args(argv)
+    try:
+        recording = EpisodeRecording.load(args.file)
+    except (OSError, ValueError) as e:
+        print(f"错误: 无法读取回合录制文件 {args.file}: {e}")
+        sys.exit(1)
+
+    print_summary(recording)
+    # 超出范围的 --step 截断到 [0, 总步数]；回放默认从第0步开始，单步输出默认最后一步
+    default = 0 if args.gui or args.play else recording.steps
+    step = default if args.step is None else min(max(args.step, 0), recording.steps)
+    if args.gui:
+        play_gui(recording, step, args.speed)
+    elif args.play:
+        play_text(recording, step, args.speed)
+    else:
+        print_step(recording, step)
+
+
+if __name__ == "__main__":
+    main()